@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Cost of reloading a tree from the binary format.
+
+Compares parsing a generated config with the fast engine (and pyparsing
+with --pyparsing), unpickling the parsed tree and load_binary() of a file
+written by dump_binary(), printing load time and size, and checks the
+reloaded trees dump the same.
+
+    python benchmarks/binary.py [--directives 100000] [--pyparsing]
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+
+from nginxparser.nginxparser import UnspacedList, dump_binary, dumps, load_binary, loads
+
+from dump import config
+
+
+def timed(func):
+    start = time.perf_counter()
+    res = func()
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directives", type=int, default=100000)
+    parser.add_argument(
+        "--pyparsing", action="store_true", help="Time the pyparsing engine too"
+    )
+    ns = parser.parse_args()
+
+    source = config(ns.directives)
+    tree = loads(source, engine="fast")
+    expected = dumps(tree)
+    # UnspacedList does not unpickle, so its spaced lists are pickled
+    pickled = pickle.dumps(tree.spaced, protocol=pickle.HIGHEST_PROTOCOL)
+    with tempfile.NamedTemporaryFile(suffix=".ngxb", delete=False) as f:
+        dump_binary(tree, f)
+    try:
+
+        def binary():
+            with open(f.name, "rb") as binary_file:
+                return load_binary(binary_file)
+
+        loaders = [
+            ("loads fast", len(source.encode()), lambda: loads(source, engine="fast")),
+            ("pickle", len(pickled), lambda: UnspacedList.adopt(pickle.loads(pickled))),
+            ("load_binary", os.path.getsize(f.name), binary),
+        ]
+        if ns.pyparsing:
+            loaders.insert(
+                0, ("loads pyparsing", len(source.encode()), lambda: loads(source))
+            )
+        for name, size, func in loaders:
+            loaded, elapsed = timed(func)
+            assert dumps(loaded) == expected, name
+            print("%-16s %8.3f s %10.1f KiB" % (name, elapsed, size / 1024.0))
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Memory held by a parsed tree, with and without compact mode.
+
+Parses a generated config into an UnspacedList, a PersistentList and a
+compact PersistentList (loads(..., compact=True): interned strings and
+hash-consed subtrees), measuring with tracemalloc the memory each tree
+keeps alive once built, and checks they all dump the same.
+
+    python benchmarks/compact.py [--directives 100000]
+"""
+import argparse
+import time
+import tracemalloc
+
+from nginxparser.nginxparser import dumps, loads
+from nginxparser.persistent import PersistentList
+
+from dump import config
+
+
+def count_directives(rows):
+    """Returns the number of directives and blocks in an unspaced tree"""
+    count = 0
+    todo = [rows]
+    while todo:
+        for row in todo.pop():
+            count += 1
+            if row and not isinstance(row[0], str):
+                todo.append(row[1])
+    return count
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    tree = func()
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return tree, elapsed, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directives", type=int, default=100000)
+    ns = parser.parse_args()
+
+    source = config(ns.directives)
+    expected = None
+    for name, func in (
+        ("unspaced", lambda: loads(source, engine="fast")),
+        (
+            "persistent",
+            lambda: PersistentList.from_unspaced(loads(source, engine="fast")),
+        ),
+        ("compact", lambda: loads(source, engine="fast", compact=True)),
+    ):
+        tree, elapsed, held = measure(func)
+        if expected is None:
+            expected = dumps(tree)
+            directives = count_directives(tree)
+        assert dumps(tree) == expected, name
+        print(
+            "%-10s %8.3f s %10.1f MiB %8.1f bytes/directive"
+            % (name, elapsed, held / 2.0**20, held / float(directives))
+        )
+        del tree
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Diffing two versions of a huge config.
+
+Generates a config of --servers servers, changes the proxy_pass of one
+location and compares the two trees: with ==, with a line diff of their
+dumps, and with diff() on plain trees and on compact trees sharing an
+Interner, whose fingerprints are kept once computed.  Prints the times and
+checks diff() finds the one change.
+
+    python benchmarks/diff.py [--servers 5000]
+"""
+import argparse
+import collections
+import time
+
+from nginxparser.diff import diff
+from nginxparser.nginxparser import dumps, loads
+from nginxparser.persistent import Interner
+
+from generator import generate
+
+
+def proxy_pass_path(tree, server):
+    """Returns the path of the first proxy_pass of server number server"""
+    http = len(tree) - 1
+    servers = [i for i, block in enumerate(tree[http][1]) if block[0] == ["server"]]
+    block = tree[http][1][servers[server]]
+    for i, location in enumerate(block[1]):
+        if isinstance(location[0], list):
+            for j, row in enumerate(location[1]):
+                if row[0] == "proxy_pass":
+                    return [http, 1, servers[server], 1, i, 1, j, 1]
+    raise ValueError("no proxy_pass in server %d" % server)
+
+
+def changed_lines(before, after):
+    """Lines removed plus lines added, wherever they are"""
+    before = collections.Counter(before.splitlines())
+    after = collections.Counter(after.splitlines())
+    return sum((before - after).values()) + sum((after - before).values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    ns = parser.parse_args()
+
+    text = generate(ns.servers, map_entries=100)
+    print("%d servers, %.1f MiB" % (ns.servers, len(text) / 2.0**20))
+    old = loads(text, engine="fast")
+    new = loads(text, engine="fast")
+    path = proxy_pass_path(new, ns.servers // 2)
+    row = new
+    for i in path[:-1]:
+        row = row[i]
+    row[path[-1]] = "http://changed"
+    interner = Interner()
+    old_compact = loads(text, engine="fast", compact=interner)
+    new_compact = old_compact.set_in(path, "http://changed")
+
+    for name, run in (
+        ("==", lambda: old == new),
+        ("dumps lines", lambda: changed_lines(dumps(old), dumps(new))),
+        ("diff", lambda: diff(old, new)),
+        ("diff compact", lambda: diff(old_compact, new_compact)),
+    ):
+        best = None
+        for _ in range(ns.repeat):
+            start = time.perf_counter()
+            res = run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("%-14s %8.3f s" % (name, best))
+        if name.startswith("diff"):
+            assert len(res) == 1 and res[0].name == "proxy_pass", res
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Compare NginxDumper with the former copying implementation.
+
+Dumps a generated config of about 100k directives with both dumpers,
+checks that the output is identical and prints time and peak memory.
+
+    python benchmarks/dump.py [--directives 100000]
+"""
+import argparse
+import copy
+import io
+import time
+import tracemalloc
+
+from nginxparser.nginxparser import NginxDumper, loads, spacey
+
+
+class LegacyNginxDumper(NginxDumper):
+    """The recursive dumper deep-copying every block, kept for comparison"""
+
+    def __iter__(self, blocks=None):
+        blocks = blocks or self.blocks
+        for b0 in blocks:
+            if isinstance(b0, str):
+                yield b0
+                continue
+            b = copy.deepcopy(b0)
+            if spacey(b[0]):
+                yield b.pop(0)
+                if not b:
+                    continue
+            key, values = b.pop(0), b.pop(0)
+            if isinstance(key, list):
+                yield " ".join(key) + " {"
+                for parameter in values:
+                    for line in self.__iter__([parameter]):
+                        yield " " * self.indentation + line
+                yield "}"
+            elif isinstance(key, str) and key.strip() == "#":
+                yield key + values
+            else:
+                gap = " "
+                if values and spacey(values):
+                    gap = values
+                    values = b.pop(0)
+                yield key + gap + values + ";"
+
+    def write(self, _file, chunk_size=None):
+        return _file.write(str(self))
+
+
+def config(directives):
+    """Returns a config of servers with nested locations and ifs"""
+    servers = []
+    for i in range(directives // 20):
+        servers.append(
+            """    # server %(i)d
+    server {
+        listen 80;
+        server_name s%(i)d.example.com www.s%(i)d.example.com;
+        root /srv/s%(i)d;
+        location / {
+            proxy_pass http://backend%(i)d;
+            proxy_set_header Host $host;
+            proxy_set_header X-Real-IP $remote_addr;
+            location /api {
+                if ($request_method = POST) {
+                    return 405;
+                }
+                proxy_read_timeout 30s;
+            }
+        }
+        location ~* \\.(png|jpg)$ {
+            expires 30d;
+            access_log off;
+        }
+    }
+"""
+            % {"i": i}
+        )
+    return "http {\n%s}\n" % "".join(servers)
+
+
+def measure(dumper_class, tree):
+    output = io.StringIO()
+    tracemalloc.start()
+    start = time.perf_counter()
+    dumper_class(tree.spaced).write(output)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return output.getvalue(), elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directives", type=int, default=100000)
+    ns = parser.parse_args()
+
+    tree = loads(config(ns.directives), engine="fast")
+    results = {}
+    for name, dumper_class in (("legacy", LegacyNginxDumper), ("stream", NginxDumper)):
+        results[name] = measure(dumper_class, tree)
+        _, elapsed, peak = results[name]
+        print("%-8s %8.3f s %10.1f MiB peak" % (name, elapsed, peak / 2.0**20))
+    assert results["legacy"][0] == results["stream"][0], "output differs"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Cost of chained filters against a fused Pipeline.
+
+Drops comments, structure markers and dummy blocks from a generated
+config by chaining filter functions (one tree copy each), with a single
+Pipeline.apply() and by dumping a Pipeline.view() directly, checking the
+output is identical and printing time and peak memory.
+
+    python benchmarks/filters.py [--directives 100000]
+"""
+import argparse
+import time
+import tracemalloc
+
+from nginxparser.nginxparser import NginxDumper, dumps, loads
+from nginxparser.process import Pipeline, filter_all_comments, filter_out
+
+from dump import config
+
+DUMMY = (["types"], "load_module", ["events"])
+
+
+def chained(tree):
+    tree = filter_out(tree, "##")
+    tree = filter_all_comments(tree)
+    return dumps(filter_out(tree, *DUMMY))
+
+
+PIPELINE = Pipeline().drop("##").drop_comments().drop(*DUMMY)
+
+
+def fused(tree):
+    return dumps(PIPELINE.apply(tree))
+
+
+def view(tree):
+    return str(NginxDumper(PIPELINE.view(tree)))
+
+
+def measure(func, tree):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func(tree)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directives", type=int, default=100000)
+    ns = parser.parse_args()
+
+    tree = loads(config(ns.directives), engine="fast")
+    outputs = []
+    for name, func in (("chained", chained), ("fused", fused), ("view", view)):
+        output, elapsed, peak = measure(func, tree)
+        outputs.append(output)
+        print("%-8s %8.3f s %10.1f MiB peak" % (name, elapsed, peak / 2.0**20))
+    assert outputs[0] == outputs[1] == outputs[2], "output differs"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""Deterministic generator of realistic nginx configurations.
+
+The same arguments always give the same text, so benchmark runs can be
+compared over time.  Configs have many servers with locations and ifs
+nested ``depth`` deep, ``map`` blocks of ``map_entries`` entries and
+comments on about ``comments`` of the lines; include trees spread servers
+over files ``include_depth`` levels deep.
+
+    python benchmarks/generator.py [--servers 200] > nginx.conf
+"""
+import argparse
+import random
+
+UPSTREAMS = ["app", "api", "static", "auth", "search"]
+HEADERS = [
+    ("Host", "$host"),
+    ("X-Real-IP", "$remote_addr"),
+    ("X-Forwarded-For", "$proxy_add_x_forwarded_for"),
+    ("X-Forwarded-Proto", "$scheme"),
+]
+COMMENTS = [
+    "managed by configuration management, do not edit",
+    "TODO: drop once the old clients are gone",
+    "see the runbook before changing timeouts",
+    "keep in sync with the load balancer",
+]
+
+
+class Writer(object):
+    """
+    Accumulates indented lines, commenting about a given ratio of them
+    """
+
+    def __init__(self, rnd, comments):
+        self.rnd = rnd
+        self.comments = comments
+        self.lines = []
+        self.level = 0
+
+    def line(self, text):
+        if self.rnd.random() < self.comments:
+            self.lines.append("    " * self.level + "# " + self.rnd.choice(COMMENTS))
+        self.lines.append("    " * self.level + text)
+
+    def open(self, text):
+        self.line(text + " {")
+        self.level += 1
+
+    def close(self):
+        self.level -= 1
+        self.lines.append("    " * self.level + "}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def _location(out, rnd, prefix, depth):
+    out.open("location %s" % prefix)
+    upstream = rnd.choice(UPSTREAMS)
+    out.line("proxy_pass http://%s;" % upstream)
+    for name, value in rnd.sample(HEADERS, rnd.randint(1, len(HEADERS))):
+        out.line("proxy_set_header %s %s;" % (name, value))
+    if depth > 1:
+        if rnd.random() < 0.5:
+            out.open("if ($request_method = POST)")
+            out.line("set $limited 1;")
+            _location(out, rnd, "%s/nested" % prefix, depth - 1)
+            out.close()
+        else:
+            _location(out, rnd, "%s/v%d" % (prefix, rnd.randint(1, 3)), depth - 1)
+    out.line("proxy_read_timeout %ds;" % rnd.choice([5, 30, 60]))
+    out.close()
+
+
+def server(out, rnd, i, depth):
+    """Writes server number i with locations nested depth deep"""
+    out.open("server")
+    if rnd.random() < 0.5:
+        out.line("listen 443 ssl;")
+        out.line("ssl_certificate /etc/ssl/s%d.example.com.pem;" % i)
+        out.line("ssl_certificate_key /etc/ssl/s%d.example.com.key;" % i)
+        out.line("ssl_protocols TLSv1.2 TLSv1.3;")
+    else:
+        out.line("listen 80;")
+    out.line("server_name s%d.example.com www.s%d.example.com;" % (i, i))
+    out.line("root /srv/s%d;" % i)
+    out.line("access_log /var/log/nginx/s%d.access.log;" % i)
+    for n in range(rnd.randint(1, 3)):
+        _location(out, rnd, "/%s%d" % (rnd.choice(UPSTREAMS), n), depth)
+    out.open("location ~* \\.(png|jpg|css|js)$")
+    out.line("expires 30d;")
+    out.line("access_log off;")
+    out.close()
+    out.close()
+
+
+def map_block(out, rnd, entries):
+    """Writes a map of entries hostnames to upstreams"""
+    out.open("map $http_host $backend")
+    out.line("default app;")
+    for i in range(entries):
+        out.line("h%d.example.com %s;" % (i, rnd.choice(UPSTREAMS)))
+    out.close()
+
+
+def generate(servers=200, depth=4, map_entries=1000, comments=0.2, seed=0):
+    """
+    Returns the text of an nginx.conf with an http block of servers
+    """
+    rnd = random.Random(seed)
+    out = Writer(rnd, comments)
+    out.line("worker_processes auto;")
+    out.open("events")
+    out.line("worker_connections 1024;")
+    out.close()
+    out.open("http")
+    out.line("include mime.types;")
+    out.line("sendfile on;")
+    map_block(out, rnd, map_entries)
+    for i in range(servers):
+        server(out, rnd, i, depth)
+    out.close()
+    return out.text()
+
+
+def generate_tree(
+    root, servers=200, depth=4, map_entries=1000, comments=0.2, include_depth=3, seed=0
+):
+    """
+    Writes an include tree under the directory root and returns the path
+    of its nginx.conf: the http block includes the files of level 1, and
+    each file of a level includes two files of the next one, servers being
+    spread over all files.
+    :param pathlib.Path root: an existing directory
+    """
+    rnd = random.Random(seed)
+    files = [[root / "nginx.conf"]]
+    for level in range(1, include_depth + 1):
+        (root / ("level%d" % level)).mkdir()
+        files.append(
+            [root / ("level%d" % level) / ("f%d.conf" % i) for i in range(2**level)]
+        )
+    # servers go round robin to the included files, or nginx.conf alone
+    leaves = [path for paths in files[1:] for path in paths] or files[0]
+    assigned = dict((path, []) for path in leaves)
+    for i in range(servers):
+        assigned[leaves[i % len(leaves)]].append(i)
+
+    for level, paths in enumerate(files):
+        for n, path in enumerate(paths):
+            out = Writer(rnd, comments)
+            if level == 0:
+                out.line("worker_processes auto;")
+                out.open("http")
+            if level < include_depth:
+                for child in files[level + 1][2 * n : 2 * n + 2]:
+                    out.line("include %s;" % child)
+            if level == 0:
+                # the parsers do not accept a directive right after a map
+                map_block(out, rnd, map_entries)
+            for i in assigned.get(path, ()):
+                server(out, rnd, i, depth)
+            if level == 0:
+                out.close()
+            if not out.lines:
+                # with fewer servers than leaves: the parsers reject empty files
+                out.lines.append("# no servers here")
+            path.write_text(out.text())
+    return files[0][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--map-entries", type=int, default=1000)
+    parser.add_argument("--comments", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    ns = parser.parse_args()
+    print(
+        generate(ns.servers, ns.depth, ns.map_entries, ns.comments, ns.seed),
+        end="",
+    )
+
+
+if __name__ == "__main__":
+    main()
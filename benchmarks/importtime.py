@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Import time of the package and startup time of ngx.
+
+Runs, each in a fresh interpreter under ``python -X importtime``, imports
+of nginxparser.nginxparser and nginxparser.cli, ``ngx --help`` and a first
+parse with each engine, and prints their best wall time, the cumulative
+import time of the package, whether pyparsing got imported and the
+slowest modules imported.  With --output the results are saved as JSON,
+which --compare reads back to print how a run relates to an earlier one.
+
+    python benchmarks/importtime.py [--repeat 5] [--output importtime.json] \\
+        [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+CASES = [
+    ("import nginxparser", "import nginxparser.nginxparser"),
+    ("import cli", "import nginxparser.cli"),
+    (
+        "ngx --help",
+        "import sys, nginxparser.cli\n"
+        "sys.argv = ['ngx', '--help']\n"
+        "try:\n"
+        "    nginxparser.cli.main()\n"
+        "except SystemExit:\n"
+        "    pass",
+    ),
+    (
+        "parse fast",
+        "from nginxparser.nginxparser import loads\n"
+        "loads('server { listen 80; }', engine='fast')",
+    ),
+    (
+        "parse pyparsing",
+        "from nginxparser.nginxparser import loads\nloads('server { listen 80; }')",
+    ),
+]
+# lines of -X importtime: "import time: self [us] | cumulative | imported package"
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run(code):
+    """
+    Returns the wall time of running code in a new interpreter and the
+    (self, cumulative microseconds, depth, module) of the modules it imported
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="")
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+        env=env,
+    )
+    elapsed = time.perf_counter() - start
+    imports = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            imports.append((int(own), int(cumulative), len(indent), module))
+    return elapsed, imports
+
+
+def summary(imports):
+    """Returns the figures kept of the imports of one run"""
+    package = sum(
+        cumulative for _, cumulative, _, module in imports if module == "nginxparser"
+    )
+    slowest = sorted(imports, key=lambda entry: -entry[0])[:5]
+    return {
+        "package_us": package,
+        "total_us": sum(own for own, _, _, _ in imports),
+        "modules": len(imports),
+        "pyparsing": any(module == "pyparsing" for _, _, _, module in imports),
+        "slowest": [[module, own] for own, _, _, module in slowest],
+    }
+
+
+def compare(results, baseline):
+    """Prints the times relative to those of a former run"""
+    print("\ncompared with the run of %s:" % baseline["meta"]["date"])
+    for name, result in results["cases"].items():
+        former = baseline["cases"].get(name)
+        if former is None:
+            print("  %-16s new" % name)
+            continue
+        print(
+            "  %-16s %6.2fx wall %6.2fx imports"
+            % (
+                name,
+                result["seconds"] / former["seconds"],
+                result["total_us"] / float(former["total_us"] or 1),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a former run")
+    ns = parser.parse_args()
+
+    # warm the bytecode caches, which the runs measured then read
+    run("import nginxparser.cli")
+    results = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": sys.version.split()[0],
+            "repeat": ns.repeat,
+        },
+        "cases": {},
+    }
+    for name, code in CASES:
+        best = None
+        for _ in range(ns.repeat):
+            elapsed, imports = run(code)
+            if best is None or elapsed < best[0]:
+                best = elapsed, imports
+        result = dict(summary(best[1]), seconds=best[0])
+        results["cases"][name] = result
+        print(
+            "%-16s %8.1f ms wall %8.1f ms imports %4d modules pyparsing %-3s"
+            " slowest: %s"
+            % (
+                name,
+                result["seconds"] * 1e3,
+                result["total_us"] / 1e3,
+                result["modules"],
+                "yes" if result["pyparsing"] else "no",
+                ", ".join("%s %.1f" % (m, us / 1e3) for m, us in result["slowest"]),
+            )
+        )
+
+    if ns.output:
+        with open(ns.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if ns.compare:
+        with open(ns.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Cost of reloading an include tree after editing a single file.
+
+Generates nginx.conf including many site files, each including a shared
+snippet, then compares a full load_path() with IncrementalLoader.load()
+after editing one site file and after editing the shared snippet.
+
+    python benchmarks/incremental.py [--sites 200] [--servers 20]
+"""
+import argparse
+import os
+import pathlib
+import tempfile
+import time
+
+from nginxparser.nginxparser import dumps
+from nginxparser.process import IncrementalLoader, load_path
+
+SERVER = """server {
+    listen 80;
+    server_name s%(i)d.example.com;
+    include %(root)s/snippets/proxy.conf;
+    location / {
+        proxy_pass http://backend%(i)d;
+    }
+}
+"""
+
+
+def generate(root, sites, servers):
+    (root / "sites").mkdir()
+    (root / "snippets").mkdir()
+    (root / "snippets" / "proxy.conf").write_text(
+        "proxy_set_header Host $host;\nproxy_read_timeout 30s;\n"
+    )
+    for site in range(sites):
+        (root / "sites" / ("site%04d.conf" % site)).write_text(
+            "".join(
+                SERVER % {"i": site * servers + i, "root": root} for i in range(servers)
+            )
+        )
+    main = root / "nginx.conf"
+    main.write_text("http {\n    include %s/sites/*.conf;\n}\n" % root)
+    return main
+
+
+def touch(path, text):
+    with path.open("a") as f:
+        f.write(text)
+    # make sure the mtime moves even on coarse-grained filesystems
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def timed(func):
+    start = time.perf_counter()
+    res = func()
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, default=200)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--engine", default="fast")
+    ns = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        path = generate(root, ns.sites, ns.servers)
+        loader = IncrementalLoader(path, engine=ns.engine)
+        _, elapsed = timed(loader.load)
+        print("%-28s %8.3f s" % ("initial load", elapsed))
+        _, elapsed = timed(lambda: load_path(path, engine=ns.engine))
+        print("%-28s %8.3f s" % ("full load_path", elapsed))
+        _, elapsed = timed(loader.load)
+        print("%-28s %8.3f s" % ("reload, nothing changed", elapsed))
+
+        edits = [
+            ("reload, one site edited", root / "sites" / "site0000.conf"),
+            ("reload, shared snippet", root / "snippets" / "proxy.conf"),
+        ]
+        for name, edited in edits:
+            touch(edited, "# edited\n")
+            tree, elapsed = timed(loader.load)
+            print(
+                "%-28s %8.3f s  (%d files rebuilt)"
+                % (name, elapsed, len(loader.rebuilt))
+            )
+            assert dumps(tree) == dumps(load_path(path, engine=ns.engine))
+
+
+if __name__ == "__main__":
+    main()
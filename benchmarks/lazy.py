@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Finding one server of a huge config with the lazy engine.
+
+Generates a config of --servers servers and looks for the server named
+--host (the last one by default) after parsing it with the fast engine and
+with the lazy one, which only parses the innards of the blocks it goes
+through.  Prints the times next to a plain regex search of the text, the
+cost of a linear scan, and checks both engines find the same server.
+
+    python benchmarks/lazy.py [--servers 5000] [--host s42.example.com]
+"""
+import argparse
+import re
+import time
+
+from nginxparser.nginxparser import loads
+
+from generator import generate
+
+
+def find_server(tree, host):
+    """Returns the server block of the http block named host, or None"""
+    for row in tree:
+        if row[0] != ["http"]:
+            continue
+        for block in row[1]:
+            if block[0] != ["server"]:
+                continue
+            for directive in block[1]:
+                if directive[0] == "server_name" and host in directive[1].split():
+                    return block
+    return None
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    res = function(*args)
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=5000)
+    parser.add_argument("--host", help="Server name to look for")
+    parser.add_argument("--repeat", type=int, default=3)
+    ns = parser.parse_args()
+    host = ns.host or "s%d.example.com" % (ns.servers - 1)
+
+    text = generate(ns.servers, map_entries=100)
+    print("%d servers, %.1f MiB" % (ns.servers, len(text) / 2.0**20))
+    pattern = re.compile(r"server_name[^;]*\s%s[\s;]" % re.escape(host))
+
+    def scan():
+        return pattern.search(text)
+
+    def search(engine):
+        def run():
+            return find_server(loads(text, engine=engine), host)
+
+        return run
+
+    found = {}
+    for name, run in (
+        ("regex scan", scan),
+        ("fast", search("fast")),
+        ("lazy", search("lazy")),
+    ):
+        best = None
+        for _ in range(ns.repeat):
+            res, elapsed = timed(run)
+            best = elapsed if best is None else min(best, elapsed)
+        found[name] = res
+        print("%-12s %8.3f s" % (name, best))
+    assert found["regex scan"] is not None, "no server named %s" % host
+    assert found["lazy"] == found["fast"]
+
+
+if __name__ == "__main__":
+    main()
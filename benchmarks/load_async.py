@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Loading many include trees from an asyncio service.
+
+Generates --roots include trees (one per tenant) and loads them all from a
+coroutine with load_path() called directly, and concurrently with
+load_path_async() parsing in the default thread pool and in a process
+pool.  Prints the total time and the longest time the event loop was kept
+from running other tasks, and checks the trees are the same.
+
+    python benchmarks/load_async.py [--roots 50] [--servers 20] [--jobs 4]
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import pathlib
+import tempfile
+import time
+
+from nginxparser.nginxparser import dumps
+from nginxparser.process import load_path, load_path_async
+
+from generator import generate_tree
+
+
+async def longest_stall(done, interval=0.001):
+    """Returns the longest delay of a periodic task until done is set"""
+    longest = 0.0
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        longest = max(longest, time.perf_counter() - start - interval)
+    return longest
+
+
+async def run(load_all):
+    done = asyncio.Event()
+    ticker = asyncio.ensure_future(longest_stall(done))
+    # let the ticker start before loading
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    trees = await load_all()
+    elapsed = time.perf_counter() - start
+    done.set()
+    return trees, elapsed, await ticker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--roots", type=int, default=50)
+    parser.add_argument("--servers", type=int, default=20)
+    parser.add_argument("--jobs", type=int, default=4)
+    ns = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        roots = []
+        for i in range(ns.roots):
+            root = pathlib.Path(tmp) / ("tenant%d" % i)
+            root.mkdir()
+            roots.append(
+                generate_tree(
+                    root, servers=ns.servers, map_entries=100, include_depth=2, seed=i
+                )
+            )
+
+        async def blocking():
+            return [load_path(path, engine="fast") for path in roots]
+
+        async def threads():
+            return await asyncio.gather(
+                *(load_path_async(path, engine="fast") for path in roots)
+            )
+
+        async def processes():
+            with concurrent.futures.ProcessPoolExecutor(ns.jobs) as pool:
+                return await asyncio.gather(
+                    *(
+                        load_path_async(
+                            path, engine="fast", executor=pool, limit=ns.jobs
+                        )
+                        for path in roots
+                    )
+                )
+
+        expected = None
+        for name, load_all in (
+            ("load_path", blocking),
+            ("async, threads", threads),
+            ("async, processes", processes),
+        ):
+            trees, elapsed, stall = asyncio.run(run(load_all))
+            dumped = [dumps(tree) for tree in trees]
+            if expected is None:
+                expected = dumped
+            assert dumped == expected, name
+            print(
+                "%-18s %8.3f s total %8.1f ms longest stall"
+                % (name, elapsed, stall * 1e3)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Build and lookup cost of the directive model on large configs.
+
+Compares build_model() and find_in_model() with the former recursive,
+unindexed implementation (ported to Python 3) for a growing number of
+servers, and prints the peak memory of each model.
+
+    python benchmarks/model.py [--max-servers 16384]
+"""
+import argparse
+import time
+import tracemalloc
+
+from nginxparser.nginxparser import build_model, find_in_model, loads
+
+from dump import config
+
+
+class LegacyBaseDirective(object):
+    """Directive without __slots__, as the model used to be"""
+
+    def __init__(self, key=None, value=None, parent=None, raw=None):
+        self.key = key
+        self.value = value
+        self.parent = parent
+        self.raw = raw
+
+
+class LegacyBlockDirective(LegacyBaseDirective):
+    pass
+
+
+def legacy_build_model(cfg, parent=None):
+    root = LegacyBlockDirective(value=[], parent=parent, raw=cfg)
+    for sub in cfg:
+        if len(sub) > 1 and isinstance(sub[1], list):
+            sub_block = legacy_build_model(sub[1], parent=root)
+            sub_block.key = sub[0]
+            sub_block.raw = sub
+            root.value.append(sub_block)
+        else:
+            value = sub[1] if len(sub) > 1 else None
+            root.value.append(
+                LegacyBaseDirective(key=sub[0], value=value, parent=root, raw=sub)
+            )
+    return root
+
+
+def legacy_find_in_model(model, path):
+    if len(path) == 0:
+        return [model]
+    ret_value = []
+    for sub in model.value:
+        if sub.key == path[0] or sub.key == [path[0]]:
+            if isinstance(sub, LegacyBlockDirective):
+                ret_value += legacy_find_in_model(sub, path[1:])
+            else:
+                ret_value += [sub]
+    return ret_value
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    elapsed = time.perf_counter() - start
+    # tracing slows allocations down, so peak memory is taken on a second run
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+def lookup(find, model, path, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        res = find(model, path)
+    return res, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-servers", type=int, default=16384)
+    parser.add_argument("--repeat", type=int, default=20)
+    ns = parser.parse_args()
+
+    impls = [
+        ("legacy", legacy_build_model, legacy_find_in_model),
+        ("indexed", build_model, find_in_model),
+    ]
+    path = ["http", "server", "listen"]
+    print(
+        "%8s %8s %10s %10s %12s"
+        % ("servers", "model", "build ms", "peak MiB", "find ms")
+    )
+    servers = 1024
+    while servers <= ns.max_servers:
+        cfg = loads(config(servers * 20), engine="fast")
+        found = []
+        for name, build, find in impls:
+            model, elapsed, peak = measure(build, cfg)
+            res, per_find = lookup(find, model, path, ns.repeat)
+            found.append([d.raw for d in res])
+            print(
+                "%8d %8s %10.1f %10.1f %12.3f"
+                % (servers, name, elapsed * 1e3, peak / 2.0**20, per_find * 1e3)
+            )
+        assert found[0] == found[1], "lookups differ"
+        servers *= 2
+
+
+if __name__ == "__main__":
+    main()
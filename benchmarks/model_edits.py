@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Cost of removing many directives from the directive model.
+
+Removes every ``listen`` directive (one per block), then every ``server``
+block (all in the same block) of a generated config from its model with
+the former remove_from_model() (equality scans and a full rebuild after
+each removal), with remove_from_model() one at a time and with a single
+ModelBatch, checking the configs end up identical.
+
+    python benchmarks/model_edits.py [--directives 10000]
+"""
+import argparse
+import time
+
+from nginxparser.nginxparser import (
+    ModelBatch,
+    build_model,
+    dumps,
+    find_in_model,
+    loads,
+    rebuild_model,
+    remove_from_model,
+)
+
+from dump import config
+
+
+def legacy_remove_from_model(root, element):
+    """The former implementation, comparing subtrees and rebuilding"""
+    body = element.parent.raw[1]
+    if element.raw not in body:
+        raise ValueError("Malformed model, element not present in the parent")
+    for i, x in enumerate(body):
+        if x == element.raw:
+            del body[i]
+            break
+    return rebuild_model(root)
+
+
+def legacy(tree, path):
+    model = build_model(tree)
+    while True:
+        found = find_in_model(model, path)
+        if not found:
+            return
+        model = legacy_remove_from_model(model, found[0])
+
+
+def one_by_one(tree, path):
+    model = build_model(tree)
+    for element in find_in_model(model, path):
+        remove_from_model(model, element)
+
+
+def batch(tree, path):
+    model = build_model(tree)
+    edits = ModelBatch()
+    for element in find_in_model(model, path):
+        edits.remove(element)
+    edits.apply()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directives", type=int, default=10000)
+    ns = parser.parse_args()
+
+    source = config(ns.directives)
+    for path in (["http", "server", "listen"], ["http", "server"]):
+        outputs = []
+        for name, func in (
+            ("legacy", legacy),
+            ("one by one", one_by_one),
+            ("batch", batch),
+        ):
+            tree = loads(source, engine="fast")
+            start = time.perf_counter()
+            func(tree, path)
+            elapsed = time.perf_counter() - start
+            print("%-20s %-12s %10.3f s" % ("/".join(path), name, elapsed))
+            outputs.append(dumps(tree))
+        assert outputs[0] == outputs[1] == outputs[2], "output differs"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Cost of editing UnspacedList blocks holding thousands of servers.
+
+For a growing number of ``server`` blocks in one ``http`` block prints the
+time per append, insert, item assignment, pop and slice assignment, which
+should not grow with the size of the block for appends and assignments.
+
+    python benchmarks/mutation.py [--max-servers 16384]
+"""
+import argparse
+import time
+
+from nginxparser.nginxparser import loads
+
+SERVER = [["server"], [["listen", "80"], ["server_name", "example.com"]]]
+
+
+def http_block(servers):
+    source = "http {\n%s}\n" % "".join(
+        "    server {\n        listen 80;\n        server_name s%d.example.com;\n    }\n"
+        % i
+        for i in range(servers)
+    )
+    return loads(source, engine="fast")[0][1]
+
+
+def per_op(block, operation, count):
+    start = time.perf_counter()
+    for i in range(count):
+        operation(block, i)
+    return (time.perf_counter() - start) * 1e6 / count
+
+
+OPERATIONS = [
+    ("append", lambda b, i: b.append(SERVER)),
+    ("insert[0]", lambda b, i: b.insert(0, SERVER)),
+    ("insert[mid]", lambda b, i: b.insert(len(b) // 2, SERVER)),
+    ("set[i]", lambda b, i: b.__setitem__(i, SERVER)),
+    ("set[-i]", lambda b, i: b.__setitem__(-i - 1, SERVER)),
+    ("pop()", lambda b, i: b.pop()),
+    ("slice=", lambda b, i: b.__setitem__(slice(i, i + 2), [SERVER, SERVER])),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-servers", type=int, default=16384)
+    parser.add_argument("--ops", type=int, default=500)
+    ns = parser.parse_args()
+
+    print("%8s" % "servers" + "".join("%13s" % name for name, _ in OPERATIONS))
+    print("%8s" % "" + "%13s" % "us/op" * len(OPERATIONS))
+    servers = 1024
+    while servers <= ns.max_servers:
+        row = []
+        for _, operation in OPERATIONS:
+            block = http_block(servers)
+            row.append(per_op(block, operation, ns.ops))
+        print("%8d" % servers + "".join("%13.2f" % cost for cost in row))
+        servers *= 2
+
+
+if __name__ == "__main__":
+    main()
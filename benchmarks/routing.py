@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Cost of routing URLs to server and location blocks.
+
+Generates servers with prefix, ^~ and regex locations, then routes URLs
+with a naive scan of the tree (compiling regexes on every request, as
+scripts built on find_elems do) and with a RoutingIndex, checking both
+agree.
+
+    python benchmarks/routing.py [--servers 1000] [--urls 5000]
+"""
+import argparse
+import random
+import re
+import time
+
+from nginxparser.nginxparser import loads
+from nginxparser.routing import RoutingIndex, normalize_host, split_url
+
+SERVER = """    server {
+        listen 80;
+        server_name s%(i)d.example.com www.s%(i)d.example.com;
+        location / { root /srv/s%(i)d; }
+        location ^~ /static/ { root /srv/static; }
+        location /api/ { proxy_pass http://backend%(i)d; }
+        location ~ ^/api/v%(i)d/(users|groups)/\\d+$ { proxy_pass http://users%(i)d; }
+        location ~* \\.(png|jpg|gif)$ { expires 30d; }
+    }
+"""
+
+PATHS = ["/", "/static/a.png", "/api/x", "/api/v%d/users/42", "/img/logo.PNG", "/about"]
+
+
+def naive_route(tree, host, uri):
+    """Linear scan of servers and locations, compiling regexes each time"""
+    host = normalize_host(host)
+    servers = [row for row in tree[0][1] if row[0] == ["server"]]
+    server = servers[0]
+    for row in servers:
+        names = [r[1] for r in row[1] if r[0] == "server_name"][0].split()
+        if host in names:
+            server = row
+            break
+    longest, regexes = None, []
+    for row in server[1]:
+        if row[0][0] != "location":
+            continue
+        args = row[0][1:]
+        if len(args) == 2 and args[0] in ("~", "~*"):
+            regexes.append((args, row))
+        elif uri.startswith(args[-1]):
+            if longest is None or len(args[-1]) > len(longest[0][-1]):
+                longest = (args, row)
+    if longest is not None and longest[0][0] == "^~":
+        return server, longest[1]
+    for args, row in regexes:
+        flags = re.IGNORECASE if args[0] == "~*" else 0
+        if re.compile(args[1], flags).search(uri):
+            return server, row
+    return server, longest and longest[1]
+
+
+def timed(func):
+    start = time.perf_counter()
+    res = func()
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=1000)
+    parser.add_argument("--urls", type=int, default=5000)
+    ns = parser.parse_args()
+
+    tree = loads(
+        "http {\n%s}\n" % "".join(SERVER % {"i": i} for i in range(ns.servers)),
+        engine="fast",
+    )
+    rnd = random.Random(0)
+    urls = []
+    for _ in range(ns.urls):
+        i = rnd.randrange(ns.servers)
+        urls.append("s%d.example.com%s" % (i, rnd.choice(PATHS).replace("%d", str(i))))
+
+    def naive():
+        return [naive_route(tree, *split_url(url)[:2]) for url in urls]
+
+    def indexed():
+        index = RoutingIndex(tree)
+        return [(r.server, r.location) for r in index.route_many(urls)]
+
+    expected, elapsed = timed(naive)
+    print("%-22s %8.3f s" % ("naive scan", elapsed))
+    index, elapsed = timed(lambda: RoutingIndex(tree))
+    print("%-22s %8.3f s" % ("build RoutingIndex", elapsed))
+    routes, elapsed = timed(indexed)
+    print("%-22s %8.3f s (including build)" % ("RoutingIndex", elapsed))
+    assert routes == expected, "routes differ"
+
+
+if __name__ == "__main__":
+    main()
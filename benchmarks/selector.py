@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""Cost of running many selectors over a large config.
+
+Runs one ``http/server[server_name~=...]//proxy_pass`` selector per server
+of a generated config, first one traversal per selector, then all of them
+in a single traversal with select(), and checks both agree.
+
+    python benchmarks/selector.py [--directives 100000] [--queries 1000]
+"""
+import argparse
+import time
+
+from nginxparser.nginxparser import loads
+from nginxparser.selector import Selector, select
+
+from dump import config
+
+
+def timed(func):
+    start = time.perf_counter()
+    res = func()
+    return res, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directives", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    ns = parser.parse_args()
+
+    tree = loads(config(ns.directives), engine="fast")
+    texts = [
+        "http/server[server_name~=s%d.example.com]//proxy_pass" % i
+        for i in range(ns.queries)
+    ]
+    selectors, elapsed = timed(lambda: [Selector(text) for text in texts])
+    print("%-22s %8.3f s" % ("compile", elapsed))
+    one_by_one, elapsed = timed(lambda: [sel.select(tree) for sel in selectors])
+    print("%-22s %8.3f s" % ("one traversal each", elapsed))
+    batch, elapsed = timed(lambda: select(tree, selectors))
+    print("%-22s %8.3f s" % ("single traversal", elapsed))
+    assert one_by_one == batch, "results differ"
+
+
+if __name__ == "__main__":
+    main()
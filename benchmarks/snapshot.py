@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Cost of keeping a snapshot before every edit.
+
+Edits a directive deep in a random location of a generated config many
+times, keeping every previous version: with copy.deepcopy of the
+UnspacedList before each edit and with PersistentList.set_in(), which
+shares untouched subtrees.  Prints the time per edit and the memory held
+by the snapshots, and checks the final trees dump the same.
+
+    python benchmarks/snapshot.py [--directives 20000] [--edits 50]
+"""
+import argparse
+import copy
+import random
+import time
+import tracemalloc
+
+from nginxparser.nginxparser import dumps, loads
+from nginxparser.persistent import PersistentList
+
+from dump import config
+
+
+def edit_paths(tree, edits):
+    """Returns paths to the proxy_pass value of random servers' location /"""
+    rnd = random.Random(0)
+    servers = len(tree[0][1])
+    # http > server i > location / > proxy_pass value
+    return [[0, 1, rnd.randrange(1, servers, 2), 1, 3, 1, 0, 1] for _ in range(edits)]
+
+
+def with_deepcopy(tree, paths):
+    snapshots = []
+    for n, path in enumerate(paths):
+        snapshots.append(copy.deepcopy(tree))
+        node = tree
+        for i in path[:-1]:
+            node = node[i]
+        node[path[-1]] = "http://edited%d" % n
+    return tree, snapshots
+
+
+def with_persistent(tree, paths):
+    snapshots = []
+    tree = PersistentList.from_unspaced(tree)
+    for n, path in enumerate(paths):
+        snapshots.append(tree)
+        tree = tree.set_in(path, "http://edited%d" % n)
+    return tree, snapshots
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func(*args)
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return res, elapsed, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directives", type=int, default=20000)
+    parser.add_argument("--edits", type=int, default=50)
+    ns = parser.parse_args()
+
+    source = config(ns.directives)
+    results = []
+    for name, func in (("deepcopy", with_deepcopy), ("persistent", with_persistent)):
+        tree = loads(source, engine="fast")
+        paths = edit_paths(tree, ns.edits)
+        (tree, _), elapsed, held = measure(func, tree, paths)
+        results.append(dumps(tree))
+        print(
+            "%-10s %10.3f ms/edit %10.1f MiB held"
+            % (name, elapsed * 1e3 / ns.edits, held / 2.0**20)
+        )
+    assert results[0] == results[1], "output differs"
+
+
+if __name__ == "__main__":
+    main()
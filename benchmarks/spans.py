@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Memory and time of parsing a large file into spans.
+
+Writes a generated config to a file, then parses it with load() (reading
+the file and building the tree of strings with the fast engine) and with
+load_spans() (mapping the file and recording spans into it), printing
+time and tracemalloc peak, which does not count the mapped file.  Then
+checks both trees hold the same directives.
+
+    python benchmarks/spans.py [--directives 100000]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from nginxparser.nginxparser import load
+from nginxparser.spans import load_spans
+
+from dump import config
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+def directives(rows):
+    """Yields the (name, value) of the directives of an unspaced tree"""
+    for row in rows:
+        if isinstance(row[0], list):
+            yield from directives(row[1])
+        elif row[0] != "#":
+            yield row[0], row[1] if len(row) > 1 else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directives", type=int, default=100000)
+    ns = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".conf", delete=False) as f:
+        f.write(config(ns.directives))
+    try:
+        size = os.path.getsize(f.name)
+        print("%-12s %20.1f MiB" % ("file", size / 2.0**20))
+
+        def strings():
+            with open(f.name) as conf:
+                return load(conf, engine="fast")
+
+        tree, elapsed, peak = measure(strings)
+        print("%-12s %8.3f s %10.1f MiB peak" % ("load", elapsed, peak / 2.0**20))
+        spans, elapsed, peak = measure(lambda: load_spans(f.name))
+        print(
+            "%-12s %8.3f s %10.1f MiB peak" % ("load_spans", elapsed, peak / 2.0**20)
+        )
+        with spans:
+            found = [
+                (node.name, node.value)
+                for node in spans.walk()
+                if node.type == "directive"
+            ]
+            assert found == list(directives(tree)), "directives differ"
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""Benchmark suite over generated configs, with JSON results.
+
+Generates a config and an include tree with generator.py, then times
+parsing with both engines, dumping, a dump/parse round trip, include
+loading with process.load_path(), filtering with a Pipeline and
+UnspacedList mutations.  Every case is run --repeat times for timing and
+once more under tracemalloc for its peak memory.  With --output the
+results are saved as JSON, which --compare reads back to print how a run
+relates to an earlier one.
+
+    python benchmarks/suite.py [--servers 200] [--only parse] \\
+        [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import pathlib
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from nginxparser.nginxparser import dumps, loads
+from nginxparser.process import Pipeline, load_path
+
+from generator import generate, generate_tree
+
+
+def count_directives(rows):
+    """Returns the number of directives and blocks in an unspaced tree"""
+    count = 0
+    todo = [rows]
+    while todo:
+        for row in todo.pop():
+            count += 1
+            if row and not isinstance(row[0], str):
+                todo.append(row[1])
+    return count
+
+
+def mutate(tree):
+    """
+    Appends, inserts, assigns and deletes a directive in every block of
+    the http block, returning the number of operations
+    """
+    http = tree[-1][1]
+    for block in http:
+        if not isinstance(block[0], list):
+            continue
+        body = block[1]
+        body.append(["add_header", "X-Bench 1"])
+        body.insert(0, ["set", "$bench 1"])
+        body[1] = ["set", "$bench 2"]
+        del body[0]
+        body.pop()
+    return 5 * sum(1 for block in http if isinstance(block[0], list))
+
+
+def cases(source, tree, nginx_conf):
+    """
+    Returns (name, units, unit, prepare, run): run(prepare()) is what gets
+    timed, processing units of unit
+    """
+    directives = count_directives(tree)
+    dumped = dumps(tree)
+    pipeline = Pipeline().drop_comments().drop("proxy_set_header")
+    mutations = mutate(loads(source, engine="fast"))
+    included = count_directives(load_path(nginx_conf, engine="fast"))
+    return [
+        (
+            "parse.fast",
+            directives,
+            "directives",
+            lambda: source,
+            lambda text: loads(text, engine="fast"),
+        ),
+        (
+            "parse.pyparsing",
+            directives,
+            "directives",
+            lambda: source,
+            lambda text: loads(text),
+        ),
+        ("dump", directives, "directives", lambda: tree, dumps),
+        (
+            "roundtrip",
+            directives,
+            "directives",
+            lambda: dumped,
+            lambda text: dumps(loads(text, engine="fast")),
+        ),
+        (
+            "includes.load_path",
+            included,
+            "directives",
+            lambda: nginx_conf,
+            lambda path: load_path(path, engine="fast"),
+        ),
+        ("filter.pipeline", directives, "directives", lambda: tree, pipeline.apply),
+        (
+            "mutation",
+            mutations,
+            "operations",
+            lambda: loads(source, engine="fast"),
+            mutate,
+        ),
+    ]
+
+
+def measure(prepare, run, repeat):
+    """Returns the run times and the peak memory of run(prepare())"""
+    times = []
+    for _ in range(repeat):
+        arg = prepare()
+        start = time.perf_counter()
+        run(arg)
+        times.append(time.perf_counter() - start)
+    arg = prepare()
+    tracemalloc.start()
+    run(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return times, peak
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=pathlib.Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Prints the times relative to those of a former run"""
+    print("\ncompared with %s:" % (baseline["meta"]["revision"] or "baseline"))
+    if baseline["meta"]["parameters"] != results["meta"]["parameters"]:
+        print("  warning: generated with different parameters")
+    for name, result in results["cases"].items():
+        former = baseline["cases"].get(name)
+        if former is None:
+            print("  %-20s new" % name)
+            continue
+        print(
+            "  %-20s %6.2fx time %6.2fx peak"
+            % (
+                name,
+                result["seconds"] / former["seconds"],
+                result["peak_bytes"] / float(former["peak_bytes"] or 1),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--map-entries", type=int, default=1000)
+    parser.add_argument("--comments", type=float, default=0.2)
+    parser.add_argument("--include-depth", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="Run the cases matching this regex")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a former run")
+    ns = parser.parse_args()
+
+    parameters = dict(
+        servers=ns.servers,
+        depth=ns.depth,
+        map_entries=ns.map_entries,
+        comments=ns.comments,
+        include_depth=ns.include_depth,
+        seed=ns.seed,
+    )
+    results = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": revision(),
+            "python": sys.version.split()[0],
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "repeat": ns.repeat,
+            "parameters": parameters,
+        },
+        "cases": {},
+    }
+    source = generate(ns.servers, ns.depth, ns.map_entries, ns.comments, ns.seed)
+    tree = loads(source, engine="fast")
+    with tempfile.TemporaryDirectory() as tmp:
+        nginx_conf = generate_tree(pathlib.Path(tmp), **parameters)
+        for name, units, unit, prepare, run in cases(source, tree, nginx_conf):
+            if ns.only and not re.search(ns.only, name):
+                continue
+            times, peak = measure(prepare, run, ns.repeat)
+            best = min(times)
+            results["cases"][name] = {
+                "seconds": best,
+                "median_seconds": statistics.median(times),
+                "times": times,
+                "units": units,
+                "unit": unit,
+                "per_second": units / best if best else None,
+                "peak_bytes": peak,
+            }
+            print(
+                "%-20s %9.4f s %12.0f %s/s %9.1f MiB peak"
+                % (name, best, units / best, unit, peak / 2.0**20)
+            )
+
+    if ns.output:
+        with open(ns.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if ns.compare:
+        with open(ns.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""Time and peak memory of UnspacedList construction on deep configs.
+
+Builds ``http > server > location > if > ...`` nests of growing depth and
+prints the cost per node, which should stay flat as the depth grows.
+
+    python benchmarks/unspacedlist.py [--max-depth 256] [--width 4]
+"""
+import argparse
+import time
+import tracemalloc
+
+from nginxparser.nginxparser import UnspacedList, loads
+
+
+def deep_config(depth, width):
+    """Returns a config nesting ``depth`` blocks with ``width`` directives each"""
+    lines = []
+    for level in range(depth):
+        indent = "    " * level
+        for i in range(width):
+            lines.append("%sproxy_set_header X-Level-%d-%d $host;" % (indent, level, i))
+        lines.append("%slocation /l%d {" % (indent, level))
+    for level in reversed(range(depth)):
+        lines.append("    " * level + "}")
+    return "\n".join(lines) + "\n"
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-depth", type=int, default=256)
+    parser.add_argument("--width", type=int, default=4)
+    ns = parser.parse_args()
+
+    print(
+        "%6s %8s %12s %12s %12s"
+        % ("depth", "nodes", "total ms", "us/node", "peak B/node")
+    )
+    depth = 1
+    while depth <= ns.max_depth:
+        source = deep_config(depth, ns.width)
+        parsed = loads(source, engine="fast")
+        nodes = source.count("\n")
+        _, elapsed, peak = measure(UnspacedList, parsed.spaced)
+        print(
+            "%6d %8d %12.3f %12.3f %12.1f"
+            % (depth, nodes, elapsed * 1e3, elapsed * 1e6 / nodes, peak / nodes)
+        )
+        depth *= 2
+
+
+if __name__ == "__main__":
+    main()
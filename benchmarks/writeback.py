@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Writing back one change to a huge config.
+
+Generates a config of --servers servers, changes the proxy_pass of one
+location and renders the result with dumps() and with Document.dumps(),
+which only renders the dirty rows again.  Prints the times and how many
+lines of each output differ from the original text.
+
+    python benchmarks/writeback.py [--servers 5000]
+"""
+import argparse
+import collections
+import time
+
+from nginxparser.nginxparser import dumps
+from nginxparser.writeback import loads_document
+
+from generator import generate
+
+
+def change_proxy_pass(tree, server):
+    """Changes the first proxy_pass of server number server"""
+    http = tree[-1][1]
+    servers = [block for block in http if block[0] == ["server"]]
+    for block in servers[server][1]:
+        if isinstance(block[0], list):
+            for row in block[1]:
+                if row[0] == "proxy_pass":
+                    row[1] = "http://changed"
+                    return
+    raise ValueError("no proxy_pass in server %d" % server)
+
+
+def changed_lines(before, after):
+    """Lines removed plus lines added, wherever they are"""
+    before = collections.Counter(before.splitlines())
+    after = collections.Counter(after.splitlines())
+    return sum((before - after).values()) + sum((after - before).values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    ns = parser.parse_args()
+
+    text = generate(ns.servers, map_entries=100)
+    start = time.perf_counter()
+    document = loads_document(text)
+    print(
+        "%d servers, %.1f MiB parsed in %.3f s"
+        % (ns.servers, len(text) / 2.0**20, time.perf_counter() - start)
+    )
+    change_proxy_pass(document.tree, ns.servers // 2)
+
+    for name, render in (
+        ("dumps", lambda: dumps(document.tree)),
+        ("Document.dumps", document.dumps),
+    ):
+        best = None
+        for _ in range(ns.repeat):
+            start = time.perf_counter()
+            out = render()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(
+            "%-16s %8.3f s %8d lines changed" % (name, best, changed_lines(text, out))
+        )
+
+
+if __name__ == "__main__":
+    main()
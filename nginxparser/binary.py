@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compact binary encoding of parsed trees.
+
+The encoding keeps the spaced tree, whitespace included, so dumping a
+decoded tree gives exactly the same text.  Layout, little endian::
+
+    header   magic "NGXB", version, token and length typecodes,
+             number of strings, string blob size, number of tokens
+    lengths  length in characters of every distinct string
+    blob     the distinct strings, concatenated, UTF-8 encoded
+    tokens   the tree in postfix order: 2 * i for string i, and
+             2 * n + 1 to gather the last n values into a list
+
+Lengths and tokens use the narrowest of 1, 2 or 4 byte unsigned integers
+that fits them, named by their array typecode in the header.
+"""
+
+import array
+import itertools
+import struct
+import sys
+
+MAGIC = b"NGXB"
+VERSION = 1
+_HEADER = struct.Struct("<4sBccxIII")
+_TYPECODES = [("B", 0xFF), ("H", 0xFFFF), ("I", 0xFFFFFFFF)]
+
+
+def _typecode(largest):
+    for typecode, limit in _TYPECODES:
+        if largest <= limit and array.array(typecode).itemsize <= 4:
+            return typecode
+    raise ValueError("Tree too large for the binary format")
+
+
+def _pack(typecode, values):
+    packed = array.array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack(typecode, buffer):
+    unpacked = array.array(typecode)
+    unpacked.frombytes(buffer)
+    if sys.byteorder == "big":
+        unpacked.byteswap()
+    return unpacked
+
+
+def encode(spaced):
+    """
+    Encodes a spaced tree of lists and strings
+    :param list spaced: the tree, usually UnspacedList.spaced
+    :rtype: bytes
+    """
+    strings = {}
+    tokens = []
+    # postfix walk without recursion: a list's token follows its items
+    stack = [(iter(spaced), len(spaced))]
+    while stack:
+        items, size = stack[-1]
+        for item in items:
+            if isinstance(item, str):
+                tokens.append(2 * strings.setdefault(item, len(strings)))
+            elif isinstance(item, list):
+                stack.append((iter(item), len(item)))
+                break
+            else:
+                raise TypeError("Cannot encode %r" % (item,))
+        else:
+            stack.pop()
+            tokens.append(2 * size + 1)
+
+    lengths = [len(string) for string in strings]
+    blob = "".join(strings).encode("utf-8")
+    length_code = _typecode(max(lengths, default=0))
+    token_code = _typecode(max(tokens))
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        length_code.encode(),
+        token_code.encode(),
+        len(strings),
+        len(blob),
+        len(tokens),
+    )
+    return b"".join(
+        [header, _pack(length_code, lengths), blob, _pack(token_code, tokens)]
+    )
+
+
+def decode(buffer):
+    """
+    Decodes an encoded tree
+    :param buffer: bytes, memoryview or mmap holding the encoding
+    :returns: the spaced tree as nested lists
+    :raises ValueError: when buffer does not hold a supported encoding
+    """
+    # released on the way out so a mapped buffer can be closed even on errors
+    with memoryview(buffer) as view:
+        if len(view) < _HEADER.size:
+            raise ValueError("Truncated binary tree")
+        (
+            magic,
+            version,
+            length_code,
+            token_code,
+            count,
+            blob_size,
+            size,
+        ) = _HEADER.unpack(view[: _HEADER.size])
+        if magic != MAGIC:
+            raise ValueError("Not a binary nginx tree")
+        if version != VERSION:
+            raise ValueError("Unsupported binary tree version %d" % version)
+        length_code, token_code = length_code.decode(), token_code.decode()
+
+        pos = _HEADER.size
+        end = pos + count * array.array(length_code).itemsize
+        lengths = _unpack(length_code, view[pos:end])
+        pos, end = end, end + blob_size
+        text = str(view[pos:end], "utf-8")
+        pos, end = end, end + size * array.array(token_code).itemsize
+        if end > len(view):
+            raise ValueError("Truncated binary tree")
+        tokens = _unpack(token_code, view[pos:end])
+
+    offsets = list(itertools.accumulate(lengths, initial=0))
+    strings = [text[a:b] for a, b in zip(offsets, offsets[1:])]
+    values = []
+    append = values.append
+    for token in tokens:
+        if token & 1:
+            n = token >> 1
+            if n:
+                items = values[-n:]
+                del values[-n:]
+                append(items)
+            else:
+                append([])
+        else:
+            append(strings[token >> 1])
+    if len(values) != 1:
+        raise ValueError("Malformed binary tree")
+    return values[0]
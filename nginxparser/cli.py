@@ -1,12 +1,35 @@
 import argparse
+import contextlib
+import itertools
+import json
 import pathlib
+import sys
+import time
+import nginxparser.diff
 import nginxparser.process
 import nginxparser.nginxparser
+import nginxparser.profiling
+import nginxparser.routing
+
+# dispatched on the first argument, before the options of ngx are parsed
+SUBCOMMANDS = """subcommands:
+  ngx route [path]      print the server and location handling URLs read from stdin
+  ngx diff OLD NEW      print the changes from configuration OLD to NEW
+
+Run them with --help for their options. To load a configuration file
+named route or diff, give it as ./route or after --."""
 
 
 def main():
+    if sys.argv[1:2] == ["route"]:
+        route(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["diff"]:
+        sys.exit(diff(sys.argv[2:]))
     parser = argparse.ArgumentParser(
-        description="Parse nginx config, optionally filter it and reindents"
+        description="Parse nginx config, optionally filter it and reindents",
+        epilog=SUBCOMMANDS,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     parser.add_argument(
         "--skip-comments",
@@ -44,10 +67,269 @@ def main():
         + " (ignored with -m)",
     )
     parser.add_argument(
-        "path", nargs="?", type=pathlib.Path, default="/etc/nginx/nginx.conf"
+        "--watch",
+        "-w",
+        type=float,
+        nargs="?",
+        const=1.0,
+        metavar="SECONDS",
+        help="Print the configuration again whenever one of its files changes,"
+        + " checking every SECONDS (default: 1)",
     )
+    add_load_arguments(parser)
     ns = parser.parse_args()
-    cfg = nginxparser.process.load_path(ns.path)
+    if ns.packrat is not None and ns.engine != "pyparsing":
+        parser.error("--packrat needs the pyparsing engine")
+    cache = nginxparser.process.ParseCache(cache_dir=ns.cache_dir)
+    with profiled(ns):
+        if ns.watch is not None:
+            watch(ns, cache)
+            return
+        cfg = load(ns, cache)
+        with nginxparser.profiling.stage("render"):
+            text = render(cfg, ns)
+        print(text)
+
+
+def add_load_arguments(parser, path=True):
+    """
+    Adds the options controlling how configuration files are loaded, and
+    the path to load unless path is false
+    """
+    parser.add_argument(
+        "--engine",
+        "-e",
+        choices=sorted(nginxparser.nginxparser.ENGINES),
+        default="pyparsing",
+        help="Parser engine to use (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--packrat",
+        type=int,
+        metavar="SIZE",
+        help="Diagnostic: parse with a packrat cache of SIZE entries and print"
+        + " its statistics to stderr (2 to 3.5 times slower)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=pathlib.Path,
+        metavar="DIR",
+        help="Keep parsed files in DIR and reuse them while they are unchanged",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Parse included files with N processes (0: one per CPU)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_const",
+        const="text",
+        help="Print the time spent per stage and per file to stderr",
+    )
+    parser.add_argument(
+        "--profile-json",
+        dest="profile",
+        action="store_const",
+        const="json",
+        help="Print the same profile to stderr as JSON",
+    )
+    if path:
+        parser.add_argument(
+            "path", nargs="?", type=pathlib.Path, default="/etc/nginx/nginx.conf"
+        )
+
+
+@contextlib.contextmanager
+def profiled(ns):
+    """Profiles the body if --profile was given, printing the profile at the end"""
+    if ns.profile is None:
+        yield
+        return
+    with nginxparser.profiling.Profile() as profile:
+        try:
+            with profile.stage("total"):
+                yield
+        finally:
+            if ns.profile == "json":
+                report = json.dumps(profile.as_dict(), indent=2, sort_keys=True)
+            else:
+                report = profile.report()
+            print(report, file=sys.stderr)
+
+
+def load(ns, cache, path=None):
+    """
+    Loads the configuration as requested on the command line, from path
+    if given
+    """
+    stats = {}
+    with nginxparser.profiling.stage("load"):
+        cfg = nginxparser.process.load_path(
+            ns.path if path is None else path,
+            engine=ns.engine,
+            packrat=ns.packrat,
+            stats=stats,
+            cache=cache,
+            jobs=ns.jobs,
+        )
+    if ns.packrat is not None:
+        print(
+            "packrat cache: %(hits)d hits, %(misses)d misses" % stats, file=sys.stderr
+        )
+    return cfg
+
+
+def route(argv):
+    """ngx route: prints the server and location handling URLs read from stdin"""
+    parser = argparse.ArgumentParser(
+        prog="ngx route",
+        description="Read URLs from stdin and print the server and location"
+        + " handling each of them, tab separated",
+    )
+    add_load_arguments(parser)
+    ns = parser.parse_args(argv)
+    if ns.packrat is not None and ns.engine != "pyparsing":
+        parser.error("--packrat needs the pyparsing engine")
+    cache = nginxparser.process.ParseCache(cache_dir=ns.cache_dir)
+    with profiled(ns):
+        cfg = load(ns, cache)
+        with nginxparser.profiling.stage("index"):
+            index = nginxparser.routing.RoutingIndex(cfg)
+        urls, requests = itertools.tee(
+            line.strip() for line in sys.stdin if line.strip()
+        )
+        with nginxparser.profiling.stage("route"):
+            for url, found in zip(urls, index.route_many(requests)):
+                print(
+                    "%s\t%s\t%s"
+                    % (url, describe(found.server), describe(found.location))
+                )
+
+
+def diff(argv):
+    """
+    ngx diff: prints the changes from one configuration to another,
+    returning the exit status, 1 if they differ
+    """
+    parser = argparse.ArgumentParser(
+        prog="ngx diff",
+        description="Print the directives added, removed and changed from the"
+        + " configuration OLD to NEW, with the blocks holding them;"
+        + " exit with status 1 if there are any",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the changes as a JSON list",
+    )
+    add_load_arguments(parser, path=False)
+    parser.add_argument("old", type=pathlib.Path)
+    parser.add_argument("new", type=pathlib.Path)
+    ns = parser.parse_args(argv)
+    if ns.packrat is not None and ns.engine != "pyparsing":
+        parser.error("--packrat needs the pyparsing engine")
+    cache = nginxparser.process.ParseCache(cache_dir=ns.cache_dir)
+    with profiled(ns):
+        old = load(ns, cache, ns.old)
+        new = load(ns, cache, ns.new)
+        with nginxparser.profiling.stage("diff"):
+            changes = nginxparser.diff.diff(old, new)
+        if ns.json:
+            print(
+                json.dumps(
+                    [
+                        {
+                            "type": change.type,
+                            "path": list(change.path),
+                            "name": change.name,
+                            "old": row_text(change.old),
+                            "new": row_text(change.new),
+                        }
+                        for change in changes
+                    ],
+                    indent=2,
+                )
+            )
+        else:
+            for change in changes:
+                print(describe_change(change))
+    return 1 if changes else 0
+
+
+def row_text(row):
+    """Returns the configuration text of a row, None for None"""
+    if row is None:
+        return None
+    return str(nginxparser.nginxparser.NginxDumper([row.spaced]))
+
+
+def describe_change(change):
+    """
+    Returns a line for a change: "+", "-" or "~", the path of its block
+    and the row, a block being shown by its label only
+    """
+    where = " > ".join(change.path) or "(top)"
+    if change.type == nginxparser.diff.CHANGED:
+        return "~ %s: %s %s -> %s" % (
+            where,
+            change.name,
+            " ".join(change.old[1:]),
+            " ".join(change.new[1:]),
+        )
+    sign = "+" if change.type == nginxparser.diff.ADDED else "-"
+    row = change.new if change.old is None else change.old
+    if not isinstance(row[0], str):
+        return "%s %s: %s { ... }" % (sign, where, change.name)
+    return "%s %s: %s" % (sign, where, " ".join(row))
+
+
+def describe(block):
+    """Returns the server names or location arguments of a block, "-" for None"""
+    if block is None:
+        return "-"
+    if block[0][0] == "server":
+        names = [
+            " ".join(row[1].split())
+            for row in block[1]
+            if isinstance(row, list) and row and row[0] == "server_name"
+        ]
+        return " ".join(names) or '""'
+    return " ".join(block[0][1:])
+
+
+def watch(ns, cache):
+    """Prints the configuration again every time one of its files changes"""
+    loader = nginxparser.process.IncrementalLoader(
+        ns.path, engine=ns.engine, packrat=ns.packrat, cache=cache, jobs=ns.jobs
+    )
+    # files being edited may not parse for a while: wait for the next change
+    errors = (ValueError, OSError)
+    if ns.engine == "pyparsing":
+        import pyparsing
+
+        errors += (pyparsing.ParseBaseException,)
+    try:
+        while True:
+            try:
+                cfg = loader.load()
+            except errors as e:
+                print("ngx: %s" % e, file=sys.stderr, flush=True)
+            else:
+                print(render(cfg, ns), flush=True)
+            while not loader.changed():
+                time.sleep(ns.watch)
+    except KeyboardInterrupt:
+        pass
+
+
+def render(cfg, ns):
+    """Filters the configuration as requested on the command line and dumps it,
+    with all filters fused in a single pass over the tree"""
+    pipeline = nginxparser.process.Pipeline()
     if ns.minimal:
         opt_cmd = [
             "http",
@@ -63,15 +345,14 @@ def main():
             opt_cmd.append("##")
         if ns.comments:
             opt_cmd.append("#")
-        cfg = nginxparser.process.filter_only(cfg, *opt_cmd)
+        pipeline = pipeline.keep(*opt_cmd)
     else:
-        opt_cmd = []
         if not ns.structure:
-            opt_cmd.append("##")
+            pipeline = pipeline.drop("##")
         if not ns.comments:
-            opt_cmd.append("#")
+            pipeline = pipeline.drop_comments()
         if not ns.dummy:
-            opt_cmd.extend([["types"], "load_module", ["events"]])
-        if opt_cmd:
-            cfg = nginxparser.process.filter_out(cfg, *opt_cmd)
-    print(nginxparser.nginxparser.dumps(cfg))
+            pipeline = pipeline.drop(["types"], "load_module", ["events"])
+    if not pipeline.stages:
+        return nginxparser.nginxparser.dumps(cfg)
+    return str(nginxparser.nginxparser.NginxDumper(pipeline.view(cfg)))
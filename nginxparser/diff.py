@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Structural diff of parsed configuration.
+
+:func:`diff` compares two trees, as returned by ``loads()`` or
+``process.load_path()`` (compact or not), and returns the changes turning
+the first into the second::
+
+    >>> for change in diff(load_path(running), load_path(candidate)):
+    ...     print(change.type, " > ".join(change.path), change.name)
+
+Every list gets a fingerprint, a hash of its strings and of the
+fingerprints of its lists (a Merkle tree), so equal subtrees are skipped
+without being compared.  PersistentLists keep their fingerprint, and the
+subtrees an Interner shares between trees are recognised by identity, so
+comparing many compact trees against the same one costs little more than
+walking the parts which differ.
+
+Rows are matched by what they are rather than where they are: identical
+rows first, then directives by name, blocks by name and arguments and
+``server`` blocks by ``server_name`` and ``listen``, then by
+``server_name`` alone.  Comments and the ``##`` file markers of
+``load_path()`` are left out.
+"""
+
+import collections
+import hashlib
+
+from .persistent import PersistentList
+
+Change = collections.namedtuple("Change", "type path name old new")
+Change.__doc__ = """A difference between two trees.
+
+type is ADDED, REMOVED or CHANGED.  path is the tuple of the labels of
+the blocks holding the row, name the directive name or the label of the
+block.  old and new are the rows (None for the one missing): directives
+change, blocks are added or removed, and the changes inside blocks found
+in both trees are reported row by row.
+"""
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+# rows of compact trees are PersistentLists
+_LISTS = (list, PersistentList)
+_SKIPPED = ("#", "##")
+
+
+def _skipped(row):
+    return isinstance(row, _LISTS) and len(row) > 0 and row[0] in _SKIPPED
+
+
+def _is_block(row):
+    return isinstance(row, _LISTS) and len(row) > 1 and isinstance(row[0], _LISTS)
+
+
+def fingerprint(node, memo=None):
+    """
+    Returns the 16 byte Merkle hash of a tree or row, comments left out
+    :param node: UnspacedList, PersistentList or nested lists
+    :param dict memo: where the fingerprints of lists other than
+        PersistentLists are kept by id, for as long as they are unchanged
+    """
+    if isinstance(node, PersistentList):
+        digest = getattr(node, "digest", None)
+    else:
+        digest = memo.get(id(node)) if memo is not None else None
+    if digest is not None:
+        return digest
+    h = hashlib.blake2b(digest_size=16)
+    for item in node:
+        if isinstance(item, str):
+            data = item.encode("utf-8", "surrogatepass")
+            h.update(b"%d:" % len(data))
+            h.update(data)
+        elif not _skipped(item):
+            h.update(b"[")
+            h.update(fingerprint(item, memo))
+    digest = h.digest()
+    if isinstance(node, PersistentList):
+        node.digest = digest
+    elif memo is not None:
+        memo[id(node)] = digest
+    return digest
+
+
+def _values(body, name):
+    return tuple(
+        row[1] if len(row) > 1 else ""
+        for row in body
+        if isinstance(row, _LISTS) and len(row) > 0 and row[0] == name
+    )
+
+
+def label(row):
+    """
+    Returns the label of a row in paths: the directive name, the block
+    name and arguments, or "server" and the server names for servers
+    """
+    if not _is_block(row):
+        return row[0] if isinstance(row, _LISTS) else row
+    head = row[0]
+    if len(head) == 1 and head[0] == "server":
+        return " ".join(
+            ("server",) + tuple(" ".join(_values(row[1], "server_name")).split())
+        )
+    return " ".join(head)
+
+
+def _exact_key(row, memo):
+    return fingerprint(row, memo) if isinstance(row, _LISTS) else row
+
+
+def _key(row, memo):
+    if not _is_block(row):
+        return ("directive", row[0]) if isinstance(row, _LISTS) else None
+    head = tuple(row[0])
+    if head == ("server",):
+        body = row[1]
+        return head + (_values(body, "server_name"), _values(body, "listen"))
+    return ("block",) + head
+
+
+def _loose_key(row, memo):
+    if _is_block(row) and tuple(row[0]) == ("server",):
+        return ("server", _values(row[1], "server_name"))
+    return None
+
+
+def _match(old_rows, new_rows, memo):
+    """
+    Returns the index in old_rows of the row matching each of new_rows,
+    None for those matching none, trying stricter keys first
+    """
+    matches = [None] * len(new_rows)
+    unmatched = list(range(len(old_rows)))
+    for key in (_exact_key, _key, _loose_key):
+        candidates = collections.defaultdict(collections.deque)
+        for i in unmatched:
+            k = key(old_rows[i], memo)
+            if k is not None:
+                candidates[k].append(i)
+        if not candidates:
+            continue
+        for j, row in enumerate(new_rows):
+            if matches[j] is None:
+                k = key(row, memo)
+                if k is not None and candidates.get(k):
+                    matches[j] = candidates[k].popleft()
+        taken = set(matches)
+        unmatched = [i for i in unmatched if i not in taken]
+    return matches
+
+
+def _same(old, new, memo):
+    """
+    Whether two rows are equal, comments left out: plain lists compare
+    without being hashed, as they are rarely compared twice
+    """
+    if old is new:
+        return True
+    if isinstance(old, list) and isinstance(new, list):
+        # a block differing only by comments is gone through, and found equal
+        return old == new
+    return _exact_key(old, memo) == _exact_key(new, memo)
+
+
+def _diff_rows(old, new, path, memo, changes):
+    if _same(old, new, memo):
+        return
+    old_rows = [row for row in old if not _skipped(row)]
+    new_rows = [row for row in new if not _skipped(row)]
+    # most rows are unchanged and in place: only those between are matched
+    start = 0
+    shortest = min(len(old_rows), len(new_rows))
+    while start < shortest and _same(old_rows[start], new_rows[start], memo):
+        start += 1
+    suffix = 0
+    while suffix < shortest - start and _same(
+        old_rows[-1 - suffix], new_rows[-1 - suffix], memo
+    ):
+        suffix += 1
+    old_rows = old_rows[start : len(old_rows) - suffix]
+    new_rows = new_rows[start : len(new_rows) - suffix]
+    if len(old_rows) == len(new_rows) and all(
+        _key(old_row, memo) == _key(row, memo)
+        for old_row, row in zip(old_rows, new_rows)
+    ):
+        # rows edited in place: no need to hash them to tell
+        matches = list(range(len(new_rows)))
+    else:
+        matches = _match(old_rows, new_rows, memo)
+    taken = set(matches)
+    for i, row in enumerate(old_rows):
+        if i not in taken:
+            changes.append(Change(REMOVED, path, label(row), row, None))
+    for row, i in zip(new_rows, matches):
+        if i is None:
+            changes.append(Change(ADDED, path, label(row), None, row))
+            continue
+        old_row = old_rows[i]
+        if _same(old_row, row, memo):
+            continue
+        if _is_block(row):
+            _diff_rows(old_row[1], row[1], path + (label(row),), memo, changes)
+        else:
+            changes.append(Change(CHANGED, path, label(row), old_row, row))
+
+
+def diff(old, new):
+    """
+    Returns the list of Changes turning the tree old into new: for every
+    list of rows, the rows removed, then those added or changed in the
+    order of new
+    :param old: UnspacedList or PersistentList
+    :param new: UnspacedList or PersistentList
+    """
+    changes = []
+    _diff_rows(old, new, (), {}, changes)
+    return changes
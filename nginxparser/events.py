@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Event based (SAX style) parsing of nginx configuration.
+
+:func:`iterparse` reads a file in chunks and yields an :class:`Event` for
+every directive, block start, block end and comment, without building a
+tree.  Words are split the way nginx does (whitespace separated, quoted
+strings and ``${var}`` kept whole) and are reported verbatim, quotes
+included.
+"""
+
+import collections
+import re
+
+Event = collections.namedtuple("Event", "type name args line column path")
+Event.__doc__ = """A parsing event.
+
+type is one of "start_block", "end_block", "directive" or "comment"; name
+is the directive or block name ("#" for comments) and args the tuple of
+its arguments (the text after "#" for comments).  line and column locate
+the first character of the statement, path is the file it comes from.
+"""
+
+START_BLOCK = "start_block"
+END_BLOCK = "end_block"
+DIRECTIVE = "directive"
+COMMENT = "comment"
+
+_TOKEN = re.compile(
+    r"""
+    (?P<space>\s+)
+    |(?P<comment>\#[^\n]*)
+    |(?P<punct>[{};])
+    |(?P<word>(?:[^\s{};"'$]+|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|\$\{[^}\s;]*\}|\$)+)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# the rest of a ${var} which may be closed by the next chunk
+_OPEN_VAR = re.compile(r"\{[^}\s;]*")
+
+
+def _may_go_on(buf, match):
+    """
+    Tells whether the token matched could be longer with more input: when
+    it reaches the end of buf, or is a word stopped by a quote or ${ which
+    are not closed within buf
+    """
+    end = match.end()
+    if end == len(buf):
+        return True
+    if match.lastgroup != "word":
+        return False
+    if buf[end] in "\"'":
+        return True
+    return (
+        buf[end] == "{"
+        and buf[end - 1] == "$"
+        and _OPEN_VAR.match(buf, end).end() == len(buf)
+    )
+
+
+def iterparse(_file, path=None, chunk_size=65536):
+    """Parses from a file, yielding events.
+
+    :param file _file: The file to parse
+    :param path: Reported as the path of every event
+    :param int chunk_size: Number of characters read at once
+    :returns: A generator of :class:`Event`
+    :raises ValueError: On unbalanced braces, unterminated statements or
+        quotes, with the line and column of the problem
+
+    """
+    buf = ""
+    base = 0  # offset of buf in the file
+    line, line_start = 1, 0  # current line and the offset it starts at
+    eof = False
+    words = []
+    start = None  # (line, column) of the statement being read
+    blocks = []
+    pos = 0
+
+    def fail(message, where):
+        raise ValueError("%s (line:%d, col:%d)" % (message, where[0], where[1]))
+
+    while True:
+        if not eof and len(buf) - pos < chunk_size:
+            chunk = _file.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            base += pos
+            pos = 0
+        match = _TOKEN.match(buf, pos)
+        if match is None or (not eof and _may_go_on(buf, match)):
+            if not eof:
+                # the token may go on in the next chunk
+                chunk = _file.read(chunk_size)
+                eof = not chunk
+                buf += chunk
+                continue
+            if pos == len(buf):
+                break
+            fail("Unterminated quoted string", (line, base + pos - line_start + 1))
+        kind = match.lastgroup
+        text = match.group()
+        where = (line, base + pos - line_start + 1)
+        pos = match.end()
+        newlines = text.count("\n")
+        if newlines:
+            line += newlines
+            line_start = base + match.start() + text.rindex("\n") + 1
+
+        if kind == "space":
+            continue
+        if kind == "comment":
+            yield Event(COMMENT, "#", (text[1:],), where[0], where[1], path)
+        elif kind == "word":
+            if not words:
+                start = where
+            words.append(text)
+        elif text == ";":
+            if not words:
+                fail("Unexpected ';'", where)
+            yield Event(DIRECTIVE, words[0], tuple(words[1:]), *start, path)
+            words = []
+        elif text == "{":
+            if not words:
+                fail("Unexpected '{'", where)
+            yield Event(START_BLOCK, words[0], tuple(words[1:]), *start, path)
+            blocks.append(words[0])
+            words = []
+        else:
+            if words:
+                fail("Unexpected '}' in unterminated statement", where)
+            if not blocks:
+                fail("Unexpected '}'", where)
+            yield Event(END_BLOCK, blocks.pop(), (), where[0], where[1], path)
+
+    if words:
+        fail("Unexpected end of file, expecting ';' or '{'", start)
+    if blocks:
+        fail(
+            "Unexpected end of file, expecting '}'", (line, base + pos - line_start + 1)
+        )
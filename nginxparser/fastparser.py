@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Hand-written parser producing the same tree as the pyparsing grammar.
+
+Every rule of :class:`nginxparser.nginxparser.NginxParser` is mirrored here
+by a precompiled regular expression or a small method, so the source is
+scanned once, left to right, without pyparsing's backtracking and
+re-parsing of ``^`` alternatives.  The result of :meth:`as_list` is
+identical to ``NginxParser(source).as_list()`` (including the whitespace
+entries kept for :class:`UnspacedList.spaced`).
+"""
+
+import re
+
+# space = Optional(White())
+_SPACE = re.compile(r"[ \t\r\n]+")
+# key = Word(alphanums + "_/+-.")
+_KEY = re.compile(r"[A-Za-z0-9_/+\-.]+")
+# value = Combine(ZeroOrMore(dquoted | squoted | varsub | nonspecial)),
+# with runs of plain characters consumed at once
+_VALUE = re.compile(r"(?:[^{};,\"'$]+|\"[^\n]*\"|'[^\n]*'|\$\{\w+\}|[^{};,])*")
+# restOfLine
+_REST_OF_LINE = re.compile(r"[^\n]*")
+# location = CharsNotIn("{};," + string.whitespace)
+_LOCATION = re.compile(r"[^{};, \t\n\r\x0b\x0c]+")
+# modifier = Literal("=") | Literal("~*") | Literal("~") | Literal("^~")
+_MODIFIER = re.compile(r"=|~\*|~|\^~")
+# condition = Regex(r"\(.+\)")
+_CONDITION = re.compile(r"\([^\n]+\)")
+# nonspace = Regex(r"\S+")
+_NONSPACE = re.compile(r"\S+")
+# dollar_var = Combine(Literal("$") + Regex(r"[^\{\};,\s]+"))
+_DOLLAR_VAR = re.compile(r"\$[^{};,\s]+")
+# map_pattern = Regex(r'".*"') | Regex(r"'.*'") | nonspace
+_MAP_PATTERN = re.compile(r"\"[^\n]*\"|'[^\n]*'|\S+")
+
+
+class FastNginxParser(object):
+    """A class that parses nginx configuration with a hand-written scanner."""
+
+    def __init__(self, source):
+        self.source = source
+
+    def parse(self):
+        """Returns the parsed tree."""
+        return self.as_list()
+
+    def as_list(self):
+        """Returns the parsed tree as a list."""
+        source = self.source
+        res = []
+        pos = 0
+        while True:
+            parsed = self._script_item(pos)
+            if parsed is None:
+                break
+            pos, item = parsed
+            res.append(item)
+        if not res or self._space(pos, res) != len(source):
+            self._fail(pos)
+        return res
+
+    def _fail(self, pos):
+        match = _SPACE.match(self.source, pos)
+        if match:
+            pos = match.end()
+        line = self.source.count("\n", 0, pos) + 1
+        col = pos - self.source.rfind("\n", 0, pos)
+        raise ValueError(
+            "Unable to parse nginx configuration (at char %d), (line:%d, col:%d)"
+            % (pos, line, col)
+        )
+
+    def _space(self, pos, tokens):
+        match = _SPACE.match(self.source, pos)
+        if match is None:
+            return pos
+        tokens.append(match.group())
+        return match.end()
+
+    def _literal(self, pos, text, tokens):
+        if self.source.startswith(text, pos):
+            tokens.append(text)
+            return pos + len(text)
+        return None
+
+    def _script_item(self, pos):
+        # Group(comment | assignment) ^ block ^ map_block: longest match wins
+        best = self._comment(pos)
+        if best is not None:
+            # A comment cannot start a block or a map
+            return best
+        for alt in (self._assignment, self._block, self._map_block):
+            parsed = alt(pos)
+            if parsed is not None and (best is None or parsed[0] > best[0]):
+                best = parsed
+        return best
+
+    def _block_item(self, pos):
+        # Group(comment | assignment) | block | map_block: first match wins
+        for alt in (self._comment, self._assignment, self._block, self._map_block):
+            parsed = alt(pos)
+            if parsed is not None:
+                return parsed
+        return None
+
+    def _comment(self, pos):
+        tokens = []
+        pos = self._space(pos, tokens)
+        pos = self._literal(pos, "#", tokens)
+        if pos is None:
+            return None
+        match = _REST_OF_LINE.match(self.source, pos)
+        tokens.append(match.group())
+        return match.end(), tokens
+
+    def _assignment(self, pos):
+        source = self.source
+        tokens = []
+        pos = self._space(pos, tokens)
+        match = _KEY.match(source, pos)
+        if match is None:
+            return None
+        tokens.append(match.group())
+        pos = self._space(match.end(), tokens)
+        match = _VALUE.match(source, pos)
+        tokens.append(match.group())
+        pos = match.end()
+        if not source.startswith(";", pos):
+            return None
+        return pos + 1, tokens
+
+    def _block_begin(self, pos):
+        # The alternatives are combined with ^: longest match, earliest on ties
+        best = None
+        for alt in (self._key_statement, self._if_statement, self._charset_map):
+            parsed = alt(pos)
+            if parsed is not None and (best is None or parsed[0] > best[0]):
+                best = parsed
+        return best
+
+    def _key_statement(self, pos):
+        source = self.source
+        tokens = []
+        pos = self._space(pos, tokens)
+        match = _KEY.match(source, pos)
+        if match is None:
+            return None
+        tokens.append(match.group())
+        pos = self._space(match.end(), tokens)
+        match = _MODIFIER.match(source, pos)
+        if match is not None:
+            tokens.append(match.group())
+            pos = match.end()
+        location = []
+        end = self._space(pos, location)
+        match = _LOCATION.match(source, end)
+        if match is not None:
+            location.append(match.group())
+            pos = self._space(match.end(), location)
+            tokens.extend(location)
+        return pos, tokens
+
+    def _if_statement(self, pos):
+        tokens = []
+        pos = self._space(pos, tokens)
+        pos = self._literal(pos, "if", tokens)
+        if pos is None:
+            return None
+        pos = self._space(pos, tokens)
+        match = _CONDITION.match(self.source, pos)
+        if match is None:
+            return None
+        tokens.append(match.group())
+        return self._space(match.end(), tokens), tokens
+
+    def _charset_map(self, pos):
+        tokens = []
+        pos = self._space(pos, tokens)
+        pos = self._literal(pos, "charset_map", tokens)
+        if pos is None:
+            return None
+        for _ in range(2):
+            pos = self._space(pos, tokens)
+            match = _VALUE.match(self.source, pos)
+            tokens.append(match.group())
+            pos = match.end()
+        return pos, tokens
+
+    def _block(self, pos):
+        parsed = self._block_begin(pos)
+        if parsed is None:
+            return None
+        pos, head = parsed
+        # left_bracket of a block skips (and drops) leading whitespace
+        match = _SPACE.match(self.source, pos)
+        if match is not None:
+            pos = match.end()
+        if not self.source.startswith("{", pos):
+            return None
+        pos, innards = self._body(pos + 1)
+        if not self.source.startswith("}", pos):
+            return None
+        return pos + 1, [head, innards]
+
+    def _body(self, pos):
+        """
+        Parses block_innards from pos, returning the position following
+        them, where the closing brace should be, and the innards
+        """
+        innards = []
+        while True:
+            parsed = self._block_item(pos)
+            if parsed is None:
+                break
+            pos, item = parsed
+            innards.append(item)
+        return self._space(pos, innards), innards
+
+    def _map_block(self, pos):
+        source = self.source
+        head = []
+        pos = self._space(pos, head)
+        pos = self._literal(pos, "map", head)
+        if pos is None:
+            return None
+        pos = self._space(pos, head)
+        match = _NONSPACE.match(source, pos)
+        if match is None:
+            return None
+        head.append(match.group())
+        pos = self._space(match.end(), head)
+        match = _DOLLAR_VAR.match(source, pos)
+        if match is None:
+            return None
+        head.append(match.group())
+        pos = self._space(match.end(), head)
+        if not source.startswith("{", pos):
+            return None
+        innards = []
+        pos += 1
+        while True:
+            parsed = self._comment(pos) or self._map_entry(pos)
+            if parsed is None:
+                break
+            pos, item = parsed
+            innards.append(item)
+        pos = self._space(pos, innards)
+        if not source.startswith("}", pos):
+            return None
+        return pos + 1, [head, innards]
+
+    def _map_entry(self, pos):
+        source = self.source
+        tokens = []
+        pos = self._space(pos, tokens)
+        match = _MAP_PATTERN.match(source, pos)
+        if match is None:
+            return None
+        tokens.append(match.group())
+        pos = self._space(match.end(), tokens)
+        match = _VALUE.match(source, pos)
+        tokens.append(match.group())
+        pos = self._space(match.end(), tokens)
+        if not source.startswith(";", pos):
+            return None
+        return pos + 1, tokens
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Parsing of block innards deferred until they are used.
+
+:class:`LazyNginxParser` parses like :class:`FastNginxParser`, except
+that the innards of a block are only scanned for their closing brace and
+kept as a :class:`LazyBody`: an empty list remembering where they are in
+the source, which parses them in place the first time it is used.  Nested
+blocks are deferred the same way, so reading one server of a huge http
+block parses the heads of the servers, the innards of that server and
+nothing else.
+
+Braces are counted without parsing, which is only exact when none of them
+can be part of a value: innards where a quoted string, a comment or an
+``if`` condition could hold a brace, with a ``${var}`` or a ``map``, are
+parsed right away.  Errors in deferred innards are raised when they are
+parsed, not by :meth:`LazyNginxParser.as_list`.
+"""
+
+import re
+
+from .fastparser import FastNginxParser
+
+# what may hide braces or change how they are read; "map" also matches
+# charset_map and longer words, which only makes the scan more careful
+_SPECIAL = re.compile(r"[{}\"'#(]|\$\{|map")
+# the characters closing what the special ones open, up to which braces
+# are part of a value
+_CLOSING = {'"': '"', "'": "'", "(": ")"}
+
+
+class LazyNginxParser(FastNginxParser):
+    """A FastNginxParser leaving block innards to be parsed on first use."""
+
+    def __init__(self, source):
+        super(LazyNginxParser, self).__init__(source)
+        # where the innards starting at a position end, for the innards of
+        # nested blocks found while skipping those of their parents
+        self._ends = {}
+
+    def _body(self, pos):
+        end = self._ends.get(pos)
+        if end is None:
+            end = self._skip(pos)
+        if end is None:
+            return FastNginxParser._body(self, pos)
+        return end, LazyBody(self, pos, end)
+
+    def _skip(self, pos):
+        """
+        Returns the position of the brace closing the innards starting at
+        pos, or None if the innards have to be parsed to know it
+        """
+        source = self.source
+        search = _SPECIAL.search
+        starts = []  # of the nested innards open
+        while True:
+            match = search(source, pos)
+            if match is None:
+                return None
+            token = match.group()
+            pos = match.end()
+            if token == "{":
+                starts.append(pos)
+            elif token == "}":
+                if not starts:
+                    return match.start()
+                self._ends[starts.pop()] = match.start()
+            elif token in ("${", "map"):
+                return None
+            else:
+                # quoted strings, comments and conditions end on their line
+                line_end = source.find("\n", pos)
+                if line_end < 0:
+                    line_end = len(source)
+                if token == "#":
+                    end = line_end
+                else:
+                    end = source.rfind(_CLOSING[token], pos, line_end)
+                    if end < 0:
+                        continue
+                if source.find("{", pos, end) >= 0 or source.find("}", pos, end) >= 0:
+                    return None
+                pos = end
+
+
+class LazyBody(list):
+    """
+    The spaced innards of a block, parsed from the source of parser
+    between start and end (the closing brace) when first used, without
+    whitespace entries if bare.  Once parsed it is a ParsedBody, a list
+    like any other.
+    """
+
+    def __init__(self, parser, start, end, bare=False):
+        list.__init__(self)
+        self.parser = parser
+        self.start = start
+        self.end = end
+        self.bare = bare
+
+    def clone(self, bare=None):
+        """Returns another LazyBody of the same innards, still not parsed"""
+        return LazyBody(
+            self.parser, self.start, self.end, self.bare if bare is None else bare
+        )
+
+    def mentions(self, word):
+        """Tells whether word appears in the source of the innards"""
+        return self.parser.source.find(word, self.start, self.end) >= 0
+
+    def parse(self):
+        """Parses the innards in place and returns self
+        :raises ValueError: if they cannot be parsed
+        """
+        parser = self.parser
+        pos, innards = FastNginxParser._body(parser, self.start)
+        if pos != self.end:
+            parser._fail(pos)
+        if self.bare:
+            innards = _bare(innards)
+        list.extend(self, innards)
+        self.__dict__.clear()
+        self.__class__ = ParsedBody
+        return self
+
+    def __reduce_ex__(self, protocol):
+        # pickled (and copied) as the plain list of the parsed innards
+        return list, (list(self.parse()),)
+
+
+class ParsedBody(list):
+    """Innards of a LazyBody which have been parsed"""
+
+    def parse(self):
+        return self
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+def _bare(spaced):
+    """
+    Returns the spaced innards without whitespace, as UnspacedList shows
+    them, nested innards not parsed yet being left to parse bare
+    """
+    # the parser does not depend on the lists
+    from .nginxparser import spacey
+
+    res = []
+    comment = False
+    for entry in spaced:
+        if type(entry) is LazyBody:
+            entry.bare = True
+            res.append(entry)
+        elif isinstance(entry, list):
+            res.append(_bare(entry))
+        # same rule as UnspacedList
+        elif comment or not spacey(entry):
+            comment = comment or entry == "#"
+            res.append(entry)
+    return res
+
+
+def _parsing_first(name):
+    method = getattr(list, name)
+
+    def parse_first(self, *args):
+        return method(self.parse(), *args)
+
+    parse_first.__name__ = name
+    return parse_first
+
+
+# every use of the list goes through one of these
+LIST_METHODS = (
+    "__iter__",
+    "__len__",
+    "__getitem__",
+    "__setitem__",
+    "__delitem__",
+    "__contains__",
+    "__eq__",
+    "__ne__",
+    "__lt__",
+    "__le__",
+    "__gt__",
+    "__ge__",
+    "__repr__",
+    "__reversed__",
+    "__add__",
+    "__iadd__",
+    "__mul__",
+    "__rmul__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "index",
+    "count",
+    "clear",
+    "copy",
+    "sort",
+    "reverse",
+)
+for _name in LIST_METHODS:
+    setattr(LazyBody, _name, _parsing_first(_name))
@@ -6,37 +6,65 @@
 
 import string
 import copy
-import types
+import functools
 import logging
-from pyparsing import (
-    Literal,
-    White,
-    Word,
-    alphanums,
-    CharsNotIn,
-    Combine,
-    Forward,
-    Group,
-    # SkipTo,
-    Optional,
-    OneOrMore,
-    ZeroOrMore,
-    # pythonStyleComment,
-    Regex,
-)
-
-import pyparsing
-from pyparsing import stringEnd
-from pyparsing import restOfLine
-
-
-pyparsing.ParserElement.setDefaultWhitespaceChars(" \n\t\r")
+import mmap
+import os
+import threading
+
+from .fastparser import FastNginxParser
+from .lazy import LIST_METHODS, LazyBody, LazyNginxParser
+from . import binary, profiling
+
+
 logger = logging.getLogger(__name__)
 
+# The whitespace the grammar skips, whatever other pyparsing users (such as
+# Cmd2) set as the default
+WHITESPACE_CHARS = " \n\t\r"
 
-class NginxParser(object):
+# Packrat parsing is switched on for every pyparsing parse of the process:
+# packrat parses are made one at a time
+_packrat_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _grammar():
+    """
+    Builds the pyparsing grammar on first use, importing pyparsing then, so
+    that importing this module and parsing with the other engines does not
+    pay for it.  The default whitespace is only changed while building.
+    """
+    import pyparsing
+
+    element = pyparsing.ParserElement
+    default_whitespace = element.DEFAULT_WHITE_CHARS
+    element.set_default_whitespace_chars(WHITESPACE_CHARS)
+    try:
+        return _build_grammar()
+    finally:
+        element.set_default_whitespace_chars(default_whitespace)
+
+
+def _build_grammar():
+    """Returns the script rule"""
     # pylint: disable=expression-not-assigned
-    """A class that parses nginx configuration with pyparsing."""
+    from pyparsing import (
+        Literal,
+        White,
+        Word,
+        alphanums,
+        CharsNotIn,
+        Combine,
+        Forward,
+        Group,
+        Optional,
+        OneOrMore,
+        ZeroOrMore,
+        Regex,
+        restOfLine,
+        stringEnd,
+    )
 
     # constants
     space = Optional(White())
@@ -115,12 +143,56 @@ class NginxParser(object):
     )
     script.parseWithTabs().leaveWhitespace()
 
-    def __init__(self, source):
+    return script
+
+
+class NginxParser(object):
+    """A class that parses nginx configuration with pyparsing."""
+
+    def __init__(self, source, packrat=None):
+        """
+        :param str source: The string to parse
+        :param int packrat: Packrat cache size limit; None disables packrat,
+            a diagnostic mode reporting cache hits, see _parse_packrat()
+        """
         self.source = source
+        self.packrat = packrat
+        self.cache_stats = None
 
     def parse(self):
         """Returns the parsed tree."""
-        return self.script.parseString(self.source)
+        if self.packrat is None:
+            return _grammar().parseString(self.source)
+        return self._parse_packrat()
+
+    def _parse_packrat(self):
+        """
+        Parses with a bounded packrat cache, recording its hits and misses.
+
+        This is a diagnostic: the grammar's alternatives rarely parse the
+        same text twice at the same place, so the cache hits about 0.1% of
+        the time and parsing takes 2 to 3.5 times as long, more with large
+        caches.  The cache is pyparsing's, enabled for the whole process
+        while parsing: other threads' pyparsing parses use it meanwhile
+        (giving the same trees), and packrat parses wait for each other.
+        Memoization is then disabled, as it is when pyparsing is imported.
+        """
+        import pyparsing
+
+        script = _grammar()
+        element = pyparsing.ParserElement
+        with _packrat_lock:
+            element.enable_packrat(self.packrat, force=True)
+            try:
+                return script.parseString(self.source)
+            finally:
+                hits, misses = element.packrat_cache_stats[:2]
+                self.cache_stats = {
+                    "hits": hits,
+                    "misses": misses,
+                    "size": self.packrat,
+                }
+                element.disable_memoization()
 
     def as_list(self):
         """Returns the parsed tree as a list."""
@@ -129,73 +201,175 @@ class NginxParser(object):
 
 class NginxDumper(object):
     # pylint: disable=too-few-public-methods
-    """A class that dumps nginx configuration from the provided tree."""
+    """A class that dumps nginx configuration from the provided tree
+    (nested lists, or the nested tuples of PersistentList.spaced)."""
 
     def __init__(self, blocks, indentation=2):
         self.blocks = blocks
         self.indentation = indentation
 
-    def __iter__(self, blocks=None):
+    def __iter__(self):
         """Iterates the dumped nginx content."""
-        blocks = blocks or self.blocks
-        for b0 in blocks:
-            if isinstance(b0, str):
-                yield b0
-                continue
-            b = copy.deepcopy(b0)
-            if spacey(b[0]):
-                yield b.pop(0)  # indentation
-                if not b:
+        indent = " " * self.indentation
+        # Walk the tree with an explicit stack of (items, prefix, closing line)
+        # so nothing is copied and every line is prefixed once
+        stack = [(iter(self.blocks), "", None)]
+        while stack:
+            blocks, prefix, closing = stack[-1]
+            for b in blocks:
+                if isinstance(b, str):
+                    yield prefix + b
                     continue
-            key, values = b.pop(0), b.pop(0)
-
-            if isinstance(key, list):
-                yield " ".join(key) + " {"
-                for parameter in values:
-                    for line in self.__iter__([parameter]):  # negate "for b0 in blocks"
-                        yield " " * self.indentation + line
-                yield "}"
-            else:
+                start = 0
+                if spacey(b[0]):
+                    yield prefix + b[0]  # indentation
+                    if len(b) == 1:
+                        continue
+                    start = 1
+                key, values = b[start], b[start + 1]
+
+                if isinstance(key, (list, tuple)):
+                    yield prefix + " ".join(key) + " {"
+                    stack.append((iter(values), prefix + indent, prefix + "}"))
+                    break
                 if isinstance(key, str) and key.strip() == "#":  # comment
-                    yield key + values
+                    yield prefix + key + values
                 else:  # assignment
                     gap = " "
                     # Sometimes the parser has stuck some gap whitespace in here;
                     # if so rotate it into gap
                     if values and spacey(values):
                         gap = values
-                        values = b.pop(0)
-                    yield key + gap + values + ";"
+                        values = b[start + 2]
+                    yield prefix + key + gap + values + ";"
+            else:
+                stack.pop()
+                if closing is not None:
+                    yield closing
+
+    def write(self, _file, chunk_size=65536):
+        """Writes the dumped nginx content to a file in chunks.
+
+        :param file _file: The file to dump to
+        :param int chunk_size: Approximate number of characters per write
+        :returns: The number of characters written
+        :rtype: int
+
+        """
+        written = size = 0
+        lines = []
+        lead = ""
+        for line in self:
+            lines.append(line)
+            size += len(line) + 1
+            if size >= chunk_size:
+                chunk = lead + "\n".join(lines)
+                _file.write(chunk)
+                written += len(chunk)
+                lead = "\n"
+                lines, size = [], 0
+        if lines:
+            chunk = lead + "\n".join(lines)
+            _file.write(chunk)
+            written += len(chunk)
+        return written
 
     def __str__(self):
         """Return the parsed block as a string."""
         return "\n".join(self)
 
 
+# Parser engines selectable by name in loads() and load()
+ENGINES = {
+    "pyparsing": NginxParser,
+    "fast": FastNginxParser,
+    # the fast engine parsing block innards on first use
+    "lazy": LazyNginxParser,
+}
+
+
+def get_engine(engine):
+    """Returns the parser class registered as ``engine``."""
+    try:
+        return ENGINES[engine]
+    except KeyError:
+        raise ValueError(
+            "Unknown parser engine %r (expected one of %s)"
+            % (engine, ", ".join(sorted(ENGINES)))
+        )
+
+
 # Shortcut functions to respect Python's serialization interface
 # (like pyyaml, picker or json)
 
 
-def loads(source):
+def loads(source, engine="pyparsing", packrat=None, stats=None, compact=False):
     """Parses from a string.
 
     :param str source: The string to parse
+    :param str engine: The parser engine to use ("pyparsing", "fast" or
+        "lazy", which only parses block innards when they are used, see
+        nginxparser.lazy)
+    :param int packrat: Packrat cache size for the pyparsing engine, to
+        see its hits and misses: parsing is slower (see NginxParser)
+    :param dict stats: If given, packrat cache hits/misses are added to it
+    :param compact: If true, or an Interner to share with other trees, the
+        tree is returned as an immutable PersistentList with equal strings
+        and subtrees shared, see nginxparser.persistent.compact()
     :returns: The parsed tree
-    :rtype: list
+    :rtype: UnspacedList or PersistentList
 
     """
-    return UnspacedList(NginxParser(source).as_list())
-
-
-def load(_file):
+    if packrat is None:
+        with profiling.stage("parse"):
+            tree = get_engine(engine)(source).as_list()
+        return _wrapped(tree, compact)
+    if engine != "pyparsing":
+        raise ValueError("Packrat parsing needs the pyparsing engine")
+    parser = NginxParser(source, packrat=packrat)
+    try:
+        with profiling.stage("parse"):
+            tree = parser.as_list()
+        return _wrapped(tree, compact)
+    finally:
+        if stats is not None and parser.cache_stats:
+            for name in ("hits", "misses"):
+                stats[name] = stats.get(name, 0) + parser.cache_stats[name]
+
+
+def load(_file, engine="pyparsing", packrat=None, stats=None, compact=False):
     """Parses from a file.
 
     :param file _file: The file to parse
+    :param str engine: The parser engine to use, see loads()
+    :param int packrat: Packrat cache size for the pyparsing engine
+    :param dict stats: If given, packrat cache hits/misses are added to it
+    :param compact: See loads()
     :returns: The parsed tree
-    :rtype: list
+    :rtype: UnspacedList or PersistentList
 
     """
-    return loads(_file.read())
+    return loads(
+        _file.read(), engine=engine, packrat=packrat, stats=stats, compact=compact
+    )
+
+
+def _wrapped(tree, compact):
+    """Returns the parsed tree as an UnspacedList, or compacted"""
+    if compact:
+        with profiling.stage("compact"):
+            return _compacted(tree, compact)
+    with profiling.stage("tree"):
+        return UnspacedList.adopt(tree)
+
+
+def _compacted(tree, compact):
+    """Returns tree as a compact PersistentList, interned with compact if
+    it is an Interner."""
+    # persistent builds on this module
+    from .persistent import Interner, compact as compact_tree
+
+    return compact_tree(tree, compact if isinstance(compact, Interner) else None)
 
 
 def dumps(blocks):
@@ -206,7 +380,8 @@ def dumps(blocks):
     :rtype: str
 
     """
-    return str(NginxDumper(blocks.spaced))
+    with profiling.stage("dump"):
+        return str(NginxDumper(blocks.spaced))
 
 
 def dump(blocks, _file):
@@ -218,7 +393,61 @@ def dump(blocks, _file):
     :rtype: NoneType
 
     """
-    return _file.write(dumps(blocks))
+    with profiling.stage("dump"):
+        return NginxDumper(blocks.spaced).write(_file)
+
+
+def dumps_binary(blocks):
+    """Dump to the compact binary format, whitespace included.
+
+    :param UnspacedList blocks: The parsed tree
+    :rtype: bytes
+
+    """
+    return binary.encode(blocks.spaced)
+
+
+def dump_binary(blocks, _file):
+    """Dump to a binary file in the compact binary format.
+
+    :param UnspacedList blocks: The parsed tree
+    :param file _file: The binary file to dump to
+    :returns: The number of bytes written
+    :rtype: int
+
+    """
+    return _file.write(dumps_binary(blocks))
+
+
+def loads_binary(data):
+    """Loads a tree dumped with dumps_binary().
+
+    :param bytes data: The encoded tree
+    :returns: The tree, dumping exactly like the one encoded
+    :rtype: UnspacedList
+    :raises ValueError: If data is not in a supported binary format
+
+    """
+    return UnspacedList.adopt(binary.decode(data))
+
+
+def load_binary(_file):
+    """Loads a tree from a binary file written by dump_binary(), mapping
+    the file in memory when possible instead of reading it.
+
+    :param file _file: The binary file to load from
+    :returns: The tree
+    :rtype: UnspacedList
+
+    """
+    try:
+        fileno = _file.fileno()
+    except (AttributeError, OSError):
+        return loads_binary(_file.read())
+    if _file.tell() or not os.fstat(fileno).st_size:
+        return loads_binary(_file.read())
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as data:
+        return loads_binary(data)
 
 
 class BaseDirective(object):
@@ -226,12 +455,19 @@ class BaseDirective(object):
     Simple representation for a config directive for Nginx
     """
 
+    __slots__ = ("key", "value", "parent", "raw")
+
     def __init__(self, key=None, value=None, parent=None, raw=None):
         self.key = key
         self.value = value
         self.parent = parent
         self.raw = raw
 
+    @property
+    def name(self):
+        """The first word of the key, under which the parent indexes it"""
+        return self.key[0] if isinstance(self.key, list) and self.key else self.key
+
     def __repr__(self):
         return "Base(key=%r, value=%r)" % (self.key, self.value)
 
@@ -241,11 +477,83 @@ class BaseDirective(object):
 
 class BlockDirective(BaseDirective):
     """
-    Simple representation for a block with more directives
+    Simple representation for a block with more directives,
+    indexing its children by name on the first lookup
     """
 
+    __slots__ = ("index",)
+
     def __init__(self, key=None, value=None, parent=None, raw=None):
-        super(BlockDirective, self).__init__(key, value, parent, raw)
+        self.key = key
+        self.value = value
+        self.parent = parent
+        self.raw = raw
+        self.index = None
+
+    def append(self, child):
+        """
+        Adds a child directive, keeping the index up to date
+        :param child:
+        :return: child
+        """
+        self.value.append(child)
+        if self.index is not None:
+            self.index.setdefault(child.name, []).append(child)
+        return child
+
+    def reindex(self):
+        """
+        Drops the name index, needed after changing value directly
+        :return:
+        """
+        self.index = None
+
+    def children(self, name):
+        """
+        Returns the children with the given name, in config order
+        :param name: directive name or block key
+        :return:
+        """
+        if self.index is None:
+            self.index = {}
+            for child in self.value:
+                self.index.setdefault(child.name, []).append(child)
+        key = name[0] if isinstance(name, list) and name else name
+        return [
+            sub
+            for sub in self.index.get(key, ())
+            if sub.key == name or sub.key == [name]
+        ]
+
+    @property
+    def body(self):
+        """The list of rows of the config this block stands for"""
+        return self.raw if self.key is None else self.raw[1]
+
+    def insert(self, i, row):
+        """
+        Inserts a row (or a detached directive) before child i, updating
+        the config and this block only
+        :param int i:
+        :param row: config row or BaseDirective
+        :return: the directive inserted
+        """
+        return ModelBatch().insert(self, i, row).apply()[0]
+
+    def remove(self, child):
+        """
+        Removes a child directive, found by identity
+        :param child:
+        :return:
+        """
+        ModelBatch().remove(child).apply()
+
+    def replace(self, child, row):
+        """
+        Replaces a child directive by a row (or a detached directive)
+        :return: the directive inserted
+        """
+        return ModelBatch().replace(child, row).apply()[0]
 
     def __repr__(self):
         return "Block(key=%r, dirs=%r)" % (self.key, self.value)
@@ -253,30 +561,33 @@ class BlockDirective(BaseDirective):
 
 def build_model(cfg, parent=None):
     """
-    Returns model version of the config
+    Returns model version of the config, built in a single pass
     :param cfg:
     :param parent:
     :return:
     """
     # If not a list -> directive, return
-    if not isinstance(cfg, types.ListType):
+    if not isinstance(cfg, list):
         return [BaseDirective(parent=parent, raw=cfg)]
 
     # Assume blocks.
     root = BlockDirective(value=[], parent=parent, raw=cfg)
-    for sub in cfg:
-        if not isinstance(sub, types.ListType):
-            raise ValueError("Directive expected: %s" % sub)
-
-        if isinstance(sub[1], types.ListType):
-            sub_block = build_model(sub[1], parent=root)
-            sub_block.key = sub[0]
-            sub_block.raw = sub
-            root.value.append(sub_block)
+    stack = [(root, cfg)]
+    while stack:
+        block, rows = stack.pop()
+        append = block.value.append
+        for sub in rows:
+            if not isinstance(sub, list):
+                raise ValueError("Directive expected: %s" % sub)
+
+            if len(sub) > 1 and isinstance(sub[1], list):
+                sub_block = BlockDirective(key=sub[0], value=[], parent=block, raw=sub)
+                append(sub_block)
+                stack.append((sub_block, sub[1]))
 
-        else:
-            sub_dir = BaseDirective(key=sub[0], value=sub[1], parent=root, raw=sub)
-            root.value.append(sub_dir)
+            else:
+                value = sub[1] if len(sub) > 1 else None
+                append(BaseDirective(key=sub[0], value=value, parent=block, raw=sub))
 
     return root
 
@@ -290,6 +601,129 @@ def rebuild_model(root):
     return build_model(root.raw, None)
 
 
+def _build_row(row, parent):
+    """
+    Returns the model of a single config row
+    """
+    if len(row) > 1 and isinstance(row[1], list):
+        block = build_model(row[1], parent)
+        block.key = row[0]
+        block.raw = row
+        return block
+    value = row[1] if len(row) > 1 else None
+    return BaseDirective(key=row[0], value=value, parent=parent, raw=row)
+
+
+class ModelBatch(object):
+    """
+    Edits of a directive model and its config applied together: every
+    block touched is rewritten once, whatever the number of edits in it.
+    Children are found by identity and indexes refer to the blocks as they
+    are before apply().
+    """
+
+    def __init__(self):
+        # id(block) -> [block, {index: [(row, directive) inserted before it]},
+        #               {index: (row, directive) replacing it or None},
+        #               {id(child): index} built on the first removal]
+        self._blocks = {}
+        self._inserted = []
+
+    def _edits(self, block):
+        if id(block) not in self._blocks:
+            self._blocks[id(block)] = [block, {}, {}, None]
+        return self._blocks[id(block)]
+
+    def _position(self, child):
+        if child.parent is None:
+            raise ValueError("Cannot remove parentless entry")
+        edits = self._edits(child.parent)
+        if edits[3] is None:
+            edits[3] = {id(sibling): i for i, sibling in enumerate(child.parent.value)}
+        i = edits[3].get(id(child))
+        if i is None:
+            raise ValueError("Malformed model, element not present in the parent")
+        if i in edits[2]:
+            raise ValueError("Element already removed or replaced")
+        return edits[2], i
+
+    def insert(self, block, i, row):
+        """
+        Inserts a row or a detached directive before child i of block,
+        at the end when i is None
+        """
+        size = len(block.value)
+        if i is None or i > size:
+            i = size
+        elif i < 0:
+            i = max(size + i, 0)
+        self._edits(block)[1].setdefault(i, []).append(self._entry(row))
+        return self
+
+    def remove(self, child):
+        replaced, i = self._position(child)
+        replaced[i] = None
+        return self
+
+    def replace(self, child, row):
+        replaced, i = self._position(child)
+        replaced[i] = self._entry(row)
+        return self
+
+    def move(self, child, block, i=None):
+        """
+        Moves a child directive before child i of another (or the same) block
+        """
+        self.remove(child)
+        return self.insert(block, i, child)
+
+    def _entry(self, row):
+        """
+        Returns the (row, directive) to insert; rows become UnspacedLists
+        so the model keeps pointing at what the config holds
+        """
+        if isinstance(row, BaseDirective):
+            child = row
+        else:
+            if not isinstance(row, UnspacedList):
+                row = UnspacedList(row)
+            child = _build_row(row, None)
+        self._inserted.append(child)
+        return child.raw, child
+
+    def apply(self):
+        """
+        Applies the edits
+        :return: the directives inserted or replacing others, in the order
+            they were added
+        """
+        for block, inserts, replaced, _ in self._blocks.values():
+            changes = []
+            value = []
+            done = 0
+            for i in sorted(set(inserts) | set(replaced)):
+                value.extend(block.value[done:i])
+                entries = list(inserts.get(i, ()))
+                stop = i
+                if i in replaced:
+                    stop = i + 1
+                    if replaced[i] is not None:
+                        entries.append(replaced[i])
+                for _, child in entries:
+                    child.parent = block
+                    value.append(child)
+                changes.append((i, stop, [row for row, _ in entries]))
+                done = stop
+            value.extend(block.value[done:])
+            block.body._splice_many(changes)
+            block.value[:] = value
+            block.reindex()
+        res = self._inserted
+        self._blocks = {}
+        self._inserted = []
+        return res
+
+
 def find_in_model(model, path):
     """
     Finding elements defined by the path array in the configuration model.
@@ -301,51 +735,43 @@ def find_in_model(model, path):
     if path is None:
         path = []
 
+    ret_value = []
+    _find_in_model(model, path, 0, ret_value)
+    return ret_value
+
+
+def _find_in_model(model, path, depth, ret_value):
     # End of the search, the whole path was reduced
-    if len(path) == 0:
-        return [model]
+    if depth == len(path):
+        ret_value.append(model)
+        return
 
-    # Assume blocks.
-    ret_value = []
-    target = model if isinstance(model, types.ListType) else model.value
+    if isinstance(model, list):
+        target = [
+            sub for sub in model if sub.key == path[depth] or sub.key == [path[depth]]
+        ]
+    else:
+        target = model.children(path[depth])
 
     for sub in target:
-        if sub.key == path[0] or sub.key == [path[0]]:
-            if isinstance(sub, BlockDirective):
-                ret_value += find_in_model(sub, path[1:])
-            elif isinstance(sub, BaseDirective):
-                ret_value += [sub]
-            else:
-                raise ValueError("Unexpected model type")
-
-    return ret_value
+        if isinstance(sub, BlockDirective):
+            _find_in_model(sub, path, depth + 1, ret_value)
+        elif isinstance(sub, BaseDirective):
+            ret_value.append(sub)
+        else:
+            raise ValueError("Unexpected model type")
 
 
-def remove_from_model(root, element, rebuild=True):
+def remove_from_model(root, element, rebuild=False):
     """
-    Removes given element from the model.
-    The root needs to be rebuild
+    Removes given element from the model and the config, updating only
+    its parent block
     :param root:
     :param element:
-    :param rebuild:
-    :return: new root
+    :param rebuild: rebuild the whole model afterwards
+    :return: root, or the new root with rebuild
     """
-    if element.parent is None:
-        raise ValueError("Cannot remove parentless entry")
-
-    if element.raw not in element.parent.raw[1]:
-        raise ValueError("Malformed model, element not present in the parent")
-
-    idx = None
-    for i, x in enumerate(element.parent.raw[1]):
-        if x == element.raw:
-            idx = i
-            break
-
-    if idx is None:
-        raise ValueError("Not found")
-
-    del element.parent.raw[1][idx]
+    ModelBatch().remove(element).apply()
 
     if rebuild:
         return rebuild_model(root)
@@ -360,31 +786,31 @@ def find_elems(cfg, path):
     :param path: [server, http, error_log]
     :return:
     """
-    # If not a list -> directive, return
-    if not isinstance(cfg, types.ListType):
-        return [cfg]
-
     if path is None:
         path = []
 
-    # End of the search, the whole path was reduced
-    if len(path) == 0:
-        return [cfg]
+    ret_value = []
+    _find_elems(cfg, path, 0, ret_value)
+    return ret_value
+
+
+def _find_elems(cfg, path, depth, ret_value):
+    # If not a list -> directive; or the whole path was reduced
+    if not isinstance(cfg, list) or depth == len(path):
+        ret_value.append(cfg)
+        return
 
     # Assume blocks.
-    ret_value = []
     for sub in cfg:
-        if not isinstance(sub, types.ListType):
+        if not isinstance(sub, list):
             raise ValueError("Directive expected: %s" % sub)
 
         if len(sub) != 2:
             logger.debug("Sub block has invalid length %s" % sub)
             continue
 
-        if sub[0] == path[0] or sub[0] == [path[0]]:
-            ret_value += find_elems(sub[1], path[1:])
-
-    return ret_value
+        if sub[0] == path[depth] or sub[0] == [path[depth]]:
+            _find_elems(sub[1], path, depth + 1, ret_value)
 
 
 def spacey(x):
@@ -396,21 +822,50 @@ class UnspacedList(list):
 
     def __init__(self, list_source):
         # ensure our argument is not a generator, and duplicate any sublists
-        self.spaced = copy.deepcopy(list(list_source))
-        self.dirty = False
+        self._wrap(list(list_source), True)
 
-        # Turn self into a version of the source list that has spaces removed
-        # and all sub-lists also UnspacedList()ed
-        list.__init__(self, list_source)
-        for i, entry in reversed(list(enumerate(self))):
+    @classmethod
+    def adopt(cls, spaced):
+        """
+        Wrap a freshly parsed tree, reusing its lists as the spaced view
+        instead of copying them. The tree must not be used elsewhere.
+        """
+        res = cls.__new__(cls)
+        res._wrap(spaced, False)
+        return res
+
+    def _wrap(self, spaced, copy_sublists):
+        """
+        Turn self into a version of the spaced list that has spaces removed
+        and all sub-lists also UnspacedList()ed, in a single pass sharing
+        the leaf strings with the spaced view
+        """
+        unspaced = []
+        comment = False
+        for i, entry in enumerate(spaced):
             if isinstance(entry, list):
-                sublist = UnspacedList(entry)
-                list.__setitem__(self, i, sublist)
-                self.spaced[i] = sublist.spaced
-            elif spacey(entry):
-                # don't delete comments
-                if "#" not in self[:i]:
-                    list.__delitem__(self, i)
+                lazy = entry.spaced if type(entry) is LazyUnspacedList else entry
+                if type(lazy) is LazyBody:
+                    # innards not parsed yet stay so, copies included
+                    if copy_sublists or lazy is not entry:
+                        lazy = lazy.clone()
+                    spaced[i] = lazy
+                    unspaced.append(LazyUnspacedList.of(lazy))
+                    continue
+                sublist = UnspacedList.__new__(UnspacedList)
+                if copy_sublists or isinstance(entry, UnspacedList):
+                    entry = list(entry)
+                sublist._wrap(entry, copy_sublists)
+                spaced[i] = sublist.spaced
+                unspaced.append(sublist)
+            # don't delete comments
+            elif comment or not spacey(entry):
+                comment = comment or entry == "#"
+                unspaced.append(entry)
+        list.__init__(self, unspaced)
+        self.spaced = spaced
+        self.dirty = False
+        self._positions = None
 
     def _coerce(self, inbound):
         """
@@ -429,20 +884,32 @@ class UnspacedList(list):
             return inbound, inbound.spaced
 
     def insert(self, i, x):
-        item, spaced_item = self._coerce(x)
-        slicepos = self._spaced_position(i) if i < len(self) else len(self.spaced)
-        self.spaced.insert(slicepos, spaced_item)
-        list.insert(self, i, item)
-        self.dirty = True
+        # Clamp like list.insert() does
+        i = min(max(len(self) + i, 0) if i < 0 else i, len(self))
+        self._splice(i, i, [x])
 
     def append(self, x):
-        item, spaced_item = self._coerce(x)
-        self.spaced.append(spaced_item)
-        list.append(self, item)
-        self.dirty = True
+        if self._positions is None and (
+            isinstance(x, list) or (isinstance(x, str) and not spacey(x))
+        ):
+            # The lazily computed index will see x, no need to build it now
+            item, spaced_item = self._coerce(x)
+            self.spaced.append(spaced_item)
+            list.append(self, item)
+            self.dirty = True
+            return
+        self._splice(len(self), len(self), [x])
 
     def extend(self, x):
+        if not isinstance(x, UnspacedList):
+            # tuples, iterators...
+            x = UnspacedList(list(x))
         item, spaced_item = self._coerce(x)
+        positions = self._index()
+        offset = len(self.spaced)
+        # taken before growing, item may be self
+        new = [offset + pos for pos in item._index()]
+        positions.extend(new)
         self.spaced.extend(spaced_item)
         list.extend(self, item)
         self.dirty = True
@@ -453,11 +920,13 @@ class UnspacedList(list):
         res.dirty = True
         return res
 
-    def pop(self, _i=None):
-        raise NotImplementedError("UnspacedList.pop() not yet implemented")
+    def pop(self, i=-1):
+        item = self[i]
+        del self[i]
+        return item
 
-    def remove(self, _):
-        raise NotImplementedError("UnspacedList.remove() not yet implemented")
+    def remove(self, x):
+        del self[self.index(x)]
 
     def reverse(self):
         raise NotImplementedError("UnspacedList.reverse() not yet implemented")
@@ -465,52 +934,195 @@ class UnspacedList(list):
     def sort(self, _cmp=None, _key=None, _Rev=None):
         raise NotImplementedError("UnspacedList.sort() not yet implemented")
 
-    def __setslice__(self, _i, _j, _newslice):
-        raise NotImplementedError(
-            "Slice operations on UnspacedLists not yet implemented"
-        )
-
     def __setitem__(self, i, value):
         if isinstance(i, slice):
-            raise NotImplementedError(
-                "Slice operations on UnspacedLists not yet implemented"
-            )
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                self._splice(start, max(start, stop), list(value))
+                return
+            indexes = range(start, stop, step)
+            values = list(value)
+            if len(values) != len(indexes):
+                raise ValueError(
+                    "attempt to assign sequence of size %d to extended slice of size %d"
+                    % (len(values), len(indexes))
+                )
+            for idx, val in zip(indexes, values):
+                self[idx] = val
+            return
         item, spaced_item = self._coerce(value)
         self.spaced.__setitem__(self._spaced_position(i), spaced_item)
         list.__setitem__(self, i, item)
         self.dirty = True
 
     def __delitem__(self, i):
-        self.spaced.__delitem__(self._spaced_position(i))
-        list.__delitem__(self, i)
-        self.dirty = True
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                self._splice(start, max(start, stop), [])
+                return
+            for idx in sorted(range(start, stop, step), reverse=True):
+                del self[idx]
+            return
+        if i < 0:
+            i = len(self) + i
+        if not 0 <= i < len(self):
+            raise IndexError("list index out of range")
+        self._splice(i, i + 1, [])
 
     def __deepcopy__(self, memo):
-        res = UnspacedList(self[:])
-        res.spaced = copy.deepcopy(self.spaced, memo=memo)
+        # Rebuilding from the spaced view copies every list exactly once
+        res = UnspacedList(self.spaced)
         res.dirty = self.dirty
         return res
 
+    def __reduce_ex__(self, protocol):
+        # Rebuilt from the spaced view too: the default reduction restores
+        # the items with extend() before the attributes it needs
+        return UnspacedList, (self.spaced,), {"dirty": self.dirty}
+
     def is_dirty(self):
         """Recurse through the parse tree to figure out if any sublists are dirty"""
         if self.dirty:
             return True
         return any((isinstance(x, list) and x.is_dirty() for x in self))
 
+    def _index(self):
+        """
+        Returns the positions in the spaced list of each unspaced item,
+        computed on first use and then kept up to date by every mutation
+        """
+        if self._positions is None:
+            positions = []
+            comment = False
+            for pos, entry in enumerate(self.spaced):
+                # same rule as _wrap()
+                if isinstance(entry, list) or comment or not spacey(entry):
+                    comment = comment or entry == "#"
+                    positions.append(pos)
+            self._positions = positions
+        return self._positions
+
+    def _splice(self, start, stop, values):
+        """Replace unspaced items [start:stop] with values, keeping spaced in sync"""
+        positions = self._index()
+        spaced = self.spaced
+        coerced = [self._coerce(value) for value in values]
+        at = positions[start] if start < len(positions) else len(spaced)
+        for pos in reversed(positions[start:stop]):
+            del spaced[pos]
+        spaced[at:at] = [spaced_item for _, spaced_item in coerced]
+        shift = len(coerced) - (stop - start)
+        positions[start:] = list(range(at, at + len(coerced))) + [
+            pos + shift for pos in positions[stop:]
+        ]
+        list.__setitem__(self, slice(start, stop), [item for item, _ in coerced])
+        self.dirty = True
+
+    def _splice_many(self, changes):
+        """
+        Apply several (start, stop, values) replacements of unspaced items,
+        sorted and not overlapping, in a single pass; the result is the same
+        as applying them with _splice() from the last one to the first
+        """
+        if not changes:
+            return
+        positions = self._index()
+        old_spaced = self.spaced
+        spaced, items = [], []
+        pos = done = 0  # next spaced entry and unspaced item to copy
+        for start, stop, values in changes:
+            at = positions[start] if start < len(positions) else len(old_spaced)
+            spaced.extend(old_spaced[pos:at])
+            items.extend(list.__getitem__(self, slice(done, start)))
+            for value in values:
+                item, spaced_item = self._coerce(value)
+                items.append(item)
+                spaced.append(spaced_item)
+            # drop the items replaced, keeping the whitespace between them
+            pos = at
+            for removed in positions[start:stop]:
+                spaced.extend(old_spaced[pos:removed])
+                pos = removed + 1
+            done = stop
+        spaced.extend(old_spaced[pos:])
+        items.extend(list.__getitem__(self, slice(done, len(self))))
+        # the spaced list is shared with the parent's spaced view
+        old_spaced[:] = spaced
+        list.__setitem__(self, slice(None), items)
+        self._positions = None
+        self.dirty = True
+
     def _spaced_position(self, idx):
         """Convert from indexes in the unspaced list to positions in the spaced one"""
-        pos = spaces = 0
-        # Normalize indexes like list[-1] etc, and save the result
+        # Normalize indexes like list[-1] etc
         if idx < 0:
             idx = len(self) + idx
         if not 0 <= idx < len(self):
             raise IndexError("list index out of range")
-        idx0 = idx
-        # Count the number of spaces in the spaced list before idx in the unspaced one
-        while idx != -1:
-            if spacey(self.spaced[pos]):
-                spaces += 1
-            else:
-                idx -= 1
-            pos += 1
-        return idx0 + spaces
+        return self._index()[idx]
+
+
+class LazyUnspacedList(UnspacedList):
+    """
+    An UnspacedList of block innards not parsed yet, its spaced view being
+    their LazyBody: they are parsed on first use, which turns it into a
+    plain UnspacedList
+    """
+
+    @classmethod
+    def of(cls, body):
+        """Wraps the LazyBody body"""
+        res = cls.__new__(cls)
+        res.spaced = body
+        res.dirty = False
+        res._positions = None
+        return res
+
+    def bare(self):
+        """
+        Returns a copy of the innards that will have no whitespace entries,
+        still not parsed
+        """
+        return LazyUnspacedList.of(self.spaced.clone(bare=True))
+
+    def _parse(self):
+        spaced = self.spaced.parse()
+        self.__class__ = UnspacedList
+        self._wrap(spaced, False)
+
+    def is_dirty(self):
+        return False
+
+    def __radd__(self, other):
+        # tried before list.__add__, which reads the still empty list storage
+        if not isinstance(other, list):
+            return NotImplemented
+        self._parse()
+        return other + self
+
+    def __reduce_ex__(self, protocol):
+        # pickled (and copied) as the plain UnspacedList of the parsed innards
+        self._parse()
+        return self.__reduce_ex__(protocol)
+
+
+def _parsing_first(name):
+    method = getattr(UnspacedList, name)
+
+    def parse_first(self, *args):
+        self._parse()
+        return method(self, *args)
+
+    parse_first.__name__ = name
+    return parse_first
+
+
+for _name in LIST_METHODS + (
+    "__deepcopy__",
+    "_index",
+    "_splice",
+    "_splice_many",
+    "_spaced_position",
+):
+    setattr(LazyUnspacedList, _name, _parsing_first(_name))
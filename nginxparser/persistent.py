@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Immutable configuration trees with structural sharing.
+
+:class:`PersistentList` is the immutable counterpart of
+:class:`~nginxparser.nginxparser.UnspacedList`: it hides whitespace the
+same way and keeps the spaced view (nested tuples) for dumping, but every
+edit returns a new list.  An edit deep in the tree rebuilds only the lists
+on the path to it and shares every other subtree with the original, so
+keeping the previous root as a snapshot costs nothing::
+
+    >>> tree = PersistentList.from_unspaced(loads(source))
+    >>> edited = tree.set_in([0, 1, 2, 1], "8080")  # old tree unchanged
+    >>> dumps(edited)
+    >>> edited.to_unspaced()  # back to a mutable tree
+
+Being immutable, equal subtrees can also be shared within and between
+trees: :func:`compact` interns every string and builds each distinct
+subtree only once, which is what ``loads(..., compact=True)`` returns.
+"""
+
+from .nginxparser import UnspacedList, spacey
+
+
+class PersistentList(object):
+    """
+    An immutable list of strings and PersistentLists with whitespace
+    entries hidden, like UnspacedList, and its spaced view as tuples
+    """
+
+    # digest is the fingerprint of nginxparser.diff, set on first use
+    __slots__ = ("items", "spaced", "positions", "digest")
+
+    def __new__(cls, list_source=()):
+        return _freeze(list_source)
+
+    @classmethod
+    def _make(cls, items, spaced, positions):
+        res = object.__new__(cls)
+        res.items = items
+        res.spaced = spaced
+        res.positions = positions  # index in spaced of every item
+        return res
+
+    @classmethod
+    def _from_entries(cls, entries):
+        """
+        Builds a list from spaced entries whose sublists are already frozen
+        """
+        items, spaced, positions = [], [], []
+        comment = False
+        for pos, entry in enumerate(entries):
+            if isinstance(entry, PersistentList):
+                items.append(entry)
+                spaced.append(entry.spaced)
+                positions.append(pos)
+                continue
+            spaced.append(entry)
+            # don't delete comments, same rule as UnspacedList
+            if comment or not spacey(entry):
+                comment = comment or entry == "#"
+                items.append(entry)
+                positions.append(pos)
+        return cls._make(tuple(items), tuple(spaced), tuple(positions))
+
+    @classmethod
+    def from_unspaced(cls, unspaced):
+        """
+        Freezes an UnspacedList, keeping its whitespace
+        :param UnspacedList unspaced:
+        :return: PersistentList
+        """
+        return _freeze(unspaced.spaced)
+
+    def to_unspaced(self):
+        """
+        Returns a mutable copy of the tree
+        :return: UnspacedList
+        """
+        return UnspacedList.adopt(_thaw(self.spaced))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self.items[i])
+        return self.items[i]
+
+    def __eq__(self, other):
+        if isinstance(other, PersistentList):
+            return self.items == other.items
+        if isinstance(other, (list, tuple)):
+            return len(self.items) == len(other) and all(
+                a == b for a, b in zip(self.items, other)
+            )
+        return NotImplemented
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        return res if res is NotImplemented else not res
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self):
+        return "PersistentList(%r)" % (list(self.items),)
+
+    def _index(self, i, insert=False):
+        size = len(self.items)
+        if i < 0:
+            i += size
+        if insert:
+            return min(max(i, 0), size)
+        if not 0 <= i < size:
+            raise IndexError("list index out of range")
+        return i
+
+    def _splice(self, start, stop, values):
+        """
+        Returns a list with items [start:stop] replaced by values, placed
+        in the spaced view the way UnspacedList does it
+        """
+        coerced = [_coerce(value) for value in values]
+        positions = self.positions
+        at = positions[start] if start < len(positions) else len(self.spaced)
+        spaced = list(self.spaced)
+        for pos in reversed(positions[start:stop]):
+            del spaced[pos]
+        spaced[at:at] = [spaced_item for _, spaced_item in coerced]
+        shift = len(coerced) - (stop - start)
+        return self._make(
+            self.items[:start] + tuple(item for item, _ in coerced) + self.items[stop:],
+            tuple(spaced),
+            positions[:start]
+            + tuple(range(at, at + len(coerced)))
+            + tuple(pos + shift for pos in positions[stop:]),
+        )
+
+    def set(self, i, value):
+        """
+        Returns a list with item i replaced by value
+        """
+        i = self._index(i)
+        item, spaced_item = _coerce(value)
+        spaced = list(self.spaced)
+        spaced[self.positions[i]] = spaced_item
+        items = self.items[:i] + (item,) + self.items[i + 1 :]
+        # the positions do not move and are shared
+        return self._make(items, tuple(spaced), self.positions)
+
+    def insert(self, i, value):
+        """
+        Returns a list with value inserted before item i
+        """
+        i = self._index(i, insert=True)
+        return self._splice(i, i, [value])
+
+    def append(self, value):
+        return self._splice(len(self.items), len(self.items), [value])
+
+    def extend(self, values):
+        return self._splice(len(self.items), len(self.items), list(values))
+
+    def delete(self, i):
+        """
+        Returns a list without item i
+        """
+        i = self._index(i)
+        return self._splice(i, i + 1, [])
+
+    def get_in(self, path):
+        """
+        Returns the item at path, a sequence of indexes
+        """
+        node = self
+        for i in path:
+            node = node[i]
+        return node
+
+    def update_in(self, path, func):
+        """
+        Returns a tree with the item at path replaced by func(item); only
+        the lists on the path are rebuilt, everything else is shared
+        """
+        return self._edit(path, lambda node, i: node.set(i, func(node[i])))
+
+    def set_in(self, path, value):
+        return self._edit(path, lambda node, i: node.set(i, value))
+
+    def insert_in(self, path, value):
+        """
+        Returns a tree with value inserted before the item at path
+        """
+        return self._edit(path, lambda node, i: node.insert(i, value))
+
+    def delete_in(self, path):
+        return self._edit(path, lambda node, i: node.delete(i))
+
+    def _edit(self, path, operation):
+        if not path:
+            raise ValueError("Empty path")
+        nodes = [self]
+        for i in path[:-1]:
+            node = nodes[-1][i]
+            if not isinstance(node, PersistentList):
+                raise TypeError("%r is not a list" % (node,))
+            nodes.append(node)
+        res = operation(nodes.pop(), path[-1])
+        for i in reversed(path[:-1]):
+            res = nodes.pop().set(i, res)
+        return res
+
+
+class Interner(object):
+    """
+    Builds PersistentLists where equal strings, whitespace included, are
+    the same object and a subtree equal to one built before is that very
+    PersistentList (hash-consing).  The tables keep everything built alive:
+    share an Interner between trees to share their common parts, and drop
+    it once they are built.
+    """
+
+    def __init__(self):
+        self.strings = {}
+        self.nodes = {}
+        self.positions = {}
+
+    def freeze(self, source):
+        """
+        Builds a compact PersistentList from a tree, without recursion
+        :param source: UnspacedList, PersistentList or spaced tree of lists
+        :return: PersistentList
+        """
+        strings, nodes, positions = self.strings, self.nodes, self.positions
+        stack = [(iter(getattr(source, "spaced", source)), [], [])]
+        while True:
+            entries, converted, key = stack[-1]
+            for entry in entries:
+                if isinstance(entry, str):
+                    entry = strings.setdefault(entry, entry)
+                    converted.append(entry)
+                    key.append(entry)
+                elif isinstance(entry, (list, tuple)):
+                    stack.append((iter(entry), [], []))
+                    break
+                else:
+                    converted.append(entry)
+                    key.append(entry)
+            else:
+                stack.pop()
+                # children are unique by now, so their identity stands for them
+                key = tuple(key)
+                node = nodes.get(key)
+                if node is None:
+                    node = PersistentList._from_entries(converted)
+                    node.positions = positions.setdefault(
+                        node.positions, node.positions
+                    )
+                    nodes[key] = node
+                if not stack:
+                    return node
+                stack[-1][1].append(node)
+                stack[-1][2].append(id(node))
+
+
+def compact(tree, interner=None):
+    """
+    Returns tree as a PersistentList sharing equal strings and subtrees
+    :param tree: UnspacedList, PersistentList or spaced tree of lists
+    :param Interner interner: tables to share with other trees, if any
+    :return: PersistentList
+    """
+    if interner is None:
+        interner = Interner()
+    return interner.freeze(tree)
+
+
+def _coerce(value):
+    """
+    Returns the (item, spaced item) for a value put in a PersistentList
+    """
+    if isinstance(value, PersistentList):
+        return value, value.spaced
+    if isinstance(value, UnspacedList):
+        value = _freeze(value.spaced)
+        return value, value.spaced
+    if isinstance(value, (list, tuple)):
+        value = _freeze(value)
+        return value, value.spaced
+    return value, value
+
+
+def _freeze(source):
+    """
+    Builds a PersistentList from a spaced tree of lists or tuples,
+    without recursion so deep trees are fine
+    """
+    if isinstance(source, PersistentList):
+        return source
+    stack = [(iter(source), [])]
+    while True:
+        entries, converted = stack[-1]
+        for entry in entries:
+            if isinstance(entry, (list, tuple)):
+                stack.append((iter(entry), []))
+                break
+            converted.append(entry)
+        else:
+            stack.pop()
+            node = PersistentList._from_entries(converted)
+            if not stack:
+                return node
+            stack[-1][1].append(node)
+
+
+def _thaw(spaced):
+    """
+    Returns the spaced tuples as fresh nested lists
+    """
+    root = []
+    stack = [(iter(spaced), root)]
+    while stack:
+        entries, res = stack[-1]
+        for entry in entries:
+            if isinstance(entry, tuple):
+                sub = []
+                res.append(sub)
+                stack.append((iter(entry), sub))
+                break
+            res.append(entry)
+        else:
+            stack.pop()
+    return root
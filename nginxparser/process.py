@@ -1,7 +1,19 @@
 import typing as t
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import marshal
 import pathlib
+import os
 import os.path
-from .nginxparser import load, UnspacedList
+import sys
+import time
+from . import profiling
+from .nginxparser import loads, UnspacedList
+from .events import Event, iterparse, DIRECTIVE
+from .lazy import LazyBody
+from .persistent import Interner, PersistentList, compact as compact_tree
 
 _nginx_cmd_type = str | list[str]
 _nginx_row_type = tuple[_nginx_cmd_type, str | UnspacedList]
@@ -9,34 +21,682 @@ _nginx_type = UnspacedList
 _T = t.TypeVar("_T")
 
 
+class ParseCache:
+    """
+    Parsed configuration files keyed by their identity on disk: resolved
+    path, mtime and size (plus a hash of the content with hash_content).
+    Every load hands out a fresh UnspacedList built from the cached tree,
+    so callers may modify what they get. The least recently used trees are
+    evicted once their files add up to more than max_bytes. With cache_dir
+    the trees are also persisted there with marshal, one file per path.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 2**20,
+        cache_dir: str | pathlib.Path | None = None,
+        hash_content: bool = False,
+    ):
+        self.max_bytes = max_bytes
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+        self.hash_content = hash_content
+        self.hits = self.misses = self.disk_hits = 0
+        self.total_bytes = 0
+        self._trees: collections.OrderedDict[
+            str, tuple[tuple[t.Any, ...], list[t.Any], int]
+        ] = collections.OrderedDict()
+
+    def key(self, path: pathlib.Path) -> tuple[t.Any, ...]:
+        st = path.stat()
+        key: tuple[t.Any, ...] = (str(path), st.st_mtime_ns, st.st_size)
+        if self.hash_content:
+            key += (hashlib.sha1(path.read_bytes()).hexdigest(),)
+        return key
+
+    def load(
+        self,
+        path: pathlib.Path,
+        engine: str = "pyparsing",
+        packrat: int | None = None,
+        stats: dict[str, int] | None = None,
+    ) -> UnspacedList:
+        key, tree = self.lookup(path)
+        if tree is None:
+            tree, file_stats = _parse_file(pathlib.Path(key[0]), engine, packrat)
+            _add_stats(stats, file_stats)
+            self.store(key, tree)
+        with profiling.stage("tree"):
+            return UnspacedList(tree)
+
+    def lookup(
+        self, path: pathlib.Path
+    ) -> tuple[tuple[t.Any, ...], list[t.Any] | None]:
+        """Returns the key of path and its cached spaced tree, if any"""
+        key = self.key(path.resolve())
+        tree = self._cached(key)
+        if tree is None:
+            tree = self._kept(key, self._read(key))
+        return key, tree
+
+    def store(self, key: tuple[t.Any, ...], tree: list[t.Any]) -> None:
+        """Caches the spaced tree parsed from the file identified by key"""
+        self._store(key[0], key, tree, key[2])
+        self._write(key, tree)
+
+    def clear(self) -> None:
+        self._trees.clear()
+        self.total_bytes = 0
+
+    def _cached(self, key: tuple[t.Any, ...]) -> list[t.Any] | None:
+        """Returns the tree of key held in memory, counting hits and misses"""
+        name = key[0]
+        entry = self._trees.get(name)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            profiling.count("cache.hits")
+            self._trees.move_to_end(name)
+            return entry[1]
+        self.misses += 1
+        profiling.count("cache.misses")
+        return None
+
+    def _kept(
+        self, key: tuple[t.Any, ...], tree: list[t.Any] | None
+    ) -> list[t.Any] | None:
+        """Keeps in memory the tree of key read from cache_dir, if any"""
+        if tree is not None:
+            self.disk_hits += 1
+            profiling.count("cache.disk_hits")
+            self._store(key[0], key, tree, key[2])
+        return tree
+
+    def _store(
+        self, name: str, key: tuple[t.Any, ...], tree: list[t.Any], size: int
+    ) -> None:
+        old = self._trees.pop(name, None)
+        if old is not None:
+            self.total_bytes -= old[2]
+        self._trees[name] = (key, tree, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes and len(self._trees) > 1:
+            _, (_, _, evicted) = self._trees.popitem(last=False)
+            self.total_bytes -= evicted
+
+    def _disk_path(self, key: tuple[t.Any, ...]) -> pathlib.Path | None:
+        if self.cache_dir is None:
+            return None
+        digest = hashlib.sha1(key[0].encode("utf-8", "surrogateescape")).hexdigest()
+        return self.cache_dir / (
+            "%s.%s.marshal" % (digest, sys.implementation.cache_tag)
+        )
+
+    def _read(self, key: tuple[t.Any, ...]) -> list[t.Any] | None:
+        cache_path = self._disk_path(key)
+        if cache_path is None:
+            return None
+        try:
+            with cache_path.open("rb") as f:
+                stored_key, tree = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return tree if tuple(stored_key) == key else None
+
+    def _write(self, key: tuple[t.Any, ...], tree: list[t.Any]) -> None:
+        cache_path = self._disk_path(key)
+        if cache_path is None:
+            return
+        tmp = cache_path.with_name("%s.%d.tmp" % (cache_path.name, os.getpid()))
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open("wb") as f:
+                marshal.dump((key, tree), f)
+            os.replace(tmp, cache_path)
+        except (OSError, ValueError):
+            # a cache we cannot write only costs speed
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
+
+def _parse_file(
+    path: pathlib.Path, engine: str, packrat: int | None
+) -> tuple[list[t.Any], dict[str, int]]:
+    """Returns the spaced tree of path and its packrat stats"""
+    stats: dict[str, int] = {}
+    start = time.perf_counter()
+    with profiling.stage("read"), path.open() as f:
+        text = f.read()
+        size = os.fstat(f.fileno()).st_size
+    tree = loads(text, engine=engine, packrat=packrat, stats=stats)
+    profiling.parsed_file(path, size, time.perf_counter() - start, tree)
+    return tree.spaced, stats
+
+
+class _ParsedFile(t.NamedTuple):
+    """What a worker parsing a file sends back"""
+
+    tree: list[t.Any]
+    stats: dict[str, int]
+    # what it measured, if profiled
+    profile: dict[str, t.Any] | None
+
+
+def _parse_file_sent(
+    path: pathlib.Path, engine: str, packrat: int | None, profiled: bool
+) -> _ParsedFile:
+    """_parse_file() for another process, with its profile if profiled"""
+    if not profiled:
+        tree, stats = _parse_file(path, engine, packrat)
+        return _ParsedFile(tree, stats, None)
+    with profiling.Profile() as profile:
+        tree, stats = _parse_file(path, engine, packrat)
+    return _ParsedFile(tree, stats, profile.as_dict())
+
+
+def _add_stats(stats: dict[str, int] | None, more: dict[str, int]) -> None:
+    if stats is not None:
+        for name, value in more.items():
+            stats[name] = stats.get(name, 0) + value
+
+
+def _include_paths(
+    path: pathlib.Path, arg: str, memo: dict[t.Any, list[pathlib.Path]] | None = None
+) -> list[pathlib.Path]:
+    """Files matched by include arg in path, in the sorted order nginx uses"""
+    if memo is not None:
+        # absolute includes match the same files from any file of a directory
+        memo_key = (path.parent if os.path.isabs(arg) else path, arg)
+        if memo_key not in memo:
+            memo[memo_key] = _include_paths(path, arg)
+        return memo[memo_key]
+    with profiling.stage("include.glob"):
+        rel = os.path.relpath(str(path / str(arg)), str(path.parent))
+        if not any(c in rel for c in "*?["):
+            # no need to list directories for a single file
+            p = path.parent / rel
+            return [p.resolve()] if p.exists() else []
+        return [p.resolve() for p in sorted(path.parent.glob(rel))]
+
+
+def _include_args(conf: UnspacedList) -> list[str]:
+    res = []
+    for row in conf:
+        if row[0] == "include":
+            res.append(row[1])
+        elif isinstance(row[0], list) and _may_include(row[1]):
+            res.extend(_include_args(row[1]))
+    return res
+
+
+def _may_include(innards: UnspacedList) -> bool:
+    """
+    Tells whether innards may hold includes: those left unparsed by the
+    lazy engine are only parsed if their source mentions any
+    """
+    spaced = innards.spaced
+    return type(spaced) is not LazyBody or spaced.mentions("include")
+
+
+def _included_files(conf: UnspacedList, path: pathlib.Path) -> list[pathlib.Path]:
+    return [p for arg in _include_args(conf) for p in _include_paths(path, arg)]
+
+
+def _prefetch(
+    path: pathlib.Path,
+    cache: ParseCache,
+    jobs: int | None,
+    engine: str,
+    packrat: int | None,
+    stats: dict[str, int] | None,
+) -> None:
+    """
+    Parses the include graph of path into cache in a process pool, one level
+    of includes at a time since includes are only known once parsed
+    """
+    pending = [path.resolve()]
+    seen: set[pathlib.Path] = set()
+    profile = profiling.current()
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        while pending:
+            parsed = []
+            futures = []
+            for p in pending:
+                if p in seen:
+                    continue
+                seen.add(p)
+                key, tree = cache.lookup(p)
+                if tree is None:
+                    future = pool.submit(
+                        _parse_file_sent, p, engine, packrat, profile is not None
+                    )
+                    futures.append((p, key, future))
+                else:
+                    parsed.append((p, tree))
+            for p, key, future in futures:
+                result: _ParsedFile = future.result()
+                if result.profile is not None:
+                    profile.merge(result.profile)
+                _add_stats(stats, result.stats)
+                cache.store(key, result.tree)
+                parsed.append((p, result.tree))
+            pending = [
+                included
+                for p, tree in parsed
+                for included in _included_files(UnspacedList(tree), p)
+            ]
+
+
 def load_path(
     path: pathlib.Path = pathlib.Path("/etc/nginx/nginx.conf"),
+    engine: str = "pyparsing",
+    packrat: int | None = None,
+    stats: dict[str, int] | None = None,
+    cache: ParseCache | None = None,
+    jobs: int | None = 1,
+    compact: bool | Interner = False,
+) -> UnspacedList | PersistentList:
+    """
+    Loads path and the files it includes. With jobs other than 1 the files
+    are first parsed by that many processes (all CPUs with None or 0), then
+    assembled in the same order as when loading sequentially. With compact
+    the assembled tree is returned as an immutable PersistentList sharing
+    equal strings and subtrees (with other trees too if compact is a shared
+    Interner).
+    """
+    if cache is None:
+        # files included many times are still parsed only once per load
+        cache = ParseCache()
+    if jobs != 1:
+        with profiling.stage("prefetch"):
+            _prefetch(path, cache, jobs or None, engine, packrat, stats)
+    conf = _load_path(path, engine, packrat, stats, cache)
+    if compact:
+        return compact_tree(conf, compact if isinstance(compact, Interner) else None)
+    return conf
+
+
+def _load_path(
+    path: pathlib.Path,
+    engine: str,
+    packrat: int | None,
+    stats: dict[str, int] | None,
+    cache: ParseCache,
 ) -> UnspacedList:
-    conf = load(path.open())
+    """load_path() from cache, not compacted"""
+    conf = cache.load(path, engine=engine, packrat=packrat, stats=stats)
     conf.insert(0, ["##", str(path)])
-    return load_includes(conf, path)
+    return load_includes(conf, path, engine, packrat=packrat, stats=stats, cache=cache)
 
 
 def _flatten(obj: t.Sequence[list[_T]]) -> list[_T]:
     return sum(obj, [])
 
 
-def load_includes(conf: UnspacedList, path: pathlib.Path) -> UnspacedList:
-    # conf = list(conf)
+def load_includes(
+    conf: UnspacedList,
+    path: pathlib.Path,
+    engine: str = "pyparsing",
+    packrat: int | None = None,
+    stats: dict[str, int] | None = None,
+    cache: ParseCache | None = None,
+) -> UnspacedList:
+    if cache is None:
+        cache = ParseCache()
+    return _expand_includes(
+        conf, path, lambda p: _load_path(p, engine, packrat, stats, cache)
+    )
+
+
+def _expand_includes(
+    conf: UnspacedList,
+    path: pathlib.Path,
+    load_file: t.Callable[[pathlib.Path], UnspacedList],
+    memo: dict[t.Any, list[pathlib.Path]] | None = None,
+) -> UnspacedList:
     res = UnspacedList([])
-    for cmd, arg in conf:
+    for row in conf:
+        cmd = row[0]
         if cmd == "include":
-            rel = os.path.relpath(str(path / str(arg)), str(path.parent))
-            for p in path.parent.glob(rel):
-                res.extend(load_path(p.resolve()))
+            profiling.count("includes")
+            for p in _include_paths(path, row[1], memo):
+                res.extend(load_file(p))
         elif isinstance(cmd, list):
             assert isinstance(cmd, UnspacedList)
-            res.append([cmd, load_includes(arg, path)])
+            # Rows built here carry no whitespace, so only the block head needs
+            # to be stripped and the expanded innards are not copied again
+            block = UnspacedList([list(cmd)])
+            innards = row[1]
+            if _may_include(innards):
+                innards = _expand_includes(innards, path, load_file, memo)
+            else:
+                innards = innards.bare()
+            block.append(innards)
+            res.append(block)
         else:
-            res.append([cmd, arg])
+            res.append(list(row))
     return res
 
 
+async def load_path_async(
+    path: pathlib.Path = pathlib.Path("/etc/nginx/nginx.conf"),
+    engine: str = "pyparsing",
+    packrat: int | None = None,
+    stats: dict[str, int] | None = None,
+    cache: ParseCache | None = None,
+    executor: concurrent.futures.Executor | None = None,
+    limit: int | None = None,
+    compact: bool | Interner = False,
+) -> UnspacedList | PersistentList:
+    """
+    Loads path and the files it includes like load_path(), giving the same
+    tree, without blocking the event loop: files are looked up, read and
+    globbed in threads, and parsed by executor (the loop's default one with
+    None; a ProcessPoolExecutor parses in parallel) with at most limit files
+    (one per CPU with None) parsed at once. The files included by a file
+    are parsed concurrently as soon as it is parsed.
+    """
+    if cache is None:
+        cache = ParseCache()
+    memo: dict[t.Any, list[pathlib.Path]] = {}
+    name = await asyncio.to_thread(path.resolve)
+    trees = await _fetch_async(
+        [(path, name)], cache, engine, packrat, stats, executor, limit, memo
+    )
+
+    def assemble() -> UnspacedList | PersistentList:
+        conf = _assemble(path, name, trees, memo)
+        if compact:
+            return compact_tree(
+                conf, compact if isinstance(compact, Interner) else None
+            )
+        return conf
+
+    return await asyncio.to_thread(assemble)
+
+
+async def load_includes_async(
+    conf: UnspacedList,
+    path: pathlib.Path,
+    engine: str = "pyparsing",
+    packrat: int | None = None,
+    stats: dict[str, int] | None = None,
+    cache: ParseCache | None = None,
+    executor: concurrent.futures.Executor | None = None,
+    limit: int | None = None,
+) -> UnspacedList:
+    """load_includes() without blocking the event loop, see load_path_async()"""
+    if cache is None:
+        cache = ParseCache()
+    memo: dict[t.Any, list[pathlib.Path]] = {}
+    included = await asyncio.to_thread(
+        lambda: [
+            p for arg in _include_args(conf) for p in _include_paths(path, arg, memo)
+        ]
+    )
+    trees = await _fetch_async(
+        [(p, p) for p in included], cache, engine, packrat, stats, executor, limit, memo
+    )
+    return await asyncio.to_thread(
+        _expand_includes,
+        conf,
+        path,
+        lambda p: _assemble(p, p, trees, memo),
+        memo,
+    )
+
+
+async def _fetch_async(
+    roots: list[tuple[pathlib.Path, pathlib.Path]],
+    cache: ParseCache,
+    engine: str,
+    packrat: int | None,
+    stats: dict[str, int] | None,
+    executor: concurrent.futures.Executor | None,
+    limit: int | None,
+    memo: dict[t.Any, list[pathlib.Path]],
+) -> dict[pathlib.Path, list[t.Any]]:
+    """
+    Returns the spaced trees of the (path, resolved path) roots and of the
+    files they include, by resolved path, resolving the includes into memo.
+    The cache is only changed from the event loop, so it may be shared by
+    concurrent loads.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(limit or os.cpu_count() or 1)
+    profile = profiling.current()
+    trees: dict[pathlib.Path, list[t.Any]] = {}
+    tasks: dict[pathlib.Path, asyncio.Future[None]] = {}
+
+    async def fetch(path: pathlib.Path, name: pathlib.Path) -> None:
+        key = await asyncio.to_thread(cache.key, name)
+        tree = cache._cached(key)
+        if tree is None and cache.cache_dir is not None:
+            tree = cache._kept(key, await asyncio.to_thread(cache._read, key))
+        if tree is None:
+            async with semaphore:
+                result: _ParsedFile = await loop.run_in_executor(
+                    executor,
+                    _parse_file_sent,
+                    name,
+                    engine,
+                    packrat,
+                    profile is not None,
+                )
+            if result.profile is not None:
+                profile.merge(result.profile)
+            _add_stats(stats, result.stats)
+            tree = result.tree
+            cache._store(key[0], key, tree, key[2])
+            if cache.cache_dir is not None:
+                await asyncio.to_thread(cache._write, key, tree)
+        trees[name] = tree
+        # includes are resolved relative to the path as given, like load_path()
+        included = await asyncio.to_thread(
+            lambda: [
+                p
+                for arg in _include_args(UnspacedList(tree))
+                for p in _include_paths(path, arg, memo)
+            ]
+        )
+        for p in included:
+            if p not in tasks:
+                tasks[p] = asyncio.ensure_future(fetch(p, p))
+
+    for path, name in roots:
+        if name not in tasks:
+            tasks[name] = asyncio.ensure_future(fetch(path, name))
+    try:
+        # tasks grows while files are parsed
+        while True:
+            pending = [task for task in tasks.values() if not task.done()]
+            if not pending:
+                break
+            await asyncio.gather(*pending)
+    finally:
+        for task in tasks.values():
+            task.cancel()
+    return trees
+
+
+def _assemble(
+    path: pathlib.Path,
+    name: pathlib.Path,
+    trees: dict[pathlib.Path, list[t.Any]],
+    memo: dict[t.Any, list[pathlib.Path]],
+) -> UnspacedList:
+    """load_path() of fetched trees and resolved includes, without I/O"""
+    with profiling.stage("tree"):
+        conf = UnspacedList(trees[name])
+    conf.insert(0, ["##", str(path)])
+    return _expand_includes(conf, path, lambda p: _assemble(p, p, trees, memo), memo)
+
+
+class IncrementalLoader:
+    """
+    Loads path like load_path() and keeps its include graph, so that the
+    next load() only re-parses the files that changed (or whose include
+    globs match other files now) and rebuilds the files including them.
+    Subtrees of unchanged files are shared between the loaded trees, which
+    should be treated as read-only.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path = pathlib.Path("/etc/nginx/nginx.conf"),
+        engine: str = "pyparsing",
+        packrat: int | None = None,
+        cache: ParseCache | None = None,
+        jobs: int | None = 1,
+    ):
+        self.path = path
+        self.engine = engine
+        self.packrat = packrat
+        self.cache = cache if cache is not None else ParseCache()
+        self.jobs = jobs
+        # files whose subtree was rebuilt by the last load()
+        self.rebuilt: list[pathlib.Path] = []
+        self._keys: dict[pathlib.Path, tuple[t.Any, ...]] = {}
+        self._globs: dict[pathlib.Path, tuple[pathlib.Path, list[str]]] = {}
+        self._includes: dict[pathlib.Path, list[pathlib.Path]] = {}
+        self._trees: dict[pathlib.Path, UnspacedList] = {}
+        # keys of the files the last load() failed to load, None if missing
+        self._failed: dict[pathlib.Path, tuple[t.Any, ...] | None] = {}
+
+    def changed(self) -> set[pathlib.Path]:
+        """
+        Returns the loaded files that changed since the last load(), and
+        those it failed to load which changed since
+        """
+        res = set()
+        for name, key in self._failed.items():
+            if self._key(name) != key:
+                res.add(name)
+        memo: dict[t.Any, list[pathlib.Path]] = {}
+        for name, key in self._keys.items():
+            try:
+                if self.cache.key(name) != key:
+                    res.add(name)
+                    continue
+            except OSError:
+                res.add(name)
+                continue
+            path, args = self._globs[name]
+            matched = [p for arg in args for p in _include_paths(path, arg, memo)]
+            if matched != self._includes[name]:
+                res.add(name)
+        return res
+
+    def load(self) -> UnspacedList:
+        """Returns the loaded tree, rebuilding only what changed"""
+        if not self._trees and self.jobs != 1:
+            _prefetch(
+                self.path,
+                self.cache,
+                self.jobs or None,
+                self.engine,
+                self.packrat,
+                None,
+            )
+        parents: dict[pathlib.Path, list[pathlib.Path]] = {}
+        for name, included in self._includes.items():
+            for child in included:
+                parents.setdefault(child, []).append(name)
+        stale = self.changed()
+        todo = list(stale)
+        while todo:
+            for parent in parents.get(todo.pop(), ()):
+                if parent not in stale:
+                    stale.add(parent)
+                    todo.append(parent)
+        for name in stale:
+            self._trees.pop(name, None)
+        self.rebuilt = []
+        self._failed = {}
+        tree = self._load_file(self.path)
+        # forget files which are not included anymore
+        reachable = set()
+        todo = [self.path.resolve()]
+        while todo:
+            name = todo.pop()
+            if name not in reachable:
+                reachable.add(name)
+                todo.extend(self._includes[name])
+        known = set(self._keys) | set(self._globs) | set(self._includes)
+        for name in known.union(self._trees) - reachable:
+            self._forget(name)
+        return tree
+
+    def _forget(self, name: pathlib.Path) -> None:
+        """Drops what is known of the file name"""
+        self._keys.pop(name, None)
+        self._globs.pop(name, None)
+        self._includes.pop(name, None)
+        self._trees.pop(name, None)
+
+    def _key(self, name: pathlib.Path) -> tuple[t.Any, ...] | None:
+        try:
+            return self.cache.key(name)
+        except OSError:
+            return None
+
+    def _load_file(self, path: pathlib.Path) -> UnspacedList:
+        name = path.resolve()
+        tree = self._trees.get(name)
+        if tree is not None:
+            return tree
+        try:
+            return self._load_new(path, name)
+        except Exception:
+            # known by the key changed() tells when to try again with
+            self._forget(name)
+            self._failed[name] = self._key(name)
+            raise
+
+    def _load_new(self, path: pathlib.Path, name: pathlib.Path) -> UnspacedList:
+        conf = self.cache.load(name, engine=self.engine, packrat=self.packrat)
+        key = self.cache.key(name)
+        conf.insert(0, ["##", str(path)])
+        included: list[pathlib.Path] = []
+
+        def load_file(p: pathlib.Path) -> UnspacedList:
+            included.append(p)
+            return self._load_file(p)
+
+        tree = _expand_includes(conf, path, load_file)
+        # only files loaded with their includes are known, so that a file
+        # which failed is loaded again by the next load()
+        self._keys[name] = key
+        self._globs[name] = (path, _include_args(conf))
+        self._includes[name] = included
+        self._trees[name] = tree
+        self.rebuilt.append(name)
+        return tree
+
+
+def iterparse_path(
+    path: pathlib.Path = pathlib.Path("/etc/nginx/nginx.conf"),
+    follow_includes: bool = True,
+) -> t.Iterator[Event]:
+    """
+    Yields the parsing events of path like events.iterparse(), replacing
+    include directives with the events of the included files (which carry
+    their own path) when follow_includes is set
+    """
+    with path.open() as f:
+        for event in iterparse(f, path=path):
+            if follow_includes and event.type == DIRECTIVE and event.name == "include":
+                if len(event.args) != 1:
+                    raise ValueError(
+                        "Invalid number of arguments in include (line:%d, col:%d)"
+                        % (event.line, event.column)
+                    )
+                for p in _include_paths(path, event.args[0]):
+                    yield from iterparse_path(p)
+            else:
+                yield event
+
+
 def conf_apply_filter(
     conf: UnspacedList, func: t.Callable[[UnspacedList], UnspacedList]
 ) -> UnspacedList:
@@ -49,32 +709,147 @@ def conf_apply_filter(
     return res
 
 
-def conf_apply_opt_filter(
-    conf: UnspacedList,
-    func: t.Callable[
-        [_nginx_cmd_type, str | UnspacedList], _nginx_row_type | UnspacedList | None
-    ],
-    *opt_cmd: _nginx_cmd_type,
-) -> UnspacedList:
-    res = UnspacedList([])
-    for cmd, arg in conf:
-        if (
-            not opt_cmd
-            or cmd in opt_cmd
-            or (isinstance(cmd, list) and cmd[0] in opt_cmd)
-        ):
+_stage_func_type = t.Callable[
+    [_nginx_cmd_type, str | UnspacedList], _nginx_row_type | UnspacedList | None
+]
+
+
+def _cmd_matches(cmd: _nginx_cmd_type, opt_cmd: tuple[_nginx_cmd_type, ...]) -> bool:
+    return cmd in opt_cmd or (isinstance(cmd, list) and cmd[0] in opt_cmd)
+
+
+class Pipeline:
+    """
+    Filters and transforms fused into a single traversal of a tree.
+
+    Each stage is a function of (cmd, arg) returning the row to keep, None
+    to drop it or an UnspacedList of rows to put in its place, optionally
+    applied only to the commands in opt_cmd, like conf_apply_opt_filter().
+    Stages run in order on every row of every block, which gives the same
+    result as applying them one after the other to the whole tree: rows
+    put in place by a stage, and their blocks, only go through the stages
+    after it. Pipelines are immutable, adding a stage returns a new one.
+    """
+
+    def __init__(self, *stages: tuple[_stage_func_type, tuple[_nginx_cmd_type, ...]]):
+        self.stages = stages
+
+    def map(self, func: _stage_func_type, *opt_cmd: _nginx_cmd_type) -> "Pipeline":
+        return Pipeline(*self.stages, (func, opt_cmd))
+
+    def drop(self, *opt_cmd: _nginx_cmd_type) -> "Pipeline":
+        """Drops the commands and blocks listed, like filter_out()"""
+
+        def func(
+            cmd: _nginx_cmd_type, arg: str | UnspacedList
+        ) -> _nginx_row_type | UnspacedList | None:
+            return None if _cmd_matches(cmd, opt_cmd) else (cmd, arg)
+
+        return self.map(func)
+
+    def keep(self, *opt_cmd: _nginx_cmd_type) -> "Pipeline":
+        """Keeps only the commands and blocks listed, like filter_only()"""
+
+        def func(
+            cmd: _nginx_cmd_type, arg: str | UnspacedList
+        ) -> _nginx_row_type | UnspacedList | None:
+            return (cmd, arg) if _cmd_matches(cmd, opt_cmd) else None
+
+        return self.map(func)
+
+    def drop_comments(self, *opt_cmd: _nginx_cmd_type) -> "Pipeline":
+        """Drops comments and the commands listed, like filter_all_comments()"""
+
+        def func(
+            cmd: _nginx_cmd_type, arg: str | UnspacedList
+        ) -> _nginx_row_type | UnspacedList | None:
+            return None if cmd == "#" or cmd in opt_cmd else (cmd, arg)
+
+        return self.map(func)
+
+    def rows(
+        self, conf: t.Iterable[list], first: int = 0
+    ) -> t.Iterator[tuple[_nginx_cmd_type, str | UnspacedList, int]]:
+        """
+        Yields (cmd, arg, first stage for the block's body) for the rows of
+        conf going through the stages from first on
+        """
+        for row in conf:
+            # a directive without arguments has an empty value in the
+            # spaced tree the dumper writes
+            yield from self._run(row[0], row[1] if len(row) > 1 else "", first)
+
+    def _run(
+        self, cmd: _nginx_cmd_type, arg: str | UnspacedList, first: int
+    ) -> t.Iterator[tuple[_nginx_cmd_type, str | UnspacedList, int]]:
+        for i in range(first, len(self.stages)):
+            func, opt_cmd = self.stages[i]
+            if opt_cmd and not _cmd_matches(cmd, opt_cmd):
+                continue
             row = func(cmd, arg)
             if row is None:
-                continue
+                return
             if isinstance(row, UnspacedList):
-                res.extend(row)
-                continue
+                for sub in row:
+                    yield from self._run(sub[0], sub[1] if len(sub) > 1 else "", i + 1)
+                return
             cmd, arg = row
-        if isinstance(cmd, list):
-            res.append([cmd, conf_apply_opt_filter(arg, func, *opt_cmd)])
-        else:
-            res.append([cmd, arg])
-    return res
+        yield cmd, arg, first
+
+    def apply(self, conf: UnspacedList) -> UnspacedList:
+        """Returns the filtered tree, built in a single pass"""
+        with profiling.stage("filter"):
+            return self._apply(conf)
+
+    def _apply(self, conf: UnspacedList) -> UnspacedList:
+        root: list = []
+        stack = [(self.rows(conf), root)]
+        while stack:
+            rows, res = stack[-1]
+            for cmd, arg, first in rows:
+                if isinstance(cmd, list):
+                    # the arg of a block is its body
+                    assert not isinstance(arg, str)
+                    body: list = []
+                    res.append([list(cmd), body])
+                    stack.append((self.rows(arg, first), body))
+                    break
+                res.append([cmd, arg])
+            else:
+                stack.pop()
+        return UnspacedList.adopt(root)
+
+    def view(self, conf: UnspacedList) -> "FilterView":
+        """Returns a lazy view of the filtered tree, which NginxDumper can dump"""
+        return FilterView(self, conf)
+
+
+class FilterView:
+    """
+    The rows of a tree as filtered by a Pipeline, computed anew on every
+    iteration without copying the tree; block bodies are views as well
+    """
+
+    def __init__(self, pipeline: Pipeline, conf: t.Iterable[list], first: int = 0):
+        self.pipeline = pipeline
+        self.conf = conf
+        self.first = first
+
+    def __iter__(self) -> t.Iterator[list]:
+        for cmd, arg, first in self.pipeline.rows(self.conf, self.first):
+            if isinstance(cmd, list):
+                assert not isinstance(arg, str)
+                yield [cmd, FilterView(self.pipeline, arg, first)]
+            else:
+                yield [cmd, arg]
+
+
+def conf_apply_opt_filter(
+    conf: UnspacedList,
+    func: _stage_func_type,
+    *opt_cmd: _nginx_cmd_type,
+) -> UnspacedList:
+    return Pipeline().map(func, *opt_cmd).apply(conf)
 
 
 def filter_comments(conf: UnspacedList, *opt_cmd: _nginx_cmd_type) -> UnspacedList:
@@ -87,26 +862,12 @@ def filter_comments(conf: UnspacedList, *opt_cmd: _nginx_cmd_type) -> UnspacedLi
 
 
 def filter_all_comments(conf: UnspacedList, *opt_cmd: _nginx_cmd_type) -> UnspacedList:
-    return conf_apply_filter(conf, lambda c: filter_comments(c, *opt_cmd))
+    return Pipeline().drop_comments(*opt_cmd).apply(conf)
 
 
 def filter_out(conf: UnspacedList, *opt_cmd: _nginx_cmd_type) -> UnspacedList:
-    def func(
-        cmd: _nginx_cmd_type, arg: str | UnspacedList
-    ) -> _nginx_row_type | UnspacedList | None:
-        if cmd in opt_cmd or (isinstance(cmd, list) and cmd[0] in opt_cmd):
-            return None
-        return cmd, arg
-
-    return conf_apply_opt_filter(conf, func)
+    return Pipeline().drop(*opt_cmd).apply(conf)
 
 
 def filter_only(conf: UnspacedList, *opt_cmd: _nginx_cmd_type) -> UnspacedList:
-    def func(
-        cmd: _nginx_cmd_type, arg: str | UnspacedList
-    ) -> _nginx_row_type | UnspacedList | None:
-        if cmd in opt_cmd or (isinstance(cmd, list) and cmd[0] in opt_cmd):
-            return cmd, arg
-        return None
-
-    return conf_apply_opt_filter(conf, func)
+    return Pipeline().keep(*opt_cmd).apply(conf)
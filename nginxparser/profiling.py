@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Opt-in instrumentation of loading, filtering and dumping.
+
+While a :class:`Profile` is active, the parser, the dumper and
+:mod:`nginxparser.process` record into it the time spent in each stage
+(reading files, parsing, building UnspacedLists, resolving includes,
+filtering, dumping), a record for every parsed file (size, time,
+directives, blocks and includes) and counters such as cache hits::
+
+    >>> with Profile() as profile:
+    ...     dumps(process.load_path(path, engine="fast"))
+    >>> print(profile.report())
+    >>> profile.as_dict()  # the same, JSON serializable
+
+Profiles are activated per context (thread or task), and the hooks do
+nothing at all while none is active.
+"""
+
+import collections
+import contextlib
+import contextvars
+import time
+
+from .lazy import LazyBody
+
+_current = contextvars.ContextVar("nginxparser_profile", default=None)
+_NOT_PROFILED = contextlib.nullcontext()
+
+
+class Profile(object):
+    """
+    Time per stage, records per file and counters of a run.
+
+    callback, if given, is called as callback(kind, name, value) for every
+    measure as it is taken: kind "stage" with the seconds spent, "count"
+    with the increment and "file" with the record of the file.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = {}  # name -> [seconds, calls]
+        self.counts = collections.Counter()
+        self.files = {}  # path -> record
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_current.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._tokens.pop())
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times the body of the with statement as stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds, calls=1):
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+        if self.callback is not None:
+            self.callback("stage", name, seconds)
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+        if self.callback is not None:
+            self.callback("count", name, n)
+
+    def add_file(self, path, record):
+        """
+        Records a parsed file
+        :param str path:
+        :param dict record: size (bytes), seconds, directives, blocks and
+            includes of the file
+        """
+        self.files[str(path)] = record
+        if self.callback is not None:
+            self.callback("file", str(path), record)
+
+    def merge(self, data):
+        """
+        Adds the measures of another profile, as returned by its as_dict()
+        """
+        for name, entry in data["stages"].items():
+            self.add_stage(name, entry["seconds"], entry["calls"])
+        for name, n in data["counts"].items():
+            self.count(name, n)
+        for path, record in data["files"].items():
+            self.add_file(path, record)
+
+    def as_dict(self):
+        return {
+            "stages": {
+                name: {"seconds": seconds, "calls": calls}
+                for name, (seconds, calls) in self.stages.items()
+            },
+            "counts": dict(self.counts),
+            "files": dict(self.files),
+        }
+
+    def report(self):
+        """Returns the stages, counters and files as text tables, slowest first"""
+        lines = ["%-24s %10s %8s" % ("stage", "seconds", "calls")]
+        for name, (seconds, calls) in sorted(
+            self.stages.items(), key=lambda item: -item[1][0]
+        ):
+            lines.append("%-24s %10.4f %8d" % (name, seconds, calls))
+        if self.counts:
+            lines.append("")
+            lines.append("%-24s %10s" % ("counter", "count"))
+            for name, n in sorted(self.counts.items()):
+                lines.append("%-24s %10d" % (name, n))
+        if self.files:
+            lines.append("")
+            lines.append(
+                "%10s %10s %10s %8s %8s  %s"
+                % ("seconds", "bytes", "directives", "blocks", "includes", "file")
+            )
+            for path, record in sorted(
+                self.files.items(), key=lambda item: -item[1]["seconds"]
+            ):
+                lines.append(
+                    "%10.4f %10d %10d %8d %8d  %s"
+                    % (
+                        record["seconds"],
+                        record["size"],
+                        record["directives"],
+                        record["blocks"],
+                        record["includes"],
+                        path,
+                    )
+                )
+        return "\n".join(lines)
+
+
+def current():
+    """Returns the active Profile, or None"""
+    return _current.get()
+
+
+def stage(name):
+    """
+    Returns a context manager timing its body as stage name of the active
+    profile, if any
+    """
+    profile = _current.get()
+    if profile is None:
+        return _NOT_PROFILED
+    return profile.stage(name)
+
+
+def count(name, n=1):
+    profile = _current.get()
+    if profile is not None:
+        profile.count(name, n)
+
+
+def parsed_file(path, size, seconds, tree):
+    """
+    Records a file of size bytes parsed in seconds into tree, an
+    UnspacedList, in the active profile, if any; what is in innards the
+    lazy engine did not parse yet is not counted
+    """
+    profile = _current.get()
+    if profile is None:
+        return
+    directives = blocks = includes = 0
+    todo = [tree]
+    while todo:
+        for row in todo.pop():
+            if not row or row[0] == "#":
+                continue
+            if isinstance(row[0], list):
+                blocks += 1
+                if type(row[1].spaced) is not LazyBody:
+                    todo.append(row[1])
+            else:
+                directives += 1
+                includes += row[0] == "include"
+    profile.add_file(
+        path,
+        {
+            "size": size,
+            "seconds": seconds,
+            "directives": directives,
+            "blocks": blocks,
+            "includes": includes,
+        },
+    )
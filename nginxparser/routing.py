@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Request routing over parsed nginx configuration.
+
+:class:`RoutingIndex` is built once from a tree returned by ``loads()`` or
+``process.load_path()`` and answers which ``server`` and ``location`` a
+request is handled by, following nginx precedence:
+
+* the servers listening on the request's address and port are selected,
+  then the ``server_name`` matching the host: exact names first, then the
+  longest wildcard starting with ``*`` (or ``.``), the longest wildcard
+  ending with ``*``, the first matching regular expression and finally the
+  ``default_server`` of the listen address (or the first server on it);
+* within the server ``location = uri`` wins, otherwise the longest prefix
+  location is remembered and its nested locations searched the same way;
+  then unless it is ``^~`` the regular expression locations (``~`` and
+  ``~*``, in configuration order) of its level are checked before falling
+  back to it.
+
+Exact names and listen addresses are kept in dictionaries, wildcard names
+in label tries, prefix locations in character tries and regular
+expressions are compiled once.  Regular expressions using PCRE features
+Python does not support are skipped with a warning.
+"""
+
+import collections
+import logging
+import re
+import urllib.parse
+
+from .persistent import PersistentList
+
+logger = logging.getLogger(__name__)
+
+Route = collections.namedtuple("Route", "server location host uri")
+Route.__doc__ = """The result of routing a request.
+
+server and location are the ``[[name, args...], body]`` blocks of the
+tree handling the request, either may be None when nothing matches.  host
+and uri are the normalized values used for matching.
+"""
+
+DEFAULT_PORT = 80
+_PORTS = {"http": 80, "https": 443}
+# rows of compact trees are PersistentLists
+_LISTS = (list, PersistentList)
+_TERMINAL = None  # trie key of the entry ending at a node
+_PCRE_NAMED_GROUP = re.compile(r"\(\?<(?=[A-Za-z_])")
+_SLASHES = re.compile(r"/{2,}")
+
+
+def _regex(pattern, flags, where):
+    """
+    Compiles a PCRE pattern, returning None when Python cannot handle it
+    """
+    try:
+        return re.compile(_PCRE_NAMED_GROUP.sub("(?P<", pattern), flags)
+    except re.error as e:
+        logger.warning("Skipping %s %r: %s" % (where, pattern, e))
+        return None
+
+
+def _unquote(word):
+    if len(word) > 1 and word[0] == word[-1] and word[0] in "\"'":
+        return word[1:-1]
+    return word
+
+
+def _block(row):
+    """
+    Returns the name, argument words and body of a block row, or None
+    """
+    if (
+        isinstance(row, _LISTS)
+        and len(row) > 1
+        and isinstance(row[0], _LISTS)
+        and row[0]
+    ):
+        return row[0][0], row[0][1:], row[1]
+    return None
+
+
+def _directives(body, name):
+    """
+    Yields the argument words of the directives of body named name
+    """
+    for row in body:
+        if isinstance(row, _LISTS) and row and row[0] == name:
+            yield row[1].split() if len(row) > 1 else []
+
+
+def parse_listen(words):
+    """
+    Returns the (address, port, default) of a listen directive, address
+    being "*" for all addresses, or None for unix sockets
+    :param words: directive arguments
+    :return:
+    """
+    if not words or words[0].startswith("unix:"):
+        return None
+    address, port = words[0], DEFAULT_PORT
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        address = "[%s]" % host
+        if rest.startswith(":"):
+            port = int(rest[1:])
+    elif address.isdigit():
+        address, port = "*", int(address)
+    elif ":" in address:
+        address, _, port = address.rpartition(":")
+        port = int(port)
+    if address == "0.0.0.0":
+        address = "*"
+    default = "default_server" in words[1:] or "default" in words[1:]
+    return address.lower(), port, default
+
+
+class _LabelTrie(object):
+    """
+    Wildcard server names keyed by their fixed labels, matched longest first
+    """
+
+    __slots__ = ("root",)
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, labels, server):
+        node = self.root
+        for label in labels:
+            node = node.setdefault(label, {})
+        node.setdefault(_TERMINAL, server)
+
+    def longest(self, labels):
+        """
+        Returns the server of the longest entry matching labels while
+        leaving at least one label for the wildcard
+        """
+        node, found = self.root, None
+        for label in labels[:-1]:
+            node = node.get(label)
+            if node is None:
+                break
+            found = node.get(_TERMINAL, found)
+        return found
+
+
+class _ServerNames(object):
+    """
+    The servers listening on one address and port
+    """
+
+    __slots__ = ("exact", "head", "tail", "regexes", "default")
+
+    def __init__(self):
+        self.exact = {}
+        self.head = _LabelTrie()  # *.example.com, labels reversed
+        self.tail = _LabelTrie()  # www.example.*
+        self.regexes = []
+        self.default = None
+
+    def add(self, server, names, default):
+        if self.default is None or (default and not self.default[1]):
+            self.default = server, default
+        for name in names:
+            if name.startswith("~"):
+                regex = _regex(name[1:], re.IGNORECASE, "server_name")
+                if regex is not None:
+                    self.regexes.append((regex, server))
+                continue
+            name = name.lower()
+            if name.startswith("."):
+                self.exact.setdefault(name[1:], server)
+                self.head.add(name[1:].split(".")[::-1], server)
+            elif name.startswith("*."):
+                self.head.add(name[2:].split(".")[::-1], server)
+            elif name.endswith(".*"):
+                self.tail.add(name[:-2].split("."), server)
+            else:
+                self.exact.setdefault(name, server)
+
+    def find(self, host):
+        server = self.exact.get(host)
+        if server is not None:
+            return server
+        labels = host.split(".")
+        server = self.head.longest(labels[::-1]) or self.tail.longest(labels)
+        if server is not None:
+            return server
+        for regex, server in self.regexes:
+            if regex.search(host):
+                return server
+        return self.default[0]
+
+
+class _Locations(object):
+    """
+    The locations of a server or location block.  find() mirrors
+    ngx_http_core_find_location(): ^~ only skips the regular expressions of
+    its own level, those nested in the matching prefix location come first
+    """
+
+    __slots__ = ("exact", "prefixes", "regexes")
+
+    def __init__(self, body):
+        self.exact = {}
+        self.prefixes = {}  # character trie of (row, noregex, nested locations)
+        self.regexes = []
+        for row in body:
+            block = _block(row)
+            if block is None or block[0] != "location":
+                continue
+            words = [_unquote(word) for word in block[1]]
+            if len(words) == 1:
+                # modifiers may be written without a space: location =/x
+                word = words[0]
+                for modifier in ("^~", "~*", "=", "~"):
+                    if word.startswith(modifier) and len(word) > len(modifier):
+                        words = [modifier, word[len(modifier) :]]
+                        break
+            if len(words) == 1:
+                modifier, uri = "", words[0]
+            elif len(words) == 2:
+                modifier, uri = words
+            else:
+                continue
+            if uri.startswith("@"):
+                continue
+            nested = _Locations(block[2])
+            if modifier == "=":
+                self.exact.setdefault(uri, row)
+            elif modifier in ("", "^~"):
+                node = self.prefixes
+                for char in uri:
+                    node = node.setdefault(char, {})
+                node.setdefault(_TERMINAL, (row, modifier == "^~", nested))
+            elif modifier in ("~", "~*"):
+                flags = re.IGNORECASE if modifier == "~*" else 0
+                regex = _regex(uri, flags, "location")
+                if regex is not None:
+                    self.regexes.append((regex, row, nested))
+
+    def find(self, uri):
+        """
+        Returns the location row handling uri and whether the search is
+        over (exact or ^~ match), None when no location matches
+        """
+        row = self.exact.get(uri)
+        if row is not None:
+            return row, True
+        node, longest = self.prefixes, None
+        for char in uri:
+            node = node.get(char)
+            if node is None:
+                break
+            longest = node.get(_TERMINAL, longest)
+        found, noregex = None, False
+        if longest is not None:
+            row, noregex, nested = longest
+            # a matching nested location replaces the prefix one
+            found = nested.find(uri) or (row, False)
+            if found[1]:
+                return found
+        if not noregex:
+            for regex, row, nested in self.regexes:
+                if regex.search(uri):
+                    return (nested.find(uri) or (row,))[0], True
+        return found
+
+
+class RoutingIndex(object):
+    """
+    Server and location lookup tables built once from a parsed tree
+    """
+
+    def __init__(self, tree):
+        self.listens = {}  # (address, port) -> _ServerNames
+        self.locations = {}  # id(server row) -> _Locations
+        for server in self._servers(tree):
+            body = server[1]
+            names = [
+                _unquote(word)
+                for words in _directives(body, "server_name")
+                for word in words
+            ]
+            listens = [parse_listen(words) for words in _directives(body, "listen")]
+            for listen in listens or [("*", DEFAULT_PORT, False)]:
+                if listen is None:
+                    continue
+                address, port, default = listen
+                names_index = self.listens.setdefault((address, port), _ServerNames())
+                names_index.add(server, names or [""], default)
+            self.locations[id(server)] = _Locations(body)
+
+    @staticmethod
+    def _servers(tree):
+        for row in tree:
+            block = _block(row)
+            if block is None:
+                continue
+            if block[0] == "http":
+                for sub in block[2]:
+                    sub_block = _block(sub)
+                    if sub_block is not None and sub_block[0] == "server":
+                        yield sub
+            elif block[0] == "server":
+                yield row
+
+    def server(self, host, port=DEFAULT_PORT, address=None):
+        """
+        Returns the server block handling host on port
+        :param str host: Host header, a port suffix is ignored
+        :param int port: port the request arrived on
+        :param str address: address the request arrived on, by default the
+            servers listening on all addresses (or else the first address
+            listened on) are used
+        :return: server row or None
+        """
+        names = self.listens.get((address.lower(), port)) if address else None
+        if names is None:
+            names = self.listens.get(("*", port))
+        if names is None and not address:
+            # only servers listening on given addresses, assume the first one
+            names = next((v for (_, p), v in self.listens.items() if p == port), None)
+        if names is None:
+            return None
+        return names.find(normalize_host(host))
+
+    def location(self, server, uri):
+        """
+        Returns the location block of server handling uri, or None
+        """
+        found = self.locations[id(server)].find(normalize_uri(uri))
+        return found and found[0]
+
+    def route(self, host, uri, port=DEFAULT_PORT, address=None):
+        """
+        Routes a request
+        :return: :class:`Route`
+        """
+        server = self.server(host, port, address)
+        location = self.location(server, uri) if server is not None else None
+        return Route(server, location, normalize_host(host), normalize_uri(uri))
+
+    def route_url(self, url):
+        """
+        Routes a request for an URL such as http://example.com:8080/api
+        :return: :class:`Route`
+        """
+        return self.route(*split_url(url))
+
+    def route_many(self, urls):
+        """
+        Routes many URLs, resolving every host and port only once
+        :param urls: iterable of URLs
+        :return: generator of :class:`Route`
+        """
+        servers = {}
+        for url in urls:
+            host, uri, port = split_url(url)
+            if (host, port) not in servers:
+                servers[(host, port)] = self.server(host, port)
+            server = servers[(host, port)]
+            location = self.location(server, uri) if server is not None else None
+            yield Route(server, location, normalize_host(host), normalize_uri(uri))
+
+
+def normalize_host(host):
+    """
+    Lower cases host and strips its port and trailing dot
+    """
+    host = host.strip().lower()
+    if host.startswith("["):
+        host = host[: host.find("]") + 1]
+    else:
+        host = host.partition(":")[0]
+    return host.rstrip(".")
+
+
+def normalize_uri(uri):
+    """
+    Decodes uri and merges slashes, dropping the query string
+    """
+    path = urllib.parse.unquote(uri.partition("?")[0].partition("#")[0])
+    return _SLASHES.sub("/", path) or "/"
+
+
+def split_url(url):
+    """
+    Returns the host, uri and port of an URL, http being the default scheme
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = "http://" + url
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or _PORTS.get(parts.scheme.lower(), DEFAULT_PORT)
+    return parts.netloc.rpartition("@")[2], parts.path or "/", port
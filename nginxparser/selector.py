@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Path selectors over parsed nginx configuration.
+
+A selector is a list of steps separated by ``/`` (child) or ``//``
+(descendant at any depth), each step being a directive name or ``*``
+followed by optional predicates in brackets::
+
+    http/server[server_name~=example.com]//location[~ ^/api]/proxy_pass
+
+A predicate is either
+
+* ``[name OP value]``, true when a child directive or block ``name`` of
+  the step's block has a value (block arguments) satisfying OP;
+* ``[OP value]``, testing the step's own arguments the same way;
+* ``[text]``, true when the step's own arguments are ``text``.
+
+OP is one of ``=`` (equal), ``!=`` (not equal), ``~=`` (contains the
+whitespace separated word), ``*=`` (contains), ``^=`` (starts with) and
+``$=`` (ends with).  Values may be quoted, so ``["= /exact"]`` matches
+``location = /exact``.  Comparisons with ``=``, ``!=`` and ``[text]``
+ignore differences in whitespace.  A selector starting with ``//`` matches
+at any depth, otherwise the first step matches top level entries.
+
+Selectors are compiled once with :class:`Selector` and evaluated with
+:func:`select`, which runs any number of them in a single traversal of
+a tree returned by ``loads()`` or ``process.load_path()``.
+"""
+
+import collections
+import re
+
+from .persistent import PersistentList
+
+Match = collections.namedtuple("Match", "node parents")
+Match.__doc__ = """A selected entry.
+
+node is the matching ``[name, value]`` directive or ``[[name, args...],
+body]`` block of the tree and parents the tuple of its enclosing blocks,
+outermost first.
+"""
+
+# rows of compact trees are PersistentLists
+_LISTS = (list, PersistentList)
+_SEPARATOR = re.compile(r"//?")
+_NAME = re.compile(r"[^/\[\]\s]+")
+_QUOTED = re.compile(r""""(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'""")
+_CHILD_PREDICATE = re.compile(
+    r"(?P<name>[\w.:-]+)\s*(?P<op>[!~*^$]?=)\s*(?P<value>.*)$", re.DOTALL
+)
+_OWN_PREDICATE = re.compile(r"(?P<op>[!~*^$]?=)(?P<value>\S.*)$", re.DOTALL)
+
+
+def _words(value):
+    return " ".join(value.split())
+
+
+def _unquote(value):
+    value = value.strip()
+    if _QUOTED.fullmatch(value):
+        return re.sub(r"\\(.)", r"\1", value[1:-1])
+    return value
+
+
+_OPERATORS = {
+    "=": lambda value, expected: _words(value) == expected,
+    "!=": lambda value, expected: _words(value) != expected,
+    "~=": lambda value, expected: expected in value.split(),
+    "*=": lambda value, expected: expected in value,
+    "^=": lambda value, expected: value.startswith(expected),
+    "$=": lambda value, expected: value.endswith(expected),
+}
+
+
+class Step(object):
+    """
+    One step of a selector: a name, an axis and predicates
+    """
+
+    __slots__ = ("name", "descendant", "predicates")
+
+    def __init__(self, name, descendant=False, predicates=()):
+        self.name = name
+        self.descendant = descendant
+        self.predicates = tuple(predicates)
+
+    def matches(self, name, args, body, values=None):
+        """
+        Tests an entry of the tree against this step
+        :param name: directive name
+        :param args: directive value or block arguments
+        :param body: block body or None for directives
+        :param dict values: cache of the values of body's children by name,
+            shared by the steps tested against the same entry
+        :return: bool
+        """
+        if self.name != "*" and self.name != name:
+            return False
+        for child, test, expected in self.predicates:
+            if child is None:
+                if not test(args, expected):
+                    return False
+                continue
+            if body is None:
+                return False
+            if values is None:
+                values = {}
+            if child not in values:
+                values[child] = list(_values(body, child))
+            if not any(test(value, expected) for value in values[child]):
+                return False
+        return True
+
+    def __repr__(self):
+        return "Step(%r, descendant=%r, predicates=%d)" % (
+            self.name,
+            self.descendant,
+            len(self.predicates),
+        )
+
+
+class Selector(object):
+    """
+    A compiled selector
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.steps = _compile(text)
+
+    def select(self, tree):
+        """
+        Returns the matches of this selector in the tree
+        :param tree: parsed configuration
+        :return: list of :class:`Match`, in configuration order
+        """
+        return select(tree, [self])[0]
+
+    def __repr__(self):
+        return "Selector(%r)" % self.text
+
+
+def _compile(text):
+    """
+    Parses the selector text into a tuple of steps
+    :param text:
+    :return:
+    """
+    steps = []
+    pos = 0
+    descendant = False
+    if text.startswith("//"):
+        descendant, pos = True, 2
+    elif text.startswith("/"):
+        pos = 1
+    while True:
+        match = _NAME.match(text, pos)
+        if match is None:
+            raise ValueError("Name expected in selector %r (at char %d)" % (text, pos))
+        name = match.group()
+        pos = match.end()
+        predicates = []
+        while pos < len(text) and text[pos] == "[":
+            end = _predicate_end(text, pos)
+            predicates.append(_predicate(text[pos + 1 : end]))
+            pos = end + 1
+        steps.append(Step(name, descendant, predicates))
+        if pos == len(text):
+            return tuple(steps)
+        match = _SEPARATOR.match(text, pos)
+        if match is None:
+            raise ValueError("'/' expected in selector %r (at char %d)" % (text, pos))
+        descendant = match.group() == "//"
+        pos = match.end()
+
+
+def _predicate_end(text, pos):
+    """
+    Returns the position of the bracket closing the predicate at pos,
+    skipping quoted strings and nested brackets
+    """
+    depth = 0
+    while pos < len(text):
+        char = text[pos]
+        if char in "\"'":
+            match = _QUOTED.match(text, pos)
+            if match is None:
+                break
+            pos = match.end()
+            continue
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+            if not depth:
+                return pos
+        pos += 1
+    raise ValueError("Unterminated predicate in selector %r" % text)
+
+
+def _predicate(text):
+    """
+    Returns the (child name or None, test, expected value) of a predicate
+    """
+    match = _CHILD_PREDICATE.match(text.strip()) or _OWN_PREDICATE.match(text.strip())
+    if match is None:
+        return None, _OPERATORS["="], _words(_unquote(text))
+    op = match.group("op")
+    expected = _unquote(match.group("value"))
+    if op in ("=", "!="):
+        expected = _words(expected)
+    return match.groupdict().get("name"), _OPERATORS[op], expected
+
+
+def _entry(row):
+    """
+    Returns the name, arguments and body (None for directives) of a row
+    """
+    key = row[0]
+    if isinstance(key, _LISTS):
+        return key[0] if key else "", " ".join(key[1:]), row[1]
+    return key, row[1] if len(row) > 1 else "", None
+
+
+def _values(body, name):
+    """
+    Yields the values of the children of body named name
+    """
+    for row in body:
+        if isinstance(row, _LISTS) and row:
+            child, args, _ = _entry(row)
+            if child == name:
+                yield args
+
+
+def select(tree, selectors):
+    """
+    Evaluates several selectors in a single traversal of the tree.
+    :param tree: parsed configuration
+    :param selectors: :class:`Selector` instances or selector strings
+    :return: a list of :class:`Match` lists, one for each selector
+    """
+    steps = [
+        (selector if isinstance(selector, Selector) else Selector(selector)).steps
+        for selector in selectors
+    ]
+    results = [[] for _ in steps]
+    levels = {}
+
+    def level(states):
+        """
+        Groups the (selector, step) states active in a block by step name,
+        separating those carried to every nested block by a // axis
+        """
+        if states not in levels:
+            by_name = {}
+            for s, i in states:
+                by_name.setdefault(steps[s][i].name, []).append((s, i))
+            descendants = tuple((s, i) for s, i in states if steps[s][i].descendant)
+            levels[states] = by_name, descendants
+        return levels[states]
+
+    parents = []
+    # each level holds the rows left to visit and the states active for them
+    stack = [(iter(tree), level(tuple((s, 0) for s in range(len(steps)))))]
+    while stack:
+        rows, (by_name, descendants) = stack[-1]
+        row = next(rows, None)
+        if row is None:
+            stack.pop()
+            if parents:
+                parents.pop()
+            continue
+        if not isinstance(row, _LISTS) or not row or row[0] == "#":
+            continue
+
+        name, args, body = _entry(row)
+        child_states = dict.fromkeys(descendants) if body is not None else {}
+        values = {}
+        for candidates in (by_name.get(name), by_name.get("*")):
+            for s, i in candidates or ():
+                if steps[s][i].matches(name, args, body, values):
+                    if i + 1 == len(steps[s]):
+                        results[s].append(Match(row, tuple(parents)))
+                    elif body is not None:
+                        child_states[(s, i + 1)] = None
+        if child_states:
+            stack.append((iter(body), level(tuple(child_states))))
+            parents.append(row)
+    return results
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Parsed trees holding spans of the source instead of strings.
+
+:func:`load_spans` maps a file in memory and parses it into a
+:class:`SpanTree`, which keeps for every statement only offsets into the
+mapped bytes, in a few flat arrays: about 30 bytes per statement besides
+the file itself, which stays in the page cache.  Names, arguments and
+source text are decoded when a :class:`SpanNode` is asked for them, and
+line and column are computed from the offsets, so every node can tell
+exactly where it comes from::
+
+    >>> with load_spans("/etc/nginx/nginx.conf") as tree:
+    ...     for node in tree.walk():
+    ...         if node.name == "proxy_pass":
+    ...             print(node.line, node.column, node.args)
+
+Statements are split like :func:`nginxparser.events.iterparse` does:
+words are whitespace separated with quoted strings and ``${var}`` kept
+whole, quotes included.  Whitespace is not part of the tree; the source
+text of any node is.
+"""
+
+import array
+import bisect
+import mmap
+import re
+
+from .events import COMMENT, DIRECTIVE
+
+BLOCK = "block"
+_KINDS = [DIRECTIVE, BLOCK, COMMENT]
+_DIRECTIVE, _BLOCK, _COMMENT = range(3)
+
+_TOKEN = re.compile(
+    rb"""
+    (?P<space>\s+)
+    |(?P<comment>\#[^\n]*)
+    |(?P<punct>[{};])
+    |(?P<word>(?:[^\s{};"'$]+|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|\$\{[^}\s;]*\}|\$)+)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+# the words of arguments, skipping comments written between them
+_WORD = re.compile(
+    r"""\#[^\n]*|((?:[^\s"'$]+|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|\$\{[^}\s;]*\}|\$)+)""",
+    re.DOTALL,
+)
+
+
+class SpanTree(object):
+    """
+    The statements of a source buffer (bytes or mmap of UTF-8 text) in
+    document order.  For statement i, kinds[i] is its type, starts[i] and
+    ends[i] delimit its source (up to the closing brace for blocks),
+    name_ends[i] ends its name, args_starts[i] and args_ends[i] delimit its
+    arguments, skips[i] is the index following its subtree and parents[i]
+    is one more than the index of its block (0 at the top level).
+    """
+
+    def __init__(self, buffer):
+        """
+        :param buffer: bytes, or an mmap which the tree then owns
+        :raises ValueError: if the source cannot be parsed, with the line
+            and column of the problem
+        """
+        self.buffer = buffer
+        typecode = "I" if len(buffer) < 2**32 else "Q"
+        self.kinds = array.array("B")
+        self.starts = array.array(typecode)
+        self.ends = array.array(typecode)
+        self.name_ends = array.array(typecode)
+        self.args_starts = array.array(typecode)
+        self.args_ends = array.array(typecode)
+        self.skips = array.array(typecode)
+        self.parents = array.array(typecode)
+        self._lines = None
+        self._parse()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmaps the source, if it is mapped; nodes cannot be read anymore"""
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __iter__(self):
+        """Yields the top level nodes"""
+        return self._children(0, len(self.kinds))
+
+    def node(self, index):
+        """Returns statement number index, in document order"""
+        if not 0 <= index < len(self.kinds):
+            raise IndexError("statement index out of range")
+        return SpanNode(self, index)
+
+    def walk(self):
+        """Yields every node, in document order"""
+        for index in range(len(self.kinds)):
+            yield SpanNode(self, index)
+
+    def _children(self, index, end):
+        skips = self.skips
+        while index < end:
+            yield SpanNode(self, index)
+            index = skips[index]
+
+    def text(self, start, end):
+        return str(self.buffer[start:end], "utf-8")
+
+    def position(self, offset):
+        """Returns the line and column, counted from 1, of a byte offset"""
+        if self._lines is None:
+            # offsets where lines start, built on first use
+            lines = array.array(self.starts.typecode, [0])
+            find = self.buffer.find
+            found = find(b"\n")
+            while found >= 0:
+                lines.append(found + 1)
+                found = find(b"\n", found + 1)
+            self._lines = lines
+        line = bisect.bisect_right(self._lines, offset)
+        line_start = self._lines[line - 1]
+        return line, len(self.text(line_start, offset)) + 1
+
+    def _fail(self, message, offset):
+        raise ValueError("%s (line:%d, col:%d)" % ((message,) + self.position(offset)))
+
+    def _add(self, kind, start, name_end, args_start, args_end, end, parent):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.name_ends.append(name_end)
+        self.args_starts.append(args_start)
+        self.args_ends.append(args_end)
+        self.ends.append(end)
+        self.skips.append(len(self.kinds))
+        self.parents.append(parent)
+
+    def _parse(self):
+        buffer = self.buffer
+        size = len(buffer)
+        match_token = _TOKEN.match
+        blocks = []  # indexes of the open blocks
+        parent = 0
+        # the statement being read: its start, name end and arguments span
+        start = name_end = args_start = args_end = None
+        pos = 0
+        while pos < size:
+            match = match_token(buffer, pos)
+            if match is None:
+                self._fail("Unterminated quoted string", pos)
+            kind = match.lastgroup
+            token_start, pos = match.span()
+            if kind == "space":
+                continue
+            if kind == "word":
+                if start is None:
+                    start = token_start
+                    name_end = args_start = args_end = pos
+                else:
+                    if args_start == name_end:
+                        args_start = token_start
+                    args_end = pos
+                continue
+            if kind == "comment":
+                # a comment may come in the middle of a statement
+                text_start = token_start + 1
+                self._add(
+                    _COMMENT, token_start, text_start, text_start, pos, pos, parent
+                )
+                continue
+            char = buffer[token_start:pos]
+            if char == b"}":
+                if start is not None:
+                    self._fail("Unexpected '}' in unterminated statement", token_start)
+                if not blocks:
+                    self._fail("Unexpected '}'", token_start)
+                index = blocks.pop()
+                self.ends[index] = pos
+                self.skips[index] = len(self.kinds)
+                parent = self.parents[index]
+                continue
+            if start is None:
+                self._fail("Unexpected %r" % char.decode(), token_start)
+            if char == b";":
+                self._add(
+                    _DIRECTIVE, start, name_end, args_start, args_end, pos, parent
+                )
+            else:
+                index = len(self.kinds)
+                self._add(_BLOCK, start, name_end, args_start, args_end, pos, parent)
+                blocks.append(index)
+                parent = index + 1
+            start = None
+        if start is not None:
+            self._fail("Unexpected end of file, expecting ';' or '{'", start)
+        if blocks:
+            self._fail("Unexpected end of file, expecting '}'", size)
+
+
+class SpanNode(object):
+    """
+    A statement of a SpanTree: a directive, a block or a comment.  Nodes
+    are light views created on access; two nodes are equal when they stand
+    for the same statement of the same tree.
+    """
+
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other):
+        if not isinstance(other, SpanNode):
+            return NotImplemented
+        return self.tree is other.tree and self.index == other.index
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        return res if res is NotImplemented else not res
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self):
+        return "<SpanNode %s %r at %d:%d>" % (
+            (self.type, self.name) + self.tree.position(self.span[0])
+        )
+
+    @property
+    def type(self):
+        """ "directive", "block" or "comment\" """
+        return _KINDS[self.tree.kinds[self.index]]
+
+    @property
+    def span(self):
+        """The (start, end) byte offsets of the statement in the source"""
+        return self.tree.starts[self.index], self.tree.ends[self.index]
+
+    @property
+    def name(self):
+        """The directive or block name, "#" for comments"""
+        return self.tree.text(
+            self.tree.starts[self.index], self.tree.name_ends[self.index]
+        )
+
+    @property
+    def value(self):
+        """The arguments as written, the text after "#" for comments"""
+        return self.tree.text(
+            self.tree.args_starts[self.index], self.tree.args_ends[self.index]
+        )
+
+    @property
+    def args(self):
+        """The tuple of arguments (quotes kept), the text after "#" for comments"""
+        if self.tree.kinds[self.index] == _COMMENT:
+            return (self.value,)
+        return tuple(word for word in _WORD.findall(self.value) if word)
+
+    @property
+    def text(self):
+        """The source of the statement, the whole block for blocks"""
+        return self.tree.text(*self.span)
+
+    @property
+    def line(self):
+        return self.tree.position(self.tree.starts[self.index])[0]
+
+    @property
+    def column(self):
+        return self.tree.position(self.tree.starts[self.index])[1]
+
+    @property
+    def end_line(self):
+        """The line of the last character of the statement"""
+        return self.tree.position(self.tree.ends[self.index] - 1)[0]
+
+    @property
+    def parent(self):
+        """The enclosing block, None at the top level"""
+        parent = self.tree.parents[self.index]
+        return SpanNode(self.tree, parent - 1) if parent else None
+
+    @property
+    def children(self):
+        """The statements of a block, an empty list for other nodes"""
+        return list(self)
+
+    def __iter__(self):
+        tree = self.tree
+        return tree._children(self.index + 1, tree.skips[self.index])
+
+
+def loads_spans(source):
+    """Parses from a string or bytes.
+
+    :param source: The text to parse, str or UTF-8 encoded bytes
+    :rtype: SpanTree
+
+    """
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    return SpanTree(source)
+
+
+def load_spans(path):
+    """Parses a file, mapping it in memory instead of reading it.
+
+    The tree holds the mapping until it is closed, which a with statement
+    does on exit.
+
+    :param path: The path of the file to parse
+    :rtype: SpanTree
+
+    """
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            buffer = f.read()
+    try:
+        return SpanTree(buffer)
+    except ValueError:
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+        raise
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Writing back edited configuration with the original text kept.
+
+A :class:`Document` parses a file remembering where every row and every
+block's innards are in the source.  Its tree is an ordinary
+:class:`UnspacedList` to edit; :meth:`Document.dumps` then copies the
+source of every subtree that is not dirty as it is, and renders again only
+the rows which were changed or added, so the result differs from the
+original file by the edits alone::
+
+    >>> document = load_document("/etc/nginx/sites-enabled/default")
+    >>> for row in document.tree[0][1]:
+    ...     if row[0] == "listen":
+    ...         row[1] = "8080"
+    >>> document.write()  # atomically replaces the file
+
+Comments, blank lines and the layout of untouched rows stay as written;
+changed rows are rendered by :class:`NginxDumper` with the indentation of
+their neighbours.
+"""
+
+import os
+import pathlib
+import re
+
+from . import profiling
+from .fastparser import FastNginxParser
+from .nginxparser import NginxDumper, UnspacedList
+
+_LEAD = re.compile(r"[ \t\r\n]*")
+_INDENT = re.compile(r"[ \t]*")
+
+
+class _RecordingParser(FastNginxParser):
+    """
+    A FastNginxParser recording in spans, by the id of every row and block
+    innards list, (the list, start, end, trailing whitespace) of its source
+    """
+
+    def __init__(self, source):
+        super(_RecordingParser, self).__init__(source)
+        self.spans = {}
+
+    def _record(self, pos, parsed):
+        if parsed is not None:
+            item = parsed[1]
+            self.spans[id(item)] = (item, pos, parsed[0], "")
+        return parsed
+
+    def _script_item(self, pos):
+        return self._record(pos, FastNginxParser._script_item(self, pos))
+
+    def _block_item(self, pos):
+        return self._record(pos, FastNginxParser._block_item(self, pos))
+
+    def _comment(self, pos):
+        return self._record(pos, FastNginxParser._comment(self, pos))
+
+    def _map_entry(self, pos):
+        return self._record(pos, FastNginxParser._map_entry(self, pos))
+
+    def _map_block(self, pos):
+        parsed = FastNginxParser._map_block(self, pos)
+        if parsed is not None:
+            # no brace comes before the one opening the innards
+            innards = parsed[1][1]
+            start = self.source.index("{", pos) + 1
+            self.spans[id(innards)] = (innards, start, parsed[0] - 1, _tail(innards))
+        return parsed
+
+    def _body(self, pos):
+        end, innards = FastNginxParser._body(self, pos)
+        self.spans[id(innards)] = (innards, pos, end, _tail(innards))
+        return end, innards
+
+
+def _tail(spaced):
+    """The whitespace ending a freshly parsed list"""
+    return spaced[-1] if spaced and isinstance(spaced[-1], str) else ""
+
+
+def _stripped(spaced):
+    """
+    Returns a spaced row without its whitespace entries, for NginxDumper
+    to lay it out (empty values are kept, the dumper needs them)
+    """
+    res = []
+    for entry in spaced:
+        if isinstance(entry, list):
+            res.append(_stripped(entry))
+        elif not entry.isspace() or (res and res[-1] == "#"):
+            res.append(entry)
+    return res
+
+
+class Document(object):
+    """
+    A configuration file parsed with the fast engine, with its source.
+    tree is the UnspacedList to edit; rows added to it are indented with
+    the rows around them, or indentation more spaces than their block.
+    """
+
+    def __init__(self, source, path=None, indentation=4):
+        """
+        :param str source: The text to parse
+        :param path: Where write() writes by default
+        :param int indentation: Spaces per level for blocks without rows
+            to take it from
+        :raises ValueError: if the source cannot be parsed
+        """
+        parser = _RecordingParser(source)
+        with profiling.stage("parse"):
+            tree = parser.as_list()
+        self.source = source
+        self.path = path
+        self.indentation = indentation
+        # rendered rows end their lines like the source
+        self.newline = "\r\n" if "\r\n" in source else "\n"
+        self._spans = parser.spans
+        self._spans[id(tree)] = (tree, 0, len(source), _tail(tree))
+        with profiling.stage("tree"):
+            self.tree = UnspacedList.adopt(tree)
+
+    def dumps(self):
+        """Returns the source with the changes made to tree"""
+        with profiling.stage("dump"):
+            tree = self.tree
+            if tree.dirty or id(tree.spaced) not in self._spans:
+                return self._list(tree, None)
+            edits = []
+            self._changes(tree, edits)
+            return self._apply(0, len(self.source), edits)
+
+    def write(self, path=None):
+        """
+        Writes dumps() to path, by default the file it was loaded from,
+        atomically: into a temporary file of the same directory, which is
+        then renamed over path with its permissions
+        """
+        path = pathlib.Path(path if path is not None else self.path)
+        text = self.dumps()
+        tmp = path.with_name("%s.%d.tmp" % (path.name, os.getpid()))
+        try:
+            with tmp.open("w", newline="") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            if path.exists():
+                os.chmod(tmp, path.stat().st_mode & 0o7777)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            raise
+
+    def _changes(self, rows, edits):
+        """
+        Adds to edits the (start, end, text) replacements of the source of
+        the changed rows of rows, a list which is not dirty itself
+        """
+        row_changes = self._row_changes
+        for row in rows:
+            # the dirty flags are all there is to read for most rows
+            if row.dirty or isinstance(row[0], list):
+                row_changes(row, edits)
+
+    def _row_changes(self, row, edits):
+        """Adds to edits the replacements of the changed parts of a row"""
+        head = row[0]
+        if not (row.dirty or isinstance(head, list)):
+            return
+        innards = None if row.dirty else row[1]
+        if innards is not None and not (head.dirty or innards.dirty):
+            self._changes(innards, edits)
+            return
+        _, start, end, _ = self._spans[id(row.spaced)]
+        innards_span = None
+        if innards is not None:
+            innards_span = self._spans.get(id(innards.spaced))
+        if innards_span is None:
+            lead = _LEAD.match(self.source, start).group()
+            edits.append((start, end, lead + self._render(row, self._indent_at(start))))
+            return
+        _, innards_start, innards_end, _ = innards_span
+        if head.dirty:
+            lead = _LEAD.match(self.source, start).group()
+            edits.append((start, innards_start, lead + " ".join(head) + " {"))
+        if innards.dirty:
+            text = self._list(innards, self._indent_at(start))
+            edits.append((innards_start, innards_end, text))
+        else:
+            self._changes(innards, edits)
+
+    def _apply(self, start, end, edits):
+        """Returns the source from start to end with edits made, in order"""
+        if not edits:
+            return self.source[start:end]
+        parts = []
+        for edit_start, edit_end, text in edits:
+            parts.append(self.source[start:edit_start])
+            parts.append(text)
+            start = edit_end
+        parts.append(self.source[start:end])
+        return "".join(parts)
+
+    def _list(self, rows, parent_indent):
+        """
+        Returns the text of an UnspacedList of rows which changed as a
+        whole (block innards, or the tree when parent_indent is None)
+        """
+        span = self._spans.get(id(rows.spaced))
+        indent = self._indent(rows, parent_indent)
+        parts = []
+        for row in rows:
+            row_span = self._spans.get(id(row.spaced))
+            if row_span is None:
+                parts.append(self.newline + indent + self._render(row, indent))
+                continue
+            edits = []
+            self._row_changes(row, edits)
+            parts.append(self._apply(row_span[1], row_span[2], edits))
+        if parent_indent is None:
+            tail = span[3] if span is not None else self.newline
+        elif span is None or "\n" not in span[3]:
+            # the closing brace goes on a line of its own
+            tail = self.newline + parent_indent
+        else:
+            tail = span[3]
+        parts.append(tail)
+        return "".join(parts)
+
+    def _render(self, row, indent):
+        lines = NginxDumper([_stripped(row.spaced)], self.indentation)
+        return (self.newline + indent).join(lines)
+
+    def _indent(self, rows, parent_indent):
+        """The indentation of rows, taken from the first one on its own line"""
+        for row in rows:
+            span = self._spans.get(id(row.spaced))
+            if span is not None and "\n" in _LEAD.match(self.source, span[1]).group():
+                return self._indent_at(span[1])
+        if parent_indent is None:
+            return ""
+        return parent_indent + " " * self.indentation
+
+    def _indent_at(self, pos):
+        """The indentation of the line where the row at pos starts"""
+        first = _LEAD.match(self.source, pos).end()
+        line = self.source.rfind("\n", 0, first) + 1
+        return _INDENT.match(self.source, line).group()
+
+
+def loads_document(source, indentation=4):
+    """Parses from a string.
+
+    :param str source: The string to parse
+    :param int indentation: See Document
+    :rtype: Document
+
+    """
+    return Document(source, indentation=indentation)
+
+
+def load_document(path, indentation=4):
+    """Parses a file, which Document.write() then writes by default.
+
+    :param path: The path of the file to parse
+    :param int indentation: See Document
+    :rtype: Document
+
+    """
+    with profiling.stage("read"), open(path, newline="") as f:
+        source = f.read()
+    return Document(source, path, indentation)
@@ -0,0 +1,91 @@
+"""Differential tests of the parser engines.
+
+Every engine must give the pyparsing grammar's tree, whitespace included,
+and so the same dumps(), for generated configs and for edge cases; input
+the grammar rejects must be rejected by every engine.
+"""
+import pathlib
+import sys
+
+import pyparsing
+import pytest
+
+from nginxparser.nginxparser import ENGINES, dumps, loads
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "benchmarks"))
+from generator import generate  # noqa: E402
+
+OTHER_ENGINES = sorted(engine for engine in ENGINES if engine != "pyparsing")
+
+EDGE_CASES = {
+    "directive": "user www-data;\n",
+    "no trailing newline": "worker_processes 4;",
+    "empty value": "break ;\n",
+    "comment only": "# nothing here\n",
+    "comment after directive": "user www; # the user\n",
+    "comment ending a block": "http {\n    gzip on;\n    # last\n}\n",
+    "empty block": "events {\n}\n",
+    "nested blocks": "http {\n  server {\n    location / {\n      root /srv;\n    }\n  }\n}\n",
+    "location modifiers": "server {\n  location = /a { }\n  location ~* \\.png$ { }\n"
+    + "  location ^~ /s { }\n  location ~ ^/x { }\n}\n",
+    "if": "server {\n  if ($request_method !~ ^(GET|HEAD)$) {\n    return 405;\n  }\n}\n",
+    "top level if quoting a brace": 'if ($x ~ "{") {\n  return 403;\n}\nuser www;\n',
+    "quoted semicolons": "log_format main '$remote_addr; \"$request\"';\n",
+    "quoted braces": 'add_header X-Test "a { b }";\n',
+    "shell variables": "set $a ${b}c;\n",
+    "map": "map $http_upgrade $connection_upgrade {\n  default upgrade;\n"
+    + "  \"\" close;\n  '~x' y;\n  # comment\n}\n",
+    "charset_map": "charset_map koi8-r utf-8 {\n  C0 D18E;\n}\n",
+    "tabs": "http {\n\tserver {\n\t\tlisten\t80;\n\t}\n}\n",
+    "crlf": "http {\r\n  gzip on;\r\n}\r\n",
+    "non ascii": 'add_header X-Name "été";\n',
+    "value over lines": "proxy_set_header\n    Host\n    $host;\n",
+    "blank lines": "\n\nuser www;\n\n\nevents {\n\n}\n\n",
+}
+
+INVALID = {
+    "directive after map": "map $a $b {\n  default 0;\n}\nuser www;\n",
+    "empty directive": "server {\n  listen 80;;\n}\n",
+    "unclosed block": "http {\n  gzip on;\n",
+    "empty": "",
+}
+
+GENERATED = {}
+for seed in range(4):
+    GENERATED["generated seed %d" % seed] = generate(
+        servers=4, depth=3, map_entries=10, comments=0.3, seed=seed
+    )
+
+
+def parsed(source, engine):
+    """Returns the tree, its spaced view and dumps(), every block parsed"""
+    tree = loads(source, engine=engine)
+    text = dumps(tree)
+    return tree, tree.spaced, text
+
+
+@pytest.mark.parametrize("engine", OTHER_ENGINES)
+@pytest.mark.parametrize(
+    "source",
+    list(EDGE_CASES.values()) + list(GENERATED.values()),
+    ids=list(EDGE_CASES) + list(GENERATED),
+)
+def test_same_tree(source, engine):
+    tree, spaced, text = parsed(source, engine)
+    expected_tree, expected_spaced, expected_text = parsed(source, "pyparsing")
+    assert tree == expected_tree
+    assert spaced == expected_spaced
+    assert text == expected_text
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+@pytest.mark.parametrize("source", list(INVALID.values()), ids=list(INVALID))
+def test_same_errors(source, engine):
+    with pytest.raises((ValueError, pyparsing.ParseException)):
+        parsed(source, engine)
+
+
+@pytest.mark.parametrize("source", list(EDGE_CASES.values()), ids=list(EDGE_CASES))
+def test_packrat_same_tree(source):
+    tree = loads(source, packrat=1000)
+    assert tree.spaced == loads(source).spaced
@@ -0,0 +1,40 @@
+"""Tests of event parsing: events must not depend on how input is read."""
+import io
+import pathlib
+
+import pytest
+
+from nginxparser.events import iterparse
+from nginxparser.process import iterparse_path
+
+SOURCES = [
+    'server_name"x;{y}";\n',
+    "set $a ${var}b;\n",
+    "set $a $ {v};\n",
+    "log_format main '$remote_addr \\'x\\' \"$request\"';\n",
+    "http {\n  # comment\n  server { listen 80; }\n}\n",
+    'add_header X "a\nb";\n',
+    'unterminated "quote;\n',
+    "a ${v b;\n",
+]
+
+
+def events(source, chunk_size):
+    try:
+        return list(iterparse(io.StringIO(source), chunk_size=chunk_size))
+    except ValueError as e:
+        return str(e)
+
+
+@pytest.mark.parametrize("source", SOURCES)
+def test_chunk_size(source):
+    expected = events(source, 65536)
+    for chunk_size in range(1, len(source) + 1):
+        assert events(source, chunk_size) == expected, chunk_size
+
+
+def test_include_without_argument(tmp_path: pathlib.Path):
+    path = tmp_path / "nginx.conf"
+    path.write_text("http {\n    include;\n}\n")
+    with pytest.raises(ValueError, match="line:2, col:5"):
+        list(iterparse_path(path))
@@ -0,0 +1,78 @@
+"""Tests of IncrementalLoader: reloading only what changed."""
+import os
+import pathlib
+
+import pytest
+
+from nginxparser.nginxparser import dumps
+from nginxparser.process import IncrementalLoader, load_path
+
+
+def write(path: pathlib.Path, text: str):
+    """Writes text to path with a later mtime than it had"""
+    mtime = path.stat().st_mtime_ns if path.exists() else 0
+    path.write_text(text)
+    os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+
+@pytest.fixture
+def conf(tmp_path: pathlib.Path) -> pathlib.Path:
+    """nginx.conf including a.conf and b.conf"""
+    write(tmp_path / "a.conf", "server {\n    listen 80;\n}\n")
+    write(tmp_path / "b.conf", "server {\n    listen 81;\n}\n")
+    write(
+        tmp_path / "nginx.conf",
+        "http {\n    include %s;\n    include %s;\n}\n"
+        % (tmp_path / "a.conf", tmp_path / "b.conf"),
+    )
+    return tmp_path / "nginx.conf"
+
+
+def loader_of(path: pathlib.Path) -> IncrementalLoader:
+    return IncrementalLoader(path, engine="fast")
+
+
+def test_edit_rebuilds_the_file_and_its_parents(conf: pathlib.Path):
+    loader = loader_of(conf)
+    loader.load()
+    a = conf.parent / "a.conf"
+    write(a, "server {\n    listen 8080;\n}\n")
+    assert loader.changed() == {a.resolve()}
+    tree = loader.load()
+    assert set(loader.rebuilt) == {a.resolve(), conf.resolve()}
+    assert dumps(tree) == dumps(load_path(conf, engine="fast"))
+    loader.load()
+    assert loader.rebuilt == []
+
+
+def test_dropped_include_is_forgotten(conf: pathlib.Path):
+    loader = loader_of(conf)
+    loader.load()
+    b = conf.parent / "b.conf"
+    write(conf, "http {\n    include %s;\n}\n" % (conf.parent / "a.conf"))
+    tree = loader.load()
+    assert b.resolve() not in loader._trees
+    assert b.resolve() not in loader._keys
+    assert dumps(tree) == dumps(load_path(conf, engine="fast"))
+    # changes to a file no longer included are not looked at
+    write(b, "server {\n    listen 9;\n}\n")
+    assert loader.changed() == set()
+
+
+def test_recovers_from_a_broken_file(conf: pathlib.Path):
+    loader = loader_of(conf)
+    loader.load()
+    a = conf.parent / "a.conf"
+    write(a, "server {\n    listen 80;\n")
+    with pytest.raises(ValueError):
+        loader.load()
+    # nothing to do until the file changes again
+    assert loader.changed() == set()
+    with pytest.raises(ValueError):
+        loader.load()
+    write(a, "server {\n    listen 8081;\n}\n")
+    assert loader.changed() == {a.resolve()}
+    tree = loader.load()
+    assert a.resolve() in loader.rebuilt
+    assert (conf.parent / "b.conf").resolve() not in loader.rebuilt
+    assert dumps(tree) == dumps(load_path(conf, engine="fast"))
@@ -0,0 +1,57 @@
+"""Tests of lazy trees: block innards must look parsed to every consumer."""
+import copy
+import pickle
+
+import pytest
+
+from nginxparser.nginxparser import LazyUnspacedList, UnspacedList, dumps, loads
+
+SOURCE = "http {\n  server {\n    listen 80;\n  }\n  # gzip off;\n}\n"
+
+
+def lazy_innards():
+    innards = loads(SOURCE, engine="lazy")[0][1]
+    assert type(innards) is LazyUnspacedList
+    return innards
+
+
+EXPECTED = loads(SOURCE)[0][1]
+
+
+@pytest.mark.parametrize(
+    "add",
+    [
+        lambda lazy: [] + lazy,
+        lambda lazy: sum([lazy], []),
+        lambda lazy: UnspacedList([]) + lazy,
+        lambda lazy: lazy + [],
+    ],
+    ids=["radd", "sum", "unspaced radd", "add"],
+)
+def test_add(add):
+    assert add(lazy_innards()) == list(EXPECTED)
+
+
+def test_add_other_types():
+    with pytest.raises(TypeError):
+        1 + lazy_innards()
+
+
+@pytest.mark.parametrize("protocol", range(pickle.HIGHEST_PROTOCOL + 1))
+def test_pickle(protocol):
+    innards = pickle.loads(pickle.dumps(lazy_innards(), protocol))
+    assert type(innards) is UnspacedList
+    assert innards == EXPECTED
+    assert innards.spaced == EXPECTED.spaced
+
+    tree = pickle.loads(pickle.dumps(loads(SOURCE, engine="lazy"), protocol))
+    assert dumps(tree) == dumps(loads(SOURCE))
+    expected = loads(SOURCE)
+    for edited in tree, expected:
+        edited[0][1].append(["gzip", "on"])
+    assert dumps(tree) == dumps(expected)
+
+
+def test_copy():
+    assert copy.copy(lazy_innards()) == EXPECTED
+    assert copy.deepcopy(lazy_innards()).spaced == EXPECTED.spaced